@@ -3,6 +3,7 @@
     data from the model_api.
 """
 import os
+import time
 import pandas as pd
 
 from langdetect import detect
@@ -18,6 +19,27 @@ MODEL_API_PORT = os.environ.get(ENVIRONMENT_VARIABLE_MODEL_API_PORT)
 
 URL_OF_MODEL_API = "http://model_api:" + MODEL_API_PORT
 
+# Seconds to wait for the model_api to load its models before a build starts
+ENVIRONMENT_VARIABLE_MODEL_API_READY_TIMEOUT = "MODEL_API_READY_TIMEOUT"
+MODEL_API_READY_TIMEOUT = float(os.environ.get(
+    ENVIRONMENT_VARIABLE_MODEL_API_READY_TIMEOUT, 600))
+
+# Number of times a request rejected by an overloaded model_api is retried
+ENVIRONMENT_VARIABLE_MODEL_API_MAX_RETRIES = "MODEL_API_MAX_RETRIES"
+MODEL_API_MAX_RETRIES = int(os.environ.get(
+    ENVIRONMENT_VARIABLE_MODEL_API_MAX_RETRIES, 20))
+
+# Builds are served after interactive requests by the model_api
+REQUEST_HEADERS = {"X-Priority": "bulk"}
+
+# Seconds to wait before a retry if the model_api doesn't say how long
+DEFAULT_RETRY_AFTER = 5
+
+# Number of abstracts sent to the model_api in one request
+ENVIRONMENT_VARIABLE_EXTRACTION_BATCH_SIZE = "EXTRACTION_BATCH_SIZE"
+EXTRACTION_BATCH_SIZE = int(os.environ.get(
+    ENVIRONMENT_VARIABLE_EXTRACTION_BATCH_SIZE, 16))
+
 # Path to existing csv file with data for the database
 ENVIRONMENT_VARIABLE_CSV_FILE = "PATH_TO_CSV"
 PATH_TO_FILE = os.environ.get(ENVIRONMENT_VARIABLE_CSV_FILE)
@@ -33,20 +55,94 @@ PATH_TO_DB = os.environ.get(ENVIRONMENT_VARIABLE_DB_FILE)
 DEFAULT_STATUS = "Unvalidated"
 
 
-def get_request_from_api(endpoint: str):
-    """ This function sends a get request to the
-    model_api and returns the response as json
+def get_retry_after(response: requests.Response) -> float:
+    """Returns the seconds the model_api asks the client to wait before
+    sending a rejected request again.
+
+    Args:
+        response (requests.Response): A response with status code 429
+
+    Returns:
+        float: Seconds from the Retry-After header or DEFAULT_RETRY_AFTER
+    """
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def post_request_to_api(endpoint: str, payload: dict,
+                        max_retries: int = MODEL_API_MAX_RETRIES):
+    """ This function sends a post request with a json body
+    to the model_api and returns the response as json. Requests the
+    model_api rejects because it is overloaded (429) are sent again
+    after the time it asks for.
 
     Args:
-        endpoint (str): The endpoint of the model_api 
+        endpoint (str): The endpoint of the model_api
+        payload (dict): The json body of the request
+        max_retries (int): Maximum number of retries of a rejected request
 
     Returns:
         json: The response of the model_api
     """
-    response = requests.get(URL_OF_MODEL_API + endpoint)
+    for attempt in range(max_retries + 1):
+        response = requests.post(URL_OF_MODEL_API + endpoint, json=payload,
+                                 headers=REQUEST_HEADERS)
+        if response.status_code != 429 or attempt == max_retries:
+            break
+        retry_after = get_retry_after(response)
+        print(f"model_api is overloaded, retrying in {retry_after}s")
+        time.sleep(retry_after)
+    response.raise_for_status()
     return response.json()
 
 
+def get_competencies_from_api(model: str, abstracts: list) -> list:
+    """Extracts the competencies of several abstracts together with the
+    category of each competency with one request to the model_api.
+
+    Args:
+        model (str): Model which should be used to get the
+        competencies, consult model_endpoint.py for accepted models
+        abstracts (list): Abstracts in text format
+
+    Returns:
+        list: [[[competency, relevancy, category_id], ...], ...]
+              in the order of abstracts
+    """
+    if not abstracts:
+        return []
+    return post_request_to_api("/extract_and_categorize",
+                               {"model": model.lower(),
+                                "abstracts": abstracts})
+
+
+def wait_for_model_api(timeout: float = MODEL_API_READY_TIMEOUT,
+                       poll_interval: float = 5):
+    """Blocks until the model_api reports that its models are loaded.
+
+    Args:
+        timeout (float): Maximum number of seconds to wait
+        poll_interval (float): Seconds between two readiness checks
+
+    Raises:
+        TimeoutError: If the model_api is not ready after timeout seconds
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if requests.get(URL_OF_MODEL_API + "/ready").status_code == 200:
+                return
+        except requests.exceptions.ConnectionError:
+            # model_api is not up yet
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("model_api is not ready after "
+                               f"{timeout} seconds")
+        time.sleep(poll_interval)
+
+
 def get_df_from_csv(path_to_file: str) -> pd.DataFrame:
     """Returns a dataframe from a csv file.
 
@@ -162,7 +258,9 @@ def get_entries_from_row(row: pd.Series):
     Returns:
         tuple: tuple of the Values mentioned above
     """    
-    abstract_content = string_formatter.format_for_api_request(row.loc["Abstract"])
+    # The abstract is sent to the model_api in a json body,
+    # so it doesn't need to be escaped
+    abstract_content = row.loc["Abstract"]
     abstract_title = row.loc["Title"]
     doctype = row.loc["Doc-Type"]
     authors = string_formatter.format_authors(row.loc["Authors"])
@@ -192,20 +290,19 @@ def add_competency_to_db(conn, competency: list, competency_ids: dict,
 
     Args:
         conn (Connection): Connection to the database
-        competency (list): List of to containing the competency itself and its
+        competency (list): List containing the competency itself, its
                            relevancy (=/= ranking; generated by model)
+                           and the id of its category
         competency_ids (dict): dict storing each id too its competency
         abstract_id (int): id of the abstract containing the competency
     """    
     competency_name = competency[0]
     relevancy = competency[1]
+    category_id = competency[2]
 
     # get or create new id for competency
     competency_ids[competency_name] = adapter.get_or_generate_competency_id_by_name(
         conn, competency_name)
-    # get category of competency from model_api
-    category_id = get_request_from_api(
-        "/get_category_of_competency/" + string_formatter.format_for_api_request(competency_name))
     adapter.insert_derived_from(conn, competency_ids[competency_name],
                                 abstract_id=abstract_id,
                                 relevancy=relevancy)
@@ -239,15 +336,48 @@ def add_author_to_db(conn, author: str, abstract_id: int, competency_ids: dict):
                                       status=DEFAULT_STATUS)   
 
 
+def add_abstract_to_db(conn, entries: tuple, competencies: list):
+    """Adds an abstract to the db including its competencies and authors.
+
+    Args:
+        conn (Connection): Connection to the database
+        entries (tuple): Values of the abstract as returned by
+                         get_entries_from_row
+        competencies (list): List of competencies of the abstract in the
+                             form [[competency, relevancy, category_id], ...]
+    """
+    (abstract_content, abstract_title, doctype, authors, year,
+     institution) = entries
+    abstract_id = adapter.get_first_available_abstract_id(conn)
+
+    competency_ids = {}
+    for competency in competencies:
+        add_competency_to_db(conn=conn, competency=competency,
+                             competency_ids=competency_ids,
+                             abstract_id=abstract_id)
+
+    for author in authors:
+        add_author_to_db(conn=conn, author=author,
+                         abstract_id=abstract_id,
+                         competency_ids=competency_ids)
+
+    adapter.insert_abstract(conn,
+                            (abstract_id, year, abstract_title,
+                             abstract_content, doctype, institution))
+
+
 def fill_database(df, model: str, path_to_db: str):
     """Fills the database with the data from a given dataframe.
+    The abstracts are sent to the model_api in batches of
+    EXTRACTION_BATCH_SIZE.
 
     Args:
         df (DataFrame): DataFrame with data for the database.
+        model (str): Model which should be used to get the
+        competencies, consult model_endpoint.py for accepted models
         path_to_db (str): Path to Database which should be filled 
     """
     df = filter_rows_with_nan_values(df=df)
-    COMPETENCY_ENDPOINT = ENDPOINT.get_endpoint(model)
 
     conn = adapter.create_connection_to(path_to_db=path_to_db)
 
@@ -257,34 +387,32 @@ def fill_database(df, model: str, path_to_db: str):
     database_info_handler.increase_abstract_count(db_name=db_name,
                                                   add_count=total_number_of_abstracts)
     try:
-        # This loop iterates the rows and stores calls the inserting functions
-        for index, row in df.iterrows():
-            database_info_handler.increase_build_status(db_name=db_name,
-                                                        add_count=1)
+        if ENDPOINT.get_endpoint(model) is None:
+            raise ValueError(f"Unknown model: {model}")
+
+        # Don't start before the models of the model_api are loaded
+        wait_for_model_api()
+
+        # This loop iterates the rows batchwise and calls the inserting
+        # functions for each abstract of the batch
+        for start in range(0, total_number_of_abstracts,
+                           EXTRACTION_BATCH_SIZE):
+            rows = df.iloc[start:start + EXTRACTION_BATCH_SIZE]
+            entries = [get_entries_from_row(row=row)
+                       for _, row in rows.iterrows()]
 
-            abstract_content, abstract_title, doctype, authors, year, institution = get_entries_from_row(row=row)
             # We focus on english abstracts
-            if not is_english(abstract_content):
-                continue
-
-            abstract_id = adapter.get_first_available_abstract_id(conn)
-            competencies = get_request_from_api(
-                COMPETENCY_ENDPOINT + abstract_content)
-            
-            competency_ids = {}
-            for competency in competencies:
-                add_competency_to_db(conn=conn, competency=competency,
-                                     competency_ids=competency_ids,
-                                     abstract_id=abstract_id)
-
-            for author in authors:
-                add_author_to_db(conn=conn, author=author,
-                                 abstract_id=abstract_id,
-                                 competency_ids=competency_ids)
-
-            adapter.insert_abstract(conn,
-                                    (abstract_id, year, abstract_title,
-                                        abstract_content, doctype, institution))
+            entries = [entry for entry in entries if is_english(entry[0])]
+
+            competencies_per_abstract = get_competencies_from_api(
+                model=model, abstracts=[entry[0] for entry in entries])
+
+            for entry, competencies in zip(entries, competencies_per_abstract):
+                add_abstract_to_db(conn=conn, entries=entry,
+                                   competencies=competencies)
+
+            database_info_handler.increase_build_status(
+                db_name=db_name, add_count=rows.shape[0])
     except Exception as e:
         # Filling db has stopped
         print(e)
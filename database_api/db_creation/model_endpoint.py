@@ -11,6 +11,8 @@ class ENDPOINT(enum.Enum):
     BLOOM = "/ask_bloom/"
     GALACTICA = "/ask_galactica/"
     GPT_NEO = "/ask_gpt_neo/"
+    # Deterministic competencies without a language model, for testing
+    SYNTHETIC = "/ask_synthetic/"
 
     @classmethod
     def get_endpoint(cls, name):
@@ -0,0 +1,303 @@
+"""
+This module benchmarks the extractors of models.py on a fixed sample of
+abstracts from a csv file in the format database_from_csv consumes. Every
+extractor is run with several batch sizes and thread counts and the
+latency, throughput, memory and load time are written to json.
+Two result files can be compared to catch performance regressions.
+
+    python benchmark.py run abstracts.csv --models keybert,bloom \
+        --batch-sizes 1,8,16 --threads 1,4 --output results.json
+    python benchmark.py compare baseline.json results.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import psutil
+import torch
+
+import phrase_cache
+from model_registry import MEGABYTE, registry
+from models import BATCH_EXTRACTORS, ENCODER_BACKEND
+
+# Relative change of a metric that counts as a regression
+DEFAULT_THRESHOLD = 0.1
+
+# Metrics that are compared and whether a higher value is better. The
+# peak of the process is not compared, it includes the models benchmarked
+# before.
+COMPARED_METRICS = {"p50_seconds": False,
+                    "p95_seconds": False,
+                    "abstracts_per_second": True,
+                    "model_memory_mb": False,
+                    "rss_growth_mb": False}
+
+
+def load_sample(path_to_csv: str, sample_size: int, seed: int) -> list:
+    """Draws a reproducible sample of abstracts from a csv file.
+
+    Args:
+        path_to_csv (str): Path to a csv file with an "Abstract" column
+        sample_size (int): Number of abstracts in the sample
+        seed (int): Seed of the random sample
+
+    Returns:
+        list: The abstracts
+    """
+    abstracts = pd.read_csv(path_to_csv)["Abstract"].dropna().tolist()
+    if sample_size >= len(abstracts):
+        return abstracts
+    return random.Random(seed).sample(abstracts, sample_size)
+
+
+def _get_rss_mb() -> float:
+    return round(psutil.Process().memory_info().rss / MEGABYTE, 1)
+
+
+def _get_peak_rss_mb() -> float:
+    # The peak of the whole process so far, so it includes the models
+    # benchmarked before. ru_maxrss is given in kilobytes on Linux and
+    # in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+@contextlib.contextmanager
+def _empty_phrase_cache():
+    """Points the phrase caches to an empty temporary directory, so a run
+    neither reuses the phrase embeddings of earlier runs nor stores its own.
+    """
+    directory = phrase_cache.PHRASE_CACHE_DIR
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        phrase_cache.PHRASE_CACHE_DIR = temporary_directory
+        phrase_cache.forget_phrase_caches()
+        try:
+            yield
+        finally:
+            phrase_cache.PHRASE_CACHE_DIR = directory
+            phrase_cache.forget_phrase_caches()
+
+
+def benchmark_model(model: str, abstracts: list, batch_size: int,
+                    threads: int, parameters: dict) -> dict:
+    """Runs the extractor of a model over the abstracts in batches and
+    measures the latency of every batch.
+
+    Args:
+        model (str): Name of the model, one of BATCH_EXTRACTORS
+        abstracts (list): Abstracts in text format
+        batch_size (int): Number of abstracts in one call of the extractor
+        threads (int): Number of threads torch may use
+        parameters (dict): Further parameters of the extractor
+
+    Returns:
+        dict: latencies, throughput and memory growth of the run
+    """
+    torch.set_num_threads(threads)
+    extractor = BATCH_EXTRACTORS[model]
+    batches = [abstracts[start:start + batch_size]
+               for start in range(0, len(abstracts), batch_size)]
+
+    # The first call allocates buffers that later calls reuse
+    with _empty_phrase_cache():
+        extractor(batches[0], batch_size=batch_size, **parameters)
+
+    # Every run starts with an empty phrase cache, so the results don't
+    # depend on the runs before
+    latencies = []
+    rss_before = _get_rss_mb()
+    with _empty_phrase_cache():
+        start = time.perf_counter()
+        for batch in batches:
+            batch_start = time.perf_counter()
+            extractor(batch, batch_size=batch_size, **parameters)
+            latencies.append(time.perf_counter() - batch_start)
+        total_seconds = time.perf_counter() - start
+        # Measured before the phrase cache of the run is dropped
+        rss_growth = max(0.0, _get_rss_mb() - rss_before)
+
+    return {"model": model,
+            "batch_size": batch_size,
+            "threads": threads,
+            "batches": len(batches),
+            "p50_seconds": float(np.percentile(latencies, 50)),
+            "p95_seconds": float(np.percentile(latencies, 95)),
+            "abstracts_per_second": len(abstracts) / total_seconds,
+            "rss_growth_mb": round(rss_growth, 1),
+            "peak_rss_mb": _get_peak_rss_mb()}
+
+
+def run(path_to_csv: str, models: list, batch_sizes: list, threads: list,
+        sample_size: int, seed: int, parameters: dict) -> dict:
+    """Benchmarks every combination of model, batch size and thread count.
+
+    Args:
+        path_to_csv (str): Path to a csv file with an "Abstract" column
+        models (list): Names of the models
+        batch_sizes (list): Batch sizes to test
+        threads (list): Thread counts to test
+        sample_size (int): Number of abstracts in the sample
+        seed (int): Seed of the random sample
+        parameters (dict): Further parameters of the extractor by model
+
+    Returns:
+        dict: The configuration of the benchmark and its results
+    """
+    abstracts = load_sample(path_to_csv, sample_size, seed)
+    results = []
+    load_seconds = {}
+
+    for model in models:
+        start = time.perf_counter()
+        registry.get(model)
+        load_seconds[model] = time.perf_counter() - start
+        # The growth of the process while the model was loaded
+        model_memory = registry.memory_bytes(
+            model, registry.default_version(model)) or 0
+        print(f"Loaded {model} in {load_seconds[model]:.1f}s")
+
+        for batch_size in batch_sizes:
+            for thread_count in threads:
+                result = benchmark_model(model, abstracts, batch_size,
+                                         thread_count,
+                                         parameters.get(model, {}))
+                result["load_seconds"] = load_seconds[model]
+                result["model_memory_mb"] = round(model_memory / MEGABYTE, 1)
+                results.append(result)
+                print(f"{model} batch size {batch_size}, {thread_count} "
+                      f"threads: p50 {result['p50_seconds']:.3f}s, "
+                      f"p95 {result['p95_seconds']:.3f}s, "
+                      f"{result['abstracts_per_second']:.2f} abstracts/s")
+
+    return {"created": datetime.datetime.now().isoformat(),
+            "csv": os.path.basename(path_to_csv),
+            "sample_size": len(abstracts),
+            "seed": seed,
+            "parameters": parameters,
+            "environment": {"python": platform.python_version(),
+                            "torch": torch.__version__,
+                            "cpu_count": os.cpu_count(),
+                            "encoder_backend": ENCODER_BACKEND},
+            "results": results}
+
+
+def compare(baseline: dict, candidate: dict,
+            threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Compares the results of two benchmark runs.
+
+    Args:
+        baseline (dict): Results of the reference run
+        candidate (dict): Results of the new run
+        threshold (float): Relative change that counts as a regression
+
+    Returns:
+        list: One dict per metric of every run present in both results
+              with the old and new value, the relative change and
+              whether it is a regression
+    """
+    def key(result):
+        return result["model"], result["batch_size"], result["threads"]
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    comparison = []
+    for result in candidate["results"]:
+        if key(result) not in baseline_results:
+            continue
+        old = baseline_results[key(result)]
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            # Results of older runs may lack a metric
+            if not old.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            worse = -change if higher_is_better else change
+            comparison.append({"model": result["model"],
+                               "batch_size": result["batch_size"],
+                               "threads": result["threads"],
+                               "metric": metric,
+                               "baseline": old[metric],
+                               "candidate": result[metric],
+                               "change": change,
+                               "regression": worse > threshold})
+    return comparison
+
+
+def _split_integers(text: str) -> list:
+    return [int(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the extractors of the model_api.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmark")
+    run_parser.add_argument("csv", help="csv file with an Abstract column")
+    run_parser.add_argument("--models", default="keybert",
+                            help="comma separated models, one of "
+                                 f"{', '.join(BATCH_EXTRACTORS)}")
+    run_parser.add_argument("--batch-sizes", default="1,8,16")
+    run_parser.add_argument("--threads", default=str(os.cpu_count() or 1))
+    run_parser.add_argument("--sample-size", type=int, default=64)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--parameters", default="{}",
+                            help="json object of extractor parameters "
+                                 "by model")
+    run_parser.add_argument("--output", default="benchmark.json")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float,
+                                default=DEFAULT_THRESHOLD,
+                                help="relative change counted as regression")
+    arguments = parser.parse_args()
+
+    if arguments.command == "run":
+        models = [model.strip() for model in arguments.models.split(",")]
+        for model in models:
+            if model not in BATCH_EXTRACTORS:
+                parser.error(f"Unknown model: {model}")
+        results = run(arguments.csv, models,
+                      _split_integers(arguments.batch_sizes),
+                      _split_integers(arguments.threads),
+                      arguments.sample_size, arguments.seed,
+                      json.loads(arguments.parameters))
+        with open(arguments.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {arguments.output}")
+        return
+
+    with open(arguments.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(arguments.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    comparison = compare(baseline, candidate, arguments.threshold)
+    for row in comparison:
+        marker = "REGRESSION" if row["regression"] else ""
+        print(f"{row['model']:<10} bs {row['batch_size']:<3} "
+              f"threads {row['threads']:<3} {row['metric']:<21} "
+              f"{row['baseline']:>10.3f} -> {row['candidate']:>10.3f} "
+              f"({row['change']:+.1%}) {marker}")
+
+    # A non-zero exit code lets CI fail on regressions
+    if any(row["regression"] for row in comparison):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+This module splits abstracts that are longer than a model can process into
+overlapping chunks of tokens. The competencies of all chunks are extracted
+in one batch and merged per abstract afterwards, so the work per abstract
+is bounded and nothing is truncated silently.
+"""
+
+# Default maximum number of abstract tokens passed to a model at once
+DEFAULT_MAX_CHUNK_TOKENS = 384
+
+# Default number of tokens consecutive chunks share, so competencies at
+# the border of a chunk are not cut in half
+DEFAULT_CHUNK_OVERLAP = 64
+
+# Context length assumed if the model's configuration doesn't state one
+DEFAULT_CONTEXT_LENGTH = 2048
+
+
+class ChunkSizeError(ValueError):
+    """Raised when no token of an abstract fits into the model's input,
+    e.g. because the requested generation takes the whole context.
+    """
+
+
+def get_context_length(model) -> int:
+    """Returns the maximum number of tokens a model can attend to.
+
+    Args:
+        model (PreTrainedModel): A transformers model
+
+    Returns:
+        int: The context length
+    """
+    config = model.config
+    for attribute in ("max_position_embeddings", "n_positions"):
+        if getattr(config, attribute, None):
+            return getattr(config, attribute)
+    return DEFAULT_CONTEXT_LENGTH
+
+
+def _split_tokens(tokenizer, text: str, input_ids: list, max_tokens: int,
+                  overlap: int) -> list:
+    step = max(1, max_tokens - overlap)
+    starts = range(0, max(1, len(input_ids) - overlap), step)
+
+    # Fast tokenizers know where each token is in the text, so the chunks
+    # are cut from the original text instead of being decoded
+    if getattr(tokenizer, "is_fast", False):
+        offsets = tokenizer(text, add_special_tokens=False,
+                            return_offsets_mapping=True)["offset_mapping"]
+        return [text[offsets[start][0]:
+                     offsets[min(start + max_tokens, len(offsets)) - 1][1]]
+                for start in starts]
+    return [tokenizer.decode(input_ids[start:start + max_tokens])
+            for start in starts]
+
+
+def split_abstracts(tokenizer, abstracts: list, max_tokens: int,
+                    overlap: int = DEFAULT_CHUNK_OVERLAP):
+    """Splits every abstract with more than max_tokens tokens into
+    overlapping chunks. Shorter abstracts are kept as they are.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): Tokenizer of the model
+        abstracts (list): Abstracts in text format
+        max_tokens (int): Maximum number of tokens of a chunk
+        overlap (int): Number of tokens consecutive chunks share, at most
+                       half of max_tokens
+
+    Raises:
+        ChunkSizeError: If max_tokens is not positive
+
+    Returns:
+        tuple: (chunks, index of the abstract of each chunk)
+    """
+    if max_tokens <= 0:
+        raise ChunkSizeError(f"The chunk size must be positive, but only "
+                             f"{max_tokens} tokens of the abstract fit into "
+                             f"the model's input")
+    # Small models leave room for few tokens, every chunk has to advance
+    overlap = max(0, min(overlap, max_tokens // 2))
+
+    input_ids = tokenizer(list(abstracts),
+                          add_special_tokens=False)["input_ids"]
+    chunks = []
+    owners = []
+    for index, (abstract, ids) in enumerate(zip(abstracts, input_ids)):
+        if len(ids) <= max_tokens:
+            parts = [abstract]
+        else:
+            parts = _split_tokens(tokenizer, abstract, ids, max_tokens,
+                                  overlap)
+        chunks.extend(parts)
+        owners.extend([index] * len(parts))
+    return chunks, owners
+
+
+def merge_chunk_results(results: list, owners: list,
+                        number_of_abstracts: int) -> list:
+    """Merges the competencies extracted from the chunks of each abstract.
+    A competency found in several chunks keeps its highest relevancy.
+
+    Args:
+        results (list): [[(competency, relevancy), ...], ...] per chunk
+        owners (list): Index of the abstract of each chunk
+        number_of_abstracts (int): Number of abstracts that were split
+
+    Returns:
+        list: [[(competency, relevancy), ...], ...] per abstract
+    """
+    merged = [{} for _ in range(number_of_abstracts)]
+    chunk_counts = [0] * number_of_abstracts
+    for owner, competencies in zip(owners, results):
+        chunk_counts[owner] += 1
+        for competency, relevancy in competencies:
+            if relevancy > merged[owner].get(competency, relevancy - 1):
+                merged[owner][competency] = relevancy
+
+    # Abstracts of one chunk keep the order the model returned. The sort
+    # is stable, so competencies without relevancy (-1) keep their order.
+    return [list(competencies.items()) if count <= 1
+            else sorted(competencies.items(), key=lambda item: item[1],
+                        reverse=True)
+            for competencies, count in zip(merged, chunk_counts)]
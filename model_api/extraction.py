@@ -0,0 +1,301 @@
+"""
+This module connects the extraction endpoints to the models. Results are
+looked up in the extraction cache first and only the abstracts that are
+not cached yet are passed to the inference scheduler. Abstracts that
+another request is extracting already wait for that extraction instead.
+Single abstracts can also be streamed, which bypasses the batching but
+not the admission of the scheduler. Models without a neural network are
+called directly. Model functions that are not batched are admitted by
+the scheduler as well.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from extraction_cache import cache, make_key
+from model_registry import registry
+from models import (BATCH_CATEGORIZERS, BATCH_EXTRACTORS,
+                    get_cache_version, get_categories_of_competencies)
+from scheduler import scheduler
+from single_flight import in_flight
+
+# Parameters that change how, but not what is extracted. The model
+# version is part of the key on its own.
+PARAMETERS_NOT_IN_KEY = ("batch_size", "model_version")
+
+# Models that are cheaper than a cache lookup. They bypass the cache, the
+# scheduler and the inference pool, so they don't evict cached results.
+INLINE_MODELS = ("synthetic",)
+
+
+def get_cache_keys(model: str, abstracts: list, parameters: dict) -> list:
+    """Returns the cache key of each abstract.
+
+    Args:
+        model (str): Name of the model
+        abstracts (list): Abstracts in text format
+        parameters (dict): Parameters of the extraction
+
+    Returns:
+        list: Cache keys in the order of abstracts
+    """
+    model_version = parameters.get("model_version",
+                                   registry.default_version(model))
+    # Results of an onnx or quantized encoder differ slightly from torch
+    cache_version = get_cache_version(model, model_version)
+    key_parameters = {name: value for name, value in parameters.items()
+                      if name not in PARAMETERS_NOT_IN_KEY}
+    return [make_key(model, cache_version, key_parameters, abstract)
+            for abstract in abstracts]
+
+
+def _lookup(model: str, abstracts: list, parameters: dict):
+    keys = get_cache_keys(model, abstracts, parameters)
+    results = cache.get_many(keys)
+
+    # The same abstract may appear several times in one batch
+    missing = {}
+    for key, abstract in zip(keys, abstracts):
+        if key not in results:
+            missing[key] = abstract
+    return keys, results, missing
+
+
+def _finish(model: str, keys: list, futures: list):
+    results = {}
+    errors = {}
+    for key, future in zip(keys, futures):
+        try:
+            results[key] = future.result()
+        except Exception as error:
+            # Includes futures that were cancelled
+            errors[key] = error
+
+    # The results are cached before the waiting requests are released,
+    # so a request arriving in between finds them in the cache
+    try:
+        cache.put_many(results)
+    finally:
+        for key in keys:
+            # A failing key must not keep the others in flight
+            try:
+                in_flight.finish(model, key, results.get(key),
+                                 errors.get(key))
+            except Exception as error:
+                print(f"Finishing the extraction of {key} failed: {error}")
+
+
+def _finish_when_done(model: str, keys: list, futures: list):
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        _finish(model, keys, futures)
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def _first_result(future: Future) -> Future:
+    # The batch function returns a list with the result of one abstract
+    first = Future()
+
+    def done(_):
+        try:
+            first.set_result(future.result()[0])
+        except Exception as error:
+            first.set_exception(error)
+
+    future.add_done_callback(done)
+    return first
+
+
+def _start(model: str, missing: dict, parameters: dict) -> list:
+    """Queues the missing abstracts that no other request is extracting.
+
+    Args:
+        model (str): Name of the model
+        missing (dict): {cache key: abstract} of the abstracts to extract
+        parameters (dict): Parameters of the extraction
+
+    Raises:
+        SchedulerOverloadedError: If the queue of the model is full
+
+    Returns:
+        list: A Future for the result of each abstract in missing
+    """
+    futures, started = in_flight.join(model, list(missing))
+    if started:
+        try:
+            computing = scheduler.submit(
+                model, [missing[key] for key in started], parameters)
+        except Exception as error:
+            # Requests waiting for these abstracts fail the same way
+            for key in started:
+                in_flight.finish(model, key, error=error)
+            raise
+        _finish_when_done(model, started, computing)
+    return [futures[key] for key in missing]
+
+
+async def call_async(model: str, function, *args, **kwargs):
+    """Runs a model function that is not batched, e.g. a summary, once the
+    scheduler admitted it, without blocking the event loop.
+
+    Args:
+        model (str): Name of the model the function uses
+        function (callable): The model function
+        *args: Positional arguments of the function
+        **kwargs: Keyword arguments of the function
+
+    Returns:
+        The result of the function
+    """
+    return await asyncio.wrap_future(
+        scheduler.call(model, function, *args, **kwargs))
+
+
+async def extract_async(model: str, abstracts: list,
+                        parameters: dict = None) -> list:
+    """Extracts competencies from abstracts with the given model.
+    Cached results are returned without running the model, the
+    scheduler is awaited without blocking the event loop.
+
+    Args:
+        model (str): Name of the model, one of BATCH_EXTRACTORS
+        abstracts (list): Abstracts in text format
+        parameters (dict, optional): Parameters passed on to the model's
+                                     batch extraction function
+
+    Returns:
+        list: [[(competency, score), ...], ...] in the order of abstracts
+    """
+    if model in INLINE_MODELS:
+        return BATCH_EXTRACTORS[model](abstracts, **(parameters or {}))
+
+    parameters = parameters or {}
+    # A swapped version is unloaded once the requests pinned to it are
+    # done. The served version may be swapped while the abstracts are
+    # queued, so they are extracted with the version their cache keys are
+    # made of.
+    with registry.use(model, parameters.get("model_version")) as version:
+        parameters = {**parameters, "model_version": version}
+        keys, results, missing = _lookup(model, abstracts, parameters)
+
+        if missing:
+            futures = _start(model, missing, parameters)
+            computed = await asyncio.gather(*[asyncio.wrap_future(future)
+                                              for future in futures])
+            results.update(zip(missing, computed))
+
+    return [results[key] for key in keys]
+
+
+async def stream_extraction(model: str, abstract: str,
+                            parameters: dict = None):
+    """Extracts competencies from an abstract and yields each competency
+    as soon as the model generated it. A cached result is yielded at once.
+
+    Args:
+        model (str): Name of the model, one of STREAMING_MODELS
+        abstract (str): Abstract in text format
+        parameters (dict, optional): Parameters passed on to the model's
+                                     batch extraction function
+
+    Yields:
+        tuple: (competency, score)
+    """
+    parameters = parameters or {}
+    started = None
+    with registry.use(model, parameters.get("model_version")) as version:
+        parameters = {**parameters, "model_version": version}
+        keys, results, missing = _lookup(model, [abstract], parameters)
+        if missing:
+            futures, started = in_flight.join(model, keys)
+        if started:
+            # The version is used until the model is done, even if the
+            # client disconnects before
+            registry.acquire(model, version)
+
+    if not missing:
+        for competency in results[keys[0]]:
+            yield competency
+        return
+
+    # Another request is extracting the abstract already, its
+    # competencies are yielded once it is done
+    if not started:
+        for competency in await asyncio.wrap_future(futures[keys[0]]):
+            yield competency
+        return
+
+    # The model runs in the inference pool and hands every competency
+    # to the event loop through the queue, None marks the end
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def on_competency(index: int, competency: tuple):
+        loop.call_soon_threadsafe(queue.put_nowait, competency)
+
+    try:
+        future = scheduler.call(model, BATCH_EXTRACTORS[model], [abstract],
+                                on_competency=on_competency, **parameters)
+    except Exception as error:
+        registry.release(model, parameters["model_version"])
+        # Requests waiting for this abstract fail the same way
+        in_flight.finish(model, keys[0], error=error)
+        raise
+    future.add_done_callback(
+        lambda _: registry.release(model, parameters["model_version"]))
+    _finish_when_done(model, keys, [_first_result(future)])
+    future.add_done_callback(
+        lambda _: loop.call_soon_threadsafe(queue.put_nowait, None))
+
+    while True:
+        competency = await queue.get()
+        if competency is None:
+            break
+        yield competency
+
+    # Raises the error of the model, if there was one
+    future.result()
+
+
+async def extract_and_categorize(model: str, abstracts: list,
+                                 parameters: dict = None) -> list:
+    """Extracts competencies from abstracts and assigns each competency
+    its category. The categories of the competencies of all abstracts are
+    computed with one encoder pass, unless the model assigns categories
+    itself (see BATCH_CATEGORIZERS).
+
+    Args:
+        model (str): Name of the model, one of BATCH_EXTRACTORS
+        abstracts (list): Abstracts in text format
+        parameters (dict, optional): Parameters passed on to the model's
+                                     batch extraction function
+
+    Returns:
+        list: [[(competency, score, category id), ...], ...]
+              in the order of abstracts
+    """
+    results = await extract_async(model, abstracts, parameters)
+
+    # Competencies found in several abstracts are only encoded once
+    names = list(dict.fromkeys(competency[0] for competencies in results
+                               for competency in competencies))
+    if model in INLINE_MODELS:
+        categories = BATCH_CATEGORIZERS[model](names)
+    elif model in BATCH_CATEGORIZERS:
+        categories = await call_async(model, BATCH_CATEGORIZERS[model], names)
+    else:
+        categories = await call_async(
+            "category", get_categories_of_competencies, names)
+    category_ids = dict(zip(names, categories))
+
+    return [[(name, score, category_ids[name]) for name, score in competencies]
+            for competencies in results]
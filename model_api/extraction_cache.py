@@ -0,0 +1,181 @@
+"""
+This module contains a persistent cache for extraction results. A result
+is stored under a hash of the model name, the model version, the
+parameters of the extraction and the normalized abstract, so the same
+abstract is never passed through the same model twice.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+ENVIRONMENT_VARIABLE_CACHE_PATH = "EXTRACTION_CACHE_PATH"
+CACHE_PATH = os.environ.get(ENVIRONMENT_VARIABLE_CACHE_PATH,
+                            "cache/extraction_cache.db")
+
+# Maximum number of results kept, the least recently used are evicted
+ENVIRONMENT_VARIABLE_CACHE_MAX_ENTRIES = "EXTRACTION_CACHE_MAX_ENTRIES"
+CACHE_MAX_ENTRIES = int(os.environ.get(ENVIRONMENT_VARIABLE_CACHE_MAX_ENTRIES,
+                                       100000))
+
+# Maximum number of keys looked up with one statement
+MAX_VARIABLES = 500
+
+SQL_CREATE_TABLE_RESULT = """CREATE TABLE IF NOT EXISTS result(
+                                key text PRIMARY KEY,
+                                value text NOT NULL,
+                                last_access real NOT NULL
+                            );"""
+SQL_CREATE_INDEX_LAST_ACCESS = """CREATE INDEX IF NOT EXISTS
+                                  result_last_access
+                                  ON result(last_access);"""
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes an abstract so that differences in whitespace
+    don't lead to different cache keys.
+
+    Args:
+        text (str): An abstract in text format
+
+    Returns:
+        str: The normalized abstract
+    """
+    return " ".join(text.split())
+
+
+def make_key(model: str, model_version: str, parameters: dict,
+             text: str) -> str:
+    """Creates the cache key of an extraction.
+
+    Args:
+        model (str): Name of the model
+        model_version (str): Version of the model
+        parameters (dict): Parameters of the extraction
+        text (str): The abstract
+
+    Returns:
+        str: sha256 hash of all arguments
+    """
+    content = json.dumps([model, model_version, parameters,
+                          normalize_text(text)], sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """SQLite backed cache with least recently used eviction."""
+
+    def __init__(self, path: str, max_entries: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SQL_CREATE_TABLE_RESULT)
+        self._conn.execute(SQL_CREATE_INDEX_LAST_ACCESS)
+        self._conn.commit()
+
+    def reopen(self):
+        """Opens a new connection to the database. A forked process must
+        not use the connection of its parent.
+        """
+        self._lock = threading.Lock()
+        self._connect()
+
+    def get_many(self, keys: list) -> dict:
+        """Looks up several keys and marks the found ones as recently used.
+
+        Args:
+            keys (list): Cache keys as returned by make_key
+
+        Returns:
+            dict: {key: result} for every key that is cached
+        """
+        if not keys:
+            return {}
+
+        found = {}
+        now = time.time()
+        with self._lock:
+            # SQLite limits the number of variables of one statement
+            for start in range(0, len(keys), MAX_VARIABLES):
+                chunk = list(keys[start:start + MAX_VARIABLES])
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    "SELECT key, value FROM result "
+                    f"WHERE key IN ({placeholders})", chunk).fetchall()
+                self._conn.execute(
+                    "UPDATE result SET last_access = ? "
+                    f"WHERE key IN ({placeholders})", [now] + chunk)
+                found.update((key, json.loads(value)) for key, value in rows)
+            self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: dict):
+        """Stores several results and evicts the least recently used
+        results if the cache holds more than max_entries.
+
+        Args:
+            items (dict): {key: result}, results must be json serializable
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO result(key, value, last_access) "
+                "VALUES (?, ?, ?)",
+                [(key, json.dumps(value), now)
+                 for key, value in items.items()])
+            self._evict()
+            self._conn.commit()
+
+    def clear(self):
+        """Removes all results from the cache."""
+        with self._lock:
+            self._conn.execute("DELETE FROM result")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: hits, misses, hit_ratio, entries and max_entries
+        """
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM result").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0,
+                    "entries": entries,
+                    "max_entries": self.max_entries}
+
+    def _evict(self):
+        entries = self._conn.execute(
+            "SELECT COUNT(*) FROM result").fetchone()[0]
+        if entries > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM result WHERE key IN ("
+                "SELECT key FROM result ORDER BY last_access LIMIT ?)",
+                (entries - self.max_entries,))
+
+
+cache = ExtractionCache(CACHE_PATH, CACHE_MAX_ENTRIES)
@@ -0,0 +1,366 @@
+"""
+This module contains the text generation helpers shared by the generative
+models (Bloom, GPT-Neo and Galactica). All of them start their prompt with
+the same instruction, so the attention keys and values of this prefix are
+computed once per model and reused for every request. Only the tokens of
+the abstract and the prompt's suffix are processed per request.
+
+Generation stops as soon as the generated keyword list is complete, instead
+of decoding a fixed number of tokens.
+"""
+
+import inspect
+import re
+import threading
+import weakref
+
+from torch import cat, no_grad, ones_like
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from metrics import (GENERATED_TOKENS, STAGE_FORWARD, STAGE_POSTPROCESS,
+                     STAGE_TOKENIZATION, time_stage)
+
+# A line break or a full stop ends the generated keyword list. A period
+# only ends a sentence if whitespace follows and it doesn't end an
+# abbreviation like "e.g." or an initial, so "node.js" or
+# "machine learning, e.g. deep learning" are kept
+END_OF_LIST = re.compile(r"\n|(?<!\b\w)(?<!\.\w)\.(?=\s)")
+
+# Number of repeated competencies after which the generation is
+# considered degenerate
+MAX_REPEATED_COMPETENCIES = 2
+
+# A competency with more than this factor times the maximum number of
+# words is not a keyword anymore but running text
+RUNAWAY_FACTOR = 3
+
+# Bounds of the number of generated tokens, which grows with
+# one new token per ABSTRACT_TOKENS_PER_NEW_TOKEN tokens of the abstract
+MIN_NEW_TOKENS = 16
+ABSTRACT_TOKENS_PER_NEW_TOKEN = 3
+
+# Prefix key/values by model, removed automatically with the model
+_prefix_states = weakref.WeakKeyDictionary()
+_prefix_states_lock = threading.Lock()
+
+
+def adaptive_max_new_tokens(abstract_tokens: int, max_new_tokens: int) -> int:
+    """Returns the token budget of a generation, which grows with the
+    length of the abstract.
+
+    Args:
+        abstract_tokens (int): Number of tokens of the (longest) abstract
+        max_new_tokens (int): Upper bound of the budget
+
+    Returns:
+        int: Maximum number of tokens to generate
+    """
+    budget = abstract_tokens // ABSTRACT_TOKENS_PER_NEW_TOKEN
+    return max(MIN_NEW_TOKENS, min(max_new_tokens, budget))
+
+
+def is_competency_list_finished(text: str, max_competencies: int,
+                                max_length_competencies: int) -> bool:
+    """Checks whether a (partially) generated keyword list is complete.
+
+    Args:
+        text (str): The text generated so far, without prompt
+        max_competencies (int): Maximum number of competencies
+        max_length_competencies (int): Maximum number of words
+                                       in a competency
+
+    Returns:
+        bool: True if the list ended, has max_competencies competencies
+              or degenerated into repetitions or running text
+    """
+    text = text.lstrip()
+    if END_OF_LIST.search(text):
+        return True
+
+    competencies = [competency.strip().lower()
+                    for competency in text.split(",")]
+    # The last competency may still be generated
+    complete = competencies[:-1]
+    if len(complete) >= max_competencies:
+        return True
+    if len(complete) - len(set(complete)) >= MAX_REPEATED_COMPETENCIES:
+        return True
+    return (len(competencies[-1].split())
+            > RUNAWAY_FACTOR * max_length_competencies)
+
+
+def truncate_competency_list(text: str, max_competencies: int) -> str:
+    """Cuts a generated keyword list at its end marker and after
+    max_competencies competencies.
+
+    Args:
+        text (str): Generated text without prompt
+        max_competencies (int): Maximum number of competencies
+
+    Returns:
+        str: The comma separated competencies
+    """
+    text = END_OF_LIST.split(text.lstrip(), maxsplit=1)[0]
+    # A period at the end of the text may end the list as well
+    text = text.rstrip().rstrip(".")
+    return ",".join(text.split(",")[:max_competencies])
+
+
+class CompetencyStoppingCriteria(StoppingCriteria):
+    """Stops the generation once the keyword list of every sequence in the
+    batch is complete (see is_competency_list_finished). If a callback is
+    given, every competency is passed to it as soon as it is decoded.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): Tokenizer of the model
+        max_competencies (int): Maximum number of competencies
+        max_length_competencies (int): Maximum number of words
+                                       in a competency
+        indices (list): Index of each sequence of the batch in the request
+        on_competency (callable, optional): Called with the index of the
+                                            sequence and the competency
+    """
+
+    def __init__(self, tokenizer, max_competencies: int,
+                 max_length_competencies: int, indices: list,
+                 on_competency=None):
+        self.tokenizer = tokenizer
+        self.max_competencies = max_competencies
+        self.max_length_competencies = max_length_competencies
+        self.indices = indices
+        self.on_competency = on_competency
+        # Set by the generation once the prompt is tokenized
+        self.prompt_length = 0
+        self._end_token_ids = {tokenizer.eos_token_id, tokenizer.pad_token_id}
+        self._emitted = [0] * len(indices)
+        self._finished = [False] * len(indices)
+
+    def finish(self, row: int, text: str):
+        """Passes the competencies of a sequence that were not passed to
+        the callback yet, e.g. because the token budget was used up.
+
+        Args:
+            row (int): Row of the sequence in the batch
+            text (str): The final generated text without prompt
+        """
+        self._emit(row, text, finished=True)
+
+    def _check_sequence(self, row, input_ids) -> bool:
+        generated = input_ids[self.prompt_length:]
+        text = self.tokenizer.decode(generated, skip_special_tokens=True)
+        finished = ((len(generated) > 0
+                     and int(generated[-1]) in self._end_token_ids)
+                    or is_competency_list_finished(
+                        text, self.max_competencies,
+                        self.max_length_competencies))
+        if row is not None:
+            self._emit(row, text, finished)
+        return finished
+
+    def _emit(self, row: int, text: str, finished: bool):
+        if self.on_competency is None or self._finished[row]:
+            return
+
+        competencies = truncate_competency_list(
+            text, self.max_competencies).split(",")
+        if not finished:
+            # The last competency may still be generated
+            competencies = competencies[:-1]
+
+        for competency in competencies[self._emitted[row]:]:
+            self.on_competency(self.indices[row], competency)
+        self._emitted[row] = len(competencies)
+        self._finished[row] = finished
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        # During beam search the rows are beams, not sequences of the
+        # batch, so competencies are only passed on at the end
+        rows = (range(len(input_ids)) if len(input_ids) == len(self.indices)
+                else [None] * len(input_ids))
+        return all([self._check_sequence(row, sequence)
+                    for row, sequence in zip(rows, input_ids)])
+
+
+def _get_prefix_state(tokenizer, model, prefix: str):
+    """Returns the token ids and the past key/values of a prompt prefix,
+    computing them on the first call for this model and prefix.
+    """
+    with _prefix_states_lock:
+        states = _prefix_states.setdefault(model, {})
+        if prefix in states:
+            return states[prefix]
+
+    prefix_ids = tokenizer(prefix, return_tensors="pt")["input_ids"]
+    with no_grad():
+        past = model(input_ids=prefix_ids, use_cache=True).past_key_values
+
+    with _prefix_states_lock:
+        states[prefix] = (prefix_ids, past)
+    return prefix_ids, past
+
+
+def _expand_past(past: tuple, batch_size: int) -> tuple:
+    """Repeats the past key/values of a single prompt for a batch. Works for
+    the (batch, heads, ...) layout as well as Bloom's (batch * heads, ...)
+    layout, as the cached prefix always has a batch size of one.
+    """
+    return tuple(tuple(tensor.repeat(batch_size, *[1] * (tensor.dim() - 1))
+                       for tensor in layer)
+                 for layer in past)
+
+
+def _get_past_argument(model) -> str:
+    # Older versions of transformers call the argument "past"
+    parameters = inspect.signature(
+        model.prepare_inputs_for_generation).parameters
+    return "past_key_values" if "past_key_values" in parameters else "past"
+
+
+def _get_stopping_kwargs(stopping_criteria: CompetencyStoppingCriteria,
+                         body_mask, prompt_length: int,
+                         max_new_tokens: int) -> dict:
+    """Returns the token budget and the stopping criteria of a batch."""
+    stopping_criteria.prompt_length = prompt_length
+    abstract_tokens = int(body_mask.sum(dim=1).max())
+    return {"max_new_tokens": adaptive_max_new_tokens(abstract_tokens,
+                                                      max_new_tokens),
+            "stopping_criteria": StoppingCriteriaList([stopping_criteria])}
+
+
+def _generate_with_prefix(tokenizer, model, prefix: str, bodies: list,
+                          stopping_criteria: CompetencyStoppingCriteria,
+                          max_new_tokens: int, model_name: str,
+                          **generation_kwargs):
+    """Generates continuations of prefix + body for each body, reusing the
+    cached key/values of the prefix.
+
+    Returns:
+        tuple: (generated token ids, number of prompt tokens)
+    """
+    prefix_ids, prefix_past = _get_prefix_state(tokenizer, model, prefix)
+    batch_size = len(bodies)
+
+    # The bodies are left padded, so the padding sits between the
+    # prefix and the abstract and is masked out
+    with time_stage(model_name, STAGE_TOKENIZATION):
+        inputs = tokenizer(bodies, return_tensors="pt", padding=True,
+                           add_special_tokens=False)
+    input_ids = cat([prefix_ids.repeat(batch_size, 1),
+                     inputs["input_ids"]], dim=1)
+    prefix_mask = ones_like(prefix_ids).repeat(batch_size, 1)
+    attention_mask = cat([prefix_mask, inputs["attention_mask"]], dim=1)
+    past = _expand_past(prefix_past, batch_size)
+
+    # Process the body except for its last token, generate() starts with
+    # the last token and the past of everything before it
+    body_length = inputs["input_ids"].shape[1]
+    if body_length > 1:
+        forward_kwargs = {}
+        if "position_ids" in inspect.signature(model.forward).parameters:
+            position_ids = attention_mask.long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask == 0, 1)
+            forward_kwargs["position_ids"] = (
+                position_ids[:, prefix_ids.shape[1]:-1])
+        with no_grad(), time_stage(model_name, STAGE_FORWARD):
+            past = model(input_ids=inputs["input_ids"][:, :-1],
+                         attention_mask=attention_mask[:, :-1],
+                         past_key_values=past, use_cache=True,
+                         **forward_kwargs).past_key_values
+
+    generation_kwargs[_get_past_argument(model)] = past
+    generation_kwargs.update(_get_stopping_kwargs(
+        stopping_criteria, inputs["attention_mask"], input_ids.shape[1],
+        max_new_tokens))
+    with no_grad(), time_stage(model_name, STAGE_FORWARD):
+        outputs = model.generate(input_ids,
+                                 attention_mask=attention_mask,
+                                 pad_token_id=tokenizer.pad_token_id,
+                                 **generation_kwargs)
+    return outputs, input_ids.shape[1]
+
+
+def _generate_without_prefix(tokenizer, model, prefix: str, bodies: list,
+                             stopping_criteria: CompetencyStoppingCriteria,
+                             max_new_tokens: int, model_name: str,
+                             **generation_kwargs):
+    """Generates continuations of prefix + body for each body.
+
+    Returns:
+        tuple: (generated token ids, number of prompt tokens)
+    """
+    with time_stage(model_name, STAGE_TOKENIZATION):
+        inputs = tokenizer([prefix + body for body in bodies],
+                           return_tensors="pt", padding=True)
+    generation_kwargs.update(_get_stopping_kwargs(
+        stopping_criteria, inputs["attention_mask"],
+        inputs["input_ids"].shape[1], max_new_tokens))
+    with no_grad(), time_stage(model_name, STAGE_FORWARD):
+        outputs = model.generate(inputs["input_ids"],
+                                 attention_mask=inputs["attention_mask"],
+                                 pad_token_id=tokenizer.pad_token_id,
+                                 **generation_kwargs)
+    return outputs, inputs["input_ids"].shape[1]
+
+
+def generate_batch(tokenizer, model, prefix: str, bodies: list,
+                   batch_size: int, max_new_tokens: int,
+                   max_competencies: int, max_length_competencies: int,
+                   on_competency=None, model_name: str = "unknown",
+                   **generation_kwargs) -> list:
+    """Generates a keyword list for the prompt prefix + body of every body.
+    The bodies are sorted by length and passed through the model in left
+    padded mini-batches. The generation of a batch stops once every keyword
+    list is complete or the token budget of the batch is used up.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): Tokenizer of the model
+        model (PreTrainedModel): A causal language model
+        prefix (str): Start of the prompt that is the same for all requests
+        bodies (list): Rest of the prompt (the abstract and the suffix)
+        batch_size (int): Number of prompts generated in one pass
+        max_new_tokens (int): Upper bound of the generated tokens, the
+                              budget adapts to the length of the abstracts
+        max_competencies (int): Maximum number of competencies
+        max_length_competencies (int): Maximum number of words
+                                       in a competency
+        on_competency (callable, optional): Called with the index of the
+                                            body and the competency as
+                                            soon as a competency is decoded
+        model_name (str, optional): Name of the model in the metrics
+        **generation_kwargs: Arguments passed on to model.generate
+
+    Returns:
+        list: The comma separated competencies for each body,
+              in the order of bodies
+    """
+    # Beam search expands the batch inside generate(), which the cached
+    # prefix is not prepared for
+    use_prefix_cache = generation_kwargs.get("num_beams", 1) == 1
+    generate = (_generate_with_prefix if use_prefix_cache
+                else _generate_without_prefix)
+
+    # Batching prompts of similar length keeps the padding small
+    order = sorted(range(len(bodies)), key=lambda index: len(bodies[index]))
+    results = [None] * len(bodies)
+
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        stopping_criteria = CompetencyStoppingCriteria(
+            tokenizer, max_competencies, max_length_competencies, indices,
+            on_competency)
+        outputs, prompt_length = generate(tokenizer, model, prefix,
+                                          [bodies[index] for index in indices],
+                                          stopping_criteria, max_new_tokens,
+                                          model_name, **generation_kwargs)
+
+        # Only decode the tokens that were generated after the prompt
+        generated = outputs[:, prompt_length:]
+        GENERATED_TOKENS.inc(int((generated != tokenizer.pad_token_id).sum()),
+                             model=model_name)
+        with time_stage(model_name, STAGE_POSTPROCESS):
+            for row, tokens in enumerate(generated):
+                text = tokenizer.decode(tokens, skip_special_tokens=True)
+                stopping_criteria.finish(row, text)
+                results[indices[row]] = truncate_competency_list(
+                    text, max_competencies)
+    return results
@@ -0,0 +1,192 @@
+"""
+This module swaps the served version of a model without restarting the
+api. The new version is loaded and warmed up in the background while the
+current version keeps serving. Then the default version of the model is
+switched at once: new requests use the new version, requests in flight
+finish on the previous version, which is unloaded once they are done.
+Worker processes of the pre-fork mode can't be swapped together, so
+swaps are only possible with a single worker.
+"""
+
+import threading
+import time
+
+import psutil
+
+import inference_pool
+import prefork
+from model_registry import MEGABYTE, registry
+from models import BATCH_EXTRACTORS, get_categories_of_competencies
+
+# Abstracts a new version is warmed up with, if the swap brings no samples
+WARMUP_ABSTRACTS = [
+    "We propose a convolutional neural network for the segmentation of "
+    "medical images and evaluate it on magnetic resonance scans.",
+    "The corrosion of steel reinforcement in concrete structures is "
+    "modelled with the finite element method under cyclic loading."]
+
+# States of a swap
+STATE_LOADING = "loading"
+STATE_WARMING = "warming"
+STATE_DRAINING = "draining"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class SwapInProgressError(RuntimeError):
+    """Raised when a model is swapped while its previous swap is running."""
+
+
+class SwapNotSupportedError(RuntimeError):
+    """Raised when a model is swapped in a worker of the pre-fork mode."""
+
+
+class _Swap:
+    """Progress of swapping one model to another version."""
+
+    def __init__(self, model: str, version: str, previous_version: str):
+        self.model = model
+        self.version = version
+        self.previous_version = previous_version
+        self.state = STATE_LOADING
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        # Growth of the resident set size while the new version was loaded
+        self.memory_bytes = None
+        # Change of the resident set size from the start of the swap until
+        # the previous version was unloaded
+        self.process_memory_delta_bytes = None
+
+    def to_dict(self) -> dict:
+        return {"model": self.model,
+                "version": self.version,
+                "previous_version": self.previous_version,
+                "state": self.state,
+                "error": self.error,
+                "load_seconds": self.load_seconds,
+                "warmup_seconds": self.warmup_seconds,
+                "memory_mb": _to_megabytes(self.memory_bytes),
+                "process_memory_delta_mb": _to_megabytes(
+                    self.process_memory_delta_bytes)}
+
+
+def _to_megabytes(size_bytes):
+    return None if size_bytes is None else round(size_bytes / MEGABYTE, 1)
+
+
+def warm_up(model: str, version: str, samples: list):
+    """Runs a version of a model on sample inputs, so the first requests
+    after the swap don't pay for lazy initialization.
+
+    Args:
+        model (str): Name of the model
+        version (str): Version of the model
+        samples (list): Abstracts in text format
+    """
+    if model == "category":
+        get_categories_of_competencies(samples, model_version=version)
+    elif model in BATCH_EXTRACTORS:
+        BATCH_EXTRACTORS[model](samples, model_version=version)
+
+
+class HotSwapper:
+    """Swaps the served versions of models in background threads. Only
+    one swap per model runs at a time.
+    """
+
+    def __init__(self):
+        self._swaps = {}
+        self._lock = threading.Lock()
+
+    def start(self, model: str, version: str, samples: list = None) -> dict:
+        """Starts loading a version of a model, which replaces the current
+        version once it is loaded and warmed up.
+
+        Args:
+            model (str): Name of the model
+            version (str): The new version
+            samples (list, optional): Abstracts the new version is warmed
+                                      up with, defaults to WARMUP_ABSTRACTS
+
+        Raises:
+            SwapNotSupportedError: If the api runs with several workers
+            SwapInProgressError: If the model is being swapped already
+
+        Returns:
+            dict: The state of the swap
+        """
+        # Every worker would have to swap, or the workers would serve
+        # different versions
+        if prefork.WORKERS > 1:
+            raise SwapNotSupportedError(
+                f"Models can't be swapped with {prefork.WORKERS} workers "
+                f"({prefork.ENVIRONMENT_VARIABLE_WORKERS}), restart the api "
+                "with the new version instead")
+
+        with self._lock:
+            running = self._swaps.get(model)
+            if running is not None and running.state in (STATE_LOADING,
+                                                         STATE_WARMING,
+                                                         STATE_DRAINING):
+                raise SwapInProgressError(
+                    f"Model {model} is being swapped to {running.version}")
+            swap = _Swap(model, version, registry.default_version(model))
+            self._swaps[model] = swap
+
+        threading.Thread(target=self._run,
+                         args=(swap, samples or WARMUP_ABSTRACTS),
+                         daemon=True).start()
+        return swap.to_dict()
+
+    def status(self) -> dict:
+        """Returns the state of the last swap of every model.
+
+        Returns:
+            dict: {model: state of the swap}
+        """
+        with self._lock:
+            swaps = list(self._swaps.values())
+        return {swap.model: swap.to_dict() for swap in swaps}
+
+    @staticmethod
+    def _run(swap: _Swap, samples: list):
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        try:
+            start = time.perf_counter()
+            registry.get(swap.model, swap.version)
+            swap.load_seconds = time.perf_counter() - start
+            swap.memory_bytes = registry.memory_bytes(swap.model,
+                                                      swap.version)
+
+            swap.state = STATE_WARMING
+            start = time.perf_counter()
+            # Runs in turn with the requests using the model
+            inference_pool.submit(swap.model, warm_up, swap.model,
+                                  swap.version, samples).result()
+            swap.warmup_seconds = time.perf_counter() - start
+        except Exception as error:
+            print(f"Swapping {swap.model} to {swap.version} failed: {error}")
+            swap.error = str(error)
+            swap.state = STATE_FAILED
+            # The previous version keeps serving
+            if swap.version != swap.previous_version:
+                registry.unload(swap.model, swap.version)
+            return
+
+        registry.set_default_version(swap.model, swap.version)
+        if swap.version != swap.previous_version:
+            # Requests pinned to the previous version would load it again
+            swap.state = STATE_DRAINING
+            registry.unload_when_unused(swap.model, swap.previous_version)
+        swap.process_memory_delta_bytes = (process.memory_info().rss
+                                           - rss_before)
+        swap.state = STATE_DONE
+        print(f"Swapped {swap.model} from {swap.previous_version} to "
+              f"{swap.version}: load {swap.load_seconds:.1f}s, warmup "
+              f"{swap.warmup_seconds:.1f}s, memory "
+              f"{_to_megabytes(swap.memory_bytes)} MB")
+
+
+swapper = HotSwapper()
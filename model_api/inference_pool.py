@@ -0,0 +1,146 @@
+"""
+This module runs the blocking inference of the model_api in a bounded
+pool of worker threads, so the event loop of uvicorn stays responsive
+while a model is working. Calls for the same model are serialized,
+calls for different models run in parallel. Calls waiting for their
+model are queued per model and don't occupy a worker thread.
+"""
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Number of models that may run inference at the same time
+ENVIRONMENT_VARIABLE_INFERENCE_WORKERS = "MODEL_API_INFERENCE_WORKERS"
+INFERENCE_WORKERS = int(os.environ.get(ENVIRONMENT_VARIABLE_INFERENCE_WORKERS,
+                                       min(4, os.cpu_count() or 1)))
+
+_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS,
+                           thread_name_prefix="inference")
+_model_queues = {}
+_model_queues_lock = threading.Lock()
+# Models that use the same instance share their queue
+_queue_aliases = {}
+_torch_threads_limited = False
+# Number of processes serving the api, see prefork.py
+_processes = 1
+
+
+def share_cores(processes: int):
+    """Divides the cores between several processes serving the api, each
+    running its own pool.
+
+    Args:
+        processes (int): Number of processes
+    """
+    global _processes, _torch_threads_limited
+    _processes = max(1, processes)
+    _torch_threads_limited = False
+
+
+def threads_per_worker() -> int:
+    """Returns the number of cores each worker may use, so models running
+    in parallel don't compete for the same cores.
+
+    Returns:
+        int: Number of threads a model may use for one operation
+    """
+    return max(1, (os.cpu_count() or 1) // (INFERENCE_WORKERS * _processes))
+
+
+def _limit_torch_threads():
+    # torch is only imported once a model that needs it is loaded
+    global _torch_threads_limited
+    if _torch_threads_limited or "torch" not in sys.modules:
+        return
+    sys.modules["torch"].set_num_threads(threads_per_worker())
+    _torch_threads_limited = True
+
+
+def share_lock(model: str, other: str):
+    """Serializes the calls of two models, e.g. because they share
+    an encoder.
+
+    Args:
+        model (str): Name of the model
+        other (str): Name of the model whose queue it uses
+    """
+    with _model_queues_lock:
+        _queue_aliases[model] = other
+
+
+class _ModelQueue:
+    """Calls waiting for a model and whether one of them is running."""
+
+    def __init__(self):
+        self.pending = collections.deque()
+        self.running = False
+
+
+def _run_next(queue: _ModelQueue):
+    with _model_queues_lock:
+        future, function, args, kwargs = queue.pending.popleft()
+
+    # Tokenizers and models are not safe to be used by several
+    # threads at once, so a model runs one call at a time
+    if future.set_running_or_notify_cancel():
+        _limit_torch_threads()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            _limit_torch_threads()
+
+    with _model_queues_lock:
+        if not queue.pending:
+            queue.running = False
+            return
+    # The next call of the model queues up behind the other models,
+    # so a busy model doesn't keep a worker thread to itself
+    _pool.submit(_run_next, queue)
+
+
+def submit(model: str, function, *args, **kwargs) -> Future:
+    """Runs a function using a model in the worker pool.
+
+    Args:
+        model (str): Name of the model the function uses
+        function (callable): The function to run
+        *args: Positional arguments of the function
+        **kwargs: Keyword arguments of the function
+
+    Returns:
+        Future: Future of the function's result
+    """
+    future = Future()
+    with _model_queues_lock:
+        model = _queue_aliases.get(model, model)
+        if model not in _model_queues:
+            _model_queues[model] = _ModelQueue()
+        queue = _model_queues[model]
+        queue.pending.append((future, function, args, kwargs))
+        if queue.running:
+            return future
+        queue.running = True
+    _pool.submit(_run_next, queue)
+    return future
+
+
+async def run(model: str, function, *args, **kwargs):
+    """Runs a function using a model in the worker pool and waits for it
+    without blocking the event loop.
+
+    Args:
+        model (str): Name of the model the function uses
+        function (callable): The function to run
+        *args: Positional arguments of the function
+        **kwargs: Keyword arguments of the function
+
+    Returns:
+        object: The function's result
+    """
+    return await asyncio.wrap_future(submit(model, function, *args, **kwargs))
@@ -0,0 +1,276 @@
+"""
+This module collects the metrics of the model_api and renders them in the
+Prometheus text format for the /metrics endpoint. The metrics are kept in
+memory, so they can be read locally without running a collector.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120)
+
+# Upper bounds of the queue depth histogram buckets in abstracts
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class _Metric:
+    """Base class of the metric types. Every metric holds one value per
+    combination of label values.
+
+    Args:
+        name (str): Name of the metric
+        description (str): Help text of the metric
+        labels (tuple): Names of the labels
+    """
+
+    metric_type = None
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labels, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = [(name, str(value).replace("\\", "\\\\")
+                    .replace('"', '\\"').replace("\n", "\\n"))
+                   for name, value in pairs]
+        return "{" + ",".join(f'{name}="{value}"'
+                              for name, value in escaped) + "}"
+
+    def _render_samples(self, values: dict) -> list:
+        return [f"{self.name}{self._format_labels(key)} {value}"
+                for key, value in values.items()]
+
+    def render(self) -> list:
+        """Returns the lines of the metric in the Prometheus text format.
+
+        Returns:
+            list: HELP, TYPE and sample lines
+        """
+        with self._lock:
+            values = dict(self._values)
+        return ([f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} {self.metric_type}"]
+                + self._render_samples(values))
+
+
+class Counter(_Metric):
+    """A value that only increases."""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increases the counter.
+
+        Args:
+            amount (float): The increment
+            **labels: Values of the labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        """Sets the gauge.
+
+        Args:
+            value (float): The new value
+            **labels: Values of the labels
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        """Increases the gauge.
+
+        Args:
+            amount (float): The increment, negative to decrease
+            **labels: Values of the labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def clear(self):
+        """Removes all values, e.g. before the values are set again."""
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    """Counts observations in cumulative buckets.
+
+    Args:
+        name (str): Name of the metric
+        description (str): Help text of the metric
+        labels (tuple): Names of the labels
+        buckets (tuple): Upper bounds of the buckets
+    """
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        """Adds an observation.
+
+        Args:
+            value (float): The observed value
+            **labels: Values of the labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # Counts per bucket plus the +Inf bucket, sum and count
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts, _, _ = self._values[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key][1] += value
+            self._values[key][2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the duration of a with block in seconds.
+
+        Args:
+            **labels: Values of the labels
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            values = {key: ([*counts], total, count)
+                      for key, (counts, total, count) in self._values.items()}
+        lines = [f"# HELP {self.name} {self.description}",
+                 f"# TYPE {self.name} {self.metric_type}"]
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket"
+                             f"{self._format_labels(key, {'le': bound})} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} "
+                         f"{count}")
+        return lines
+
+
+_metrics = []
+
+REQUESTS = Counter("model_api_requests_total",
+                   "Number of handled requests",
+                   ("endpoint", "method", "status"))
+REQUEST_SECONDS = Histogram("model_api_request_duration_seconds",
+                            "Time until the response of a request started",
+                            ("endpoint", "method", "lane"))
+REQUESTS_IN_FLIGHT = Gauge("model_api_requests_in_flight",
+                           "Number of requests being handled")
+QUEUE_DEPTH = Gauge("model_api_scheduler_queue_depth",
+                    "Number of abstracts waiting for their batch",
+                    ("model",))
+QUEUE_DEPTH_ON_ARRIVAL = Histogram(
+    "model_api_scheduler_queue_depth_on_arrival",
+    "Number of abstracts waiting in a lane when new abstracts arrive",
+    ("model", "lane"), DEPTH_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram("model_api_scheduler_queue_wait_seconds",
+                               "Time an abstract waited for its batch",
+                               ("model", "lane"))
+QUEUE_REJECTIONS = Counter("model_api_scheduler_rejections_total",
+                           "Number of abstracts rejected by the scheduler",
+                           ("model", "reason"))
+STAGE_SECONDS = Histogram("model_api_inference_stage_seconds",
+                          "Time spent in a stage of the inference",
+                          ("model", "stage"))
+GENERATED_TOKENS = Counter("model_api_generated_tokens_total",
+                           "Number of tokens generated by language models",
+                           ("model",))
+CACHE_HITS = Gauge("model_api_cache_hits",
+                   "Number of abstracts answered from the extraction cache")
+CACHE_MISSES = Gauge("model_api_cache_misses",
+                     "Number of abstracts not found in the extraction cache")
+CACHE_HIT_RATIO = Gauge(
+    "model_api_cache_hit_ratio",
+    "Share of abstracts answered from the extraction cache")
+CACHE_ENTRIES = Gauge("model_api_cache_entries",
+                      "Number of results in the extraction cache")
+PHRASE_CACHE_HITS = Gauge("model_api_phrase_cache_hits",
+                          "Number of phrases whose embedding was cached",
+                          ("encoder",))
+PHRASE_CACHE_MISSES = Gauge("model_api_phrase_cache_misses",
+                            "Number of phrases that had to be embedded",
+                            ("encoder",))
+PHRASE_CACHE_HIT_RATIO = Gauge("model_api_phrase_cache_hit_ratio",
+                               "Share of phrases whose embedding was cached",
+                               ("encoder",))
+PHRASE_CACHE_ENTRIES = Gauge("model_api_phrase_cache_entries",
+                             "Number of phrase embeddings in memory or on "
+                             "disk", ("encoder", "store"))
+COALESCING_REQUESTS = Counter(
+    "model_api_coalescing_requests_total",
+    "Number of abstracts that started an extraction (leader) or waited "
+    "for an identical extraction in flight (duplicate)", ("model", "role"))
+COALESCING_SAVED_SECONDS = Counter(
+    "model_api_coalescing_saved_seconds_total",
+    "Extraction time saved by sharing the results of identical extractions",
+    ("model",))
+MODEL_MEMORY = Gauge("model_api_model_memory_bytes",
+                     "Memory used by a resident model", ("model",))
+PROCESS_MEMORY = Gauge("model_api_process_resident_memory_bytes",
+                       "Resident set size of the model_api process")
+
+# Stages of the inference of a model
+STAGE_TOKENIZATION = "tokenization"
+STAGE_FORWARD = "forward"
+STAGE_POSTPROCESS = "postprocess"
+
+
+def time_stage(model: str, stage: str):
+    """Context manager measuring a stage of the inference of a model.
+
+    Args:
+        model (str): Name of the model
+        stage (str): One of the STAGE_ constants
+
+    Returns:
+        contextmanager: Observes the duration of the with block
+    """
+    return STAGE_SECONDS.time(model=model, stage=stage)
+
+
+def render() -> str:
+    """Renders all metrics in the Prometheus text format.
+
+    Returns:
+        str: The metrics
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
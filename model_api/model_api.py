@@ -3,15 +3,142 @@ This API exposes different endpoints that can be used
 to extract competencies from abstracts.
 """
 
-import uvicorn
-from fastapi import FastAPI
-from models import (ask_pegasus, get_mock_competency,
-                    ask_galactica, ask_xlnet, ask_bloom, ask_keybert,
-                    get_competency_from_backend, ask_gpt_neo, get_category_of_competency)
+import time
+_import_start = time.perf_counter()
+
+import hmac
+import inspect
+import json
+import os
+import sys
+import threading
+from typing import List
 
+import uvicorn
+import psutil
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import (JSONResponse, PlainTextResponse,
+                               StreamingResponse)
+from starlette.routing import Match
+from pydantic import BaseModel
+from models import (ask_pegasus, get_mock_competency, ask_xlnet,
+                    get_category_of_competency,
+                    get_categories_of_competencies, BATCH_EXTRACTORS,
+                    STREAMING_MODELS)
+from model_registry import (registry, get_preload_models, MEGABYTE,
+                            ModelNotEnabledError)
+from extraction import (call_async, extract_async, extract_and_categorize,
+                        stream_extraction)
+import prefork
+from chunking import ChunkSizeError
+from hot_swap import swapper, SwapInProgressError, SwapNotSupportedError
+from extraction_cache import cache
+from scheduler import (scheduler, SchedulerOverloadedError, LANES,
+                       LANE_INTERACTIVE, request_lane)
+import metrics
+
+# Time it took to import the api, the libraries of the models are
+# imported when the models are loaded
+API_IMPORT_SECONDS = time.perf_counter() - _import_start
 
 app = FastAPI()
 
+# Header choosing the priority lane of a request, "interactive" or "bulk"
+PRIORITY_HEADER = "X-Priority"
+
+# Token the admin endpoints that change the served models require in the
+# admin header. Without a token these endpoints are disabled.
+ENVIRONMENT_VARIABLE_ADMIN_TOKEN = "MODEL_API_ADMIN_TOKEN"
+ADMIN_TOKEN = os.environ.get(ENVIRONMENT_VARIABLE_ADMIN_TOKEN, "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+@app.exception_handler(ModelNotEnabledError)
+async def model_not_enabled(request: Request, error: ModelNotEnabledError):
+    """Answers requests for models the deployment doesn't enable with 404."""
+    return JSONResponse(status_code=404, content={"detail": str(error)})
+
+
+@app.exception_handler(ChunkSizeError)
+async def chunk_size_invalid(request: Request, error: ChunkSizeError):
+    """Answers requests whose parameters leave no room for the abstract
+    with 422.
+    """
+    return JSONResponse(status_code=422, content={"detail": str(error)})
+
+
+@app.exception_handler(SchedulerOverloadedError)
+async def scheduler_overloaded(request: Request,
+                               error: SchedulerOverloadedError):
+    """Answers requests the scheduler can't take with 429, the Retry-After
+    header tells the client when to try again.
+    """
+    return JSONResponse(status_code=429, content={"detail": str(error)},
+                        headers={"Retry-After": str(error.retry_after)})
+
+
+def get_route_path(request: Request) -> str:
+    """Returns the path template of the route handling a request, so the
+    metrics are not split by the abstract in the path.
+
+    Args:
+        request (Request): The request
+
+    Returns:
+        str: e.g. "/ask_bloom/{abstract}"
+    """
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+def get_lane(request: Request) -> str:
+    """Returns the priority lane of a request from its X-Priority header.
+    Requests without (or with an unknown) priority are interactive.
+
+    Args:
+        request (Request): The request
+
+    Returns:
+        str: One of the scheduler's LANES
+    """
+    lane = request.headers.get(PRIORITY_HEADER, "").strip().lower()
+    return lane if lane in LANES else LANE_INTERACTIVE
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts the requests and measures their latency per endpoint and
+    lane. Streamed responses are measured until the response started.
+    The lane is handed to the scheduler for the handling of the request.
+    """
+    endpoint = get_route_path(request)
+    lane = get_lane(request)
+    request_lane.set(lane)
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    status = 500
+    try:
+        with metrics.REQUEST_SECONDS.time(endpoint=endpoint,
+                                          method=request.method, lane=lane):
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.inc(-1)
+        metrics.REQUESTS.inc(endpoint=endpoint, method=request.method,
+                             status=status)
+
+
+@app.on_event("startup")
+async def warmup_models():
+    """Loads the configured models in the background, so the api can
+    answer requests (e.g. /ready) while the models are loading.
+    """
+    threading.Thread(target=registry.warmup, args=(get_preload_models(),),
+                     daemon=True).start()
+
 
 @app.get("/")
 async def root():
@@ -26,8 +153,218 @@ async def root():
             "details, please visit http://127.0.0.1:8000/docs.")
 
 
+@app.get("/ready")
+async def ready(response: Response):
+    """Readiness endpoint. Answers with status code 503 until all models
+    configured in MODEL_API_PRELOAD_MODELS are loaded.
+
+    Returns:
+        json: Whether the api is ready and the state of each model
+    """
+    is_ready = registry.is_ready()
+    if not is_ready:
+        response.status_code = 503
+    return {"ready": is_ready, "models": registry.status()}
+
+
+@app.get("/models")
+async def model_status():
+    """Returns the state and load time of every model known to the api.
+
+    Returns:
+        json: {"name:version": {"state": ..., "load_seconds": ...}, ...}
+    """
+    return registry.status()
+
+
+@app.get("/startup")
+async def startup_report():
+    """Returns how long the startup took, split into importing the api,
+    importing the libraries of each model and loading each model.
+
+    Returns:
+        json: api_import_seconds, enabled and preloaded models, warmup
+              time and the import and load time of every loaded model
+    """
+    return {"api_import_seconds": API_IMPORT_SECONDS,
+            **registry.startup_report()}
+
+
+@app.get("/models/resident")
+async def resident_models():
+    """Returns the memory budget, the models that are currently resident
+    and how often each model was evicted to stay within the budget.
+
+    Returns:
+        json: {"budget_mb": ..., "resident_mb": ..., "resident": [...],
+               "evictions": {"name:version": count, ...}}
+    """
+    return registry.residency()
+
+
+@app.get("/memory")
+async def memory():
+    """Returns the memory of the processes serving the api. With several
+    workers (MODEL_API_WORKERS) the unique memory (uss) of each worker
+    shows what it costs on top of the weights shared with the parent.
+
+    Returns:
+        json: mode, processes with rss_mb, uss_mb, pss_mb and shared_mb,
+              worker_uss_mb and total_pss_mb
+    """
+    return prefork.memory_report()
+
+
+class ModelSwap(BaseModel):
+    """Contains the version a model is swapped to and optional abstracts
+    the new version is warmed up with.
+
+    Args:
+        BaseModel (BaseModel): pydantic basemodel
+    """
+    version: str
+    samples: List[str] = []
+
+
+def check_admin_token(request: Request):
+    """Checks that a request carries the admin token.
+
+    Args:
+        request (Request): The request
+
+    Raises:
+        HTTPException: 403 if no admin token is configured, 401 if the
+                       request's token is missing or wrong
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Admin endpoints are disabled, set "
+                   f"{ENVIRONMENT_VARIABLE_ADMIN_TOKEN} to enable them")
+    token = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    # Compared in constant time, so the token can't be guessed by timing
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401,
+                            detail=f"Missing or wrong {ADMIN_TOKEN_HEADER}")
+
+
+@app.post("/admin/models/{model}/swap", status_code=202)
+async def swap_model(model: str, swap: ModelSwap, request: Request):
+    """Loads another version of a model in the background and warms it up
+    with the samples. Afterwards new requests are served by the new
+    version, requests in flight finish on the previous version. Swaps
+    are rejected with several workers (MODEL_API_WORKERS). The request
+    must carry the admin token (MODEL_API_ADMIN_TOKEN) in X-Admin-Token.
+
+    Args:
+        model (str): Name of the model
+        swap (ModelSwap): The new version and the warmup samples
+        request (Request): The request, carrying the admin token
+
+    Returns:
+        json: The state of the swap, see /admin/models/swaps
+    """
+    check_admin_token(request)
+    if not registry.is_enabled(model):
+        raise HTTPException(status_code=404,
+                            detail=f"Model {model} is not enabled")
+    try:
+        return swapper.start(model, swap.version, swap.samples)
+    except (SwapInProgressError, SwapNotSupportedError) as error:
+        raise HTTPException(status_code=409, detail=str(error)) from error
+
+
+@app.get("/admin/models/swaps")
+async def model_swaps():
+    """Returns the state, load and warmup duration and the memory delta
+    of the last swap of every model.
+
+    Returns:
+        json: {model: {"state": ..., "load_seconds": ..., ...}, ...}
+    """
+    return swapper.status()
+
+
+@app.get("/cache")
+async def cache_stats():
+    """Returns the hit and miss counters of the extraction cache.
+
+    Returns:
+        json: hits, misses, hit_ratio, entries and max_entries
+    """
+    return cache.stats()
+
+
+@app.delete("/cache")
+async def clear_cache():
+    """Removes all results from the extraction cache.
+
+    Returns:
+        str: success message
+    """
+    cache.clear()
+    return "[success]"
+
+
+@app.get("/scheduler")
+async def scheduler_stats():
+    """Returns the batching configuration of the inference scheduler and
+    how many batches of each size it ran per model.
+
+    Returns:
+        json: window_ms, max_batch_size, max_queue_depth, max_wait_ms,
+              batch_sizes and rejections
+    """
+    return scheduler.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Returns the request, inference, cache and memory metrics of the api
+    in the Prometheus text format.
+
+    Returns:
+        str: The metrics
+    """
+    # Values owned by other modules are read when the metrics are requested
+    metrics.QUEUE_DEPTH.clear()
+    for model, depth in scheduler.queue_depths().items():
+        metrics.QUEUE_DEPTH.set(depth, model=model)
+
+    cache_stats = cache.stats()
+    metrics.CACHE_HITS.set(cache_stats["hits"])
+    metrics.CACHE_MISSES.set(cache_stats["misses"])
+    metrics.CACHE_HIT_RATIO.set(cache_stats["hit_ratio"])
+    metrics.CACHE_ENTRIES.set(cache_stats["entries"])
+
+    # The phrase caches are only imported once KeyBERT ran
+    metrics.PHRASE_CACHE_ENTRIES.clear()
+    if "phrase_cache" in sys.modules:
+        phrase_caches = sys.modules["phrase_cache"].get_phrase_cache_stats()
+        for encoder, phrase_stats in phrase_caches.items():
+            metrics.PHRASE_CACHE_HITS.set(phrase_stats["hits"],
+                                          encoder=encoder)
+            metrics.PHRASE_CACHE_MISSES.set(phrase_stats["misses"],
+                                            encoder=encoder)
+            metrics.PHRASE_CACHE_HIT_RATIO.set(phrase_stats["hit_ratio"],
+                                               encoder=encoder)
+            for store in ("memory", "disk"):
+                metrics.PHRASE_CACHE_ENTRIES.set(
+                    phrase_stats[f"{store}_entries"], encoder=encoder,
+                    store=store)
+
+    metrics.MODEL_MEMORY.clear()
+    for resident in registry.residency()["resident"]:
+        metrics.MODEL_MEMORY.set((resident["memory_mb"] or 0) * MEGABYTE,
+                                 model=resident["model"])
+    metrics.PROCESS_MEMORY.set(psutil.Process().memory_info().rss)
+
+    return PlainTextResponse(metrics.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
 @app.get("/get_competency/{abstract}")
-def get_competency(abstract: str):
+async def get_competency(abstract: str):
     """Standard endpoint for extracting competencies from an abstract.
     Optimized for best possible results. This endpoint is also visualized
     in the playground.
@@ -35,11 +372,12 @@ def get_competency(abstract: str):
     Args:
         abstract (str): An abstract from which competencies are extracted
     """
-    return get_competency_from_backend(abstract)
+    # The default parameters of KeyBERT are the optimized ones
+    return (await extract_async("keybert", [abstract]))[0]
 
 
 @app.get("/get_category_of_competency/{competency}")
-def get_category(competency: str):
+async def get_category(competency: str):
     """Endpoint for getting the category of a specific competency. Returns
     the id of the category.
 
@@ -49,7 +387,8 @@ def get_category(competency: str):
     Returns:
         int: id of the category
     """
-    return get_category_of_competency(competency)
+    return await call_async("category", get_category_of_competency,
+                            competency)
 
 
 @app.get("/ask_gpt_neo/{abstract}")
@@ -63,7 +402,7 @@ async def gpt_neo(abstract: str):
     Returns:
         string: Response from the model
     """
-    return ask_gpt_neo(abstract)
+    return (await extract_async("gpt_neo", [abstract]))[0]
 
 
 @app.get("/ask_pegasus/{abstract}")
@@ -73,7 +412,7 @@ async def pegasus(abstract: str):
     Returns:
         string: Response from the model
     """
-    return ask_pegasus(abstract)
+    return await call_async("pegasus", ask_pegasus, abstract)
 
 
 @app.get("/get_mock_competency/")
@@ -94,7 +433,7 @@ async def galactica(abstract: str):
     Returns:
         string: The model's response to the prompt.
     """
-    return ask_galactica(abstract)
+    return (await extract_async("galactica", [abstract]))[0]
 
 
 @app.get("/ask_xlnet/{abstract}")
@@ -105,7 +444,7 @@ async def xlnet(abstract: str):
     Returns:
         string: The model's response to the prompt.
     """
-    return ask_xlnet(abstract)
+    return await call_async("xlnet", ask_xlnet, abstract)
 
 
 @app.get("/ask_bloom/{abstract}")
@@ -118,7 +457,22 @@ async def bloom(abstract: str):
     Returns:
         string: The model's response to the prompt.
     """
-    return ask_bloom(abstract)
+    return (await extract_async("bloom", [abstract]))[0]
+
+
+@app.get("/ask_synthetic/{abstract}")
+async def synthetic(abstract: str):
+    """Returns deterministic synthetic competencies with relevancies and
+    category ids without running a language model. Meant for testing the
+    build pipeline.
+
+    Args:
+        abstract (str): Text of the abstract
+
+    Returns:
+        list: [(competency, relevancy, category id), ...]
+    """
+    return (await extract_and_categorize("synthetic", [abstract]))[0]
 
 
 @app.get("/ask_keybert/{abstract}")
@@ -129,4 +483,412 @@ async def keybert(abstract: str):
     Returns:
         list: The model's response to the prompt.
     """
-    return ask_keybert(abstract)
+    return (await extract_async("keybert", [abstract]))[0]
+
+
+# Parameters that must be positive, e.g. a batch size of 0 never ends
+POSITIVE_PARAMETERS = ("batch_size",)
+
+
+def _check_value(name: str, value, parameter: inspect.Parameter):
+    """Checks a parameter value against the annotation or the default
+    value of the function parameter.
+
+    Raises:
+        TypeError: If the value has the wrong type
+        ValueError: If the value is out of range
+    """
+    expected = parameter.annotation
+    if expected is inspect.Parameter.empty:
+        if parameter.default in (None, inspect.Parameter.empty):
+            return
+        expected = type(parameter.default)
+    if value is None and parameter.default is None:
+        return
+
+    # json has no tuples, and integers are valid floats
+    allowed = {float: (int, float), tuple: (list, tuple),
+               list: (list, tuple)}.get(expected, (expected,))
+    if not isinstance(value, allowed) or (isinstance(value, bool)
+                                          and expected is not bool):
+        raise TypeError(f"{name} must be of type {expected.__name__}, "
+                        f"not {type(value).__name__}")
+
+    if isinstance(parameter.default, tuple):
+        if len(value) != len(parameter.default):
+            raise ValueError(f"{name} must have {len(parameter.default)} "
+                             f"elements")
+        for element, default in zip(value, parameter.default):
+            _check_value(name, element, inspect.Parameter(
+                name, inspect.Parameter.KEYWORD_ONLY, default=default))
+    elif expected in (int, float) and value < 0:
+        raise ValueError(f"{name} must not be negative")
+    if name in POSITIVE_PARAMETERS and value <= 0:
+        raise ValueError(f"{name} must be positive")
+
+
+def check_parameters(function, parameters: dict, model: str):
+    """Checks that a model function accepts the parameters of a request
+    in addition to the text it is called with. The values must match the
+    type annotations, or the type of the defaults, of the function. A
+    model_version is only accepted if the registry allows requests to use
+    it, so a request can't make the api download and keep arbitrary
+    checkpoints.
+
+    Args:
+        function (callable): The model function
+        parameters (dict): Keyword arguments from the request
+        model (str): Name of the model the function uses
+
+    Raises:
+        HTTPException: If the function does not accept the parameters
+    """
+    if "on_competency" in parameters:
+        raise HTTPException(status_code=422,
+                            detail="on_competency can't be set by a request")
+    try:
+        signature = inspect.signature(function)
+        signature.bind(None, **parameters)
+        for name, value in parameters.items():
+            parameter = signature.parameters.get(name)
+            # Parameters passed on to e.g. model.generate are not checked
+            if parameter is not None and parameter.kind not in (
+                    inspect.Parameter.VAR_POSITIONAL,
+                    inspect.Parameter.VAR_KEYWORD):
+                _check_value(name, value, parameter)
+    except (TypeError, ValueError) as error:
+        raise HTTPException(status_code=422, detail=str(error)) from error
+
+    if ("model_version" in parameters and not registry.is_version_allowed(
+            model, parameters["model_version"])):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Version {parameters['model_version']} of {model} is "
+                   f"not served, see /admin/models/{model}/swap")
+
+
+class ExtractionBatch(BaseModel):
+    """Contains the abstracts of a batch extraction, the name of the model
+    and optional parameters of the model's extraction function.
+
+    Args:
+        BaseModel (BaseModel): pydantic basemodel
+    """
+    model: str
+    abstracts: List[str]
+    parameters: dict = {}
+
+
+@app.post("/extract_batch")
+async def extract_batch(batch: ExtractionBatch):
+    """Extracts competencies from a list of abstracts. The abstracts are
+    passed through the model in padded mini-batches.
+
+    Args:
+        batch (ExtractionBatch): model, abstracts and parameters
+
+    Raises:
+        HTTPException: If the model does not support batch extraction
+                       or the parameters are invalid
+
+    Returns:
+        list: [[(competency, score), ...], ...] in the order of the abstracts
+    """
+    enabled = (batch.model in BATCH_EXTRACTORS
+               and registry.is_enabled(batch.model))
+    if not enabled:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown model: {batch.model}")
+    check_parameters(BATCH_EXTRACTORS[batch.model], batch.parameters,
+                     batch.model)
+    return await extract_async(batch.model, batch.abstracts, batch.parameters)
+
+
+@app.post("/extract_and_categorize")
+async def extract_and_categorize_batch(batch: ExtractionBatch):
+    """Extracts competencies from a list of abstracts and returns the
+    category of each competency along with it, so no further requests
+    for the categories are needed.
+
+    Args:
+        batch (ExtractionBatch): model, abstracts and parameters
+
+    Raises:
+        HTTPException: If the model does not support batch extraction
+                       or the parameters are invalid
+
+    Returns:
+        list: [[(competency, score, category id), ...], ...]
+              in the order of the abstracts
+    """
+    enabled = (batch.model in BATCH_EXTRACTORS
+               and registry.is_enabled(batch.model))
+    if not enabled:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown model: {batch.model}")
+    check_parameters(BATCH_EXTRACTORS[batch.model], batch.parameters,
+                     batch.model)
+    return await extract_and_categorize(batch.model, batch.abstracts,
+                                        batch.parameters)
+
+
+class Competencies(BaseModel):
+    """Contains a list of competencies
+
+    Args:
+        BaseModel (BaseModel): pydantic basemodel
+    """
+    competencies: List[str]
+
+
+@app.post("/categories_batch")
+async def categories_batch(competencies: Competencies):
+    """Endpoint for getting the categories of several competencies with
+    one encoder pass.
+
+    Args:
+        competencies (Competencies): the competencies
+
+    Returns:
+        list: ids of the categories in the order of the competencies
+    """
+    return await call_async("category", get_categories_of_competencies,
+                            competencies.competencies)
+
+
+class Text(BaseModel):
+    """Contains the raw text of an abstract or competency and optional
+    parameters of the model function that processes it.
+
+    Args:
+        BaseModel (BaseModel): pydantic basemodel
+    """
+    text: str
+    parameters: dict = {}
+
+
+async def extract_from_body(model: str, body: Text):
+    """Extracts competencies from the text of a request body.
+
+    Args:
+        model (str): Name of the model, one of BATCH_EXTRACTORS
+        body (Text): text and parameters
+
+    Returns:
+        list: [(competency, score), ...]
+    """
+    check_parameters(BATCH_EXTRACTORS[model], body.parameters, model)
+    return (await extract_async(model, [body.text], body.parameters))[0]
+
+
+@app.post("/get_competency")
+async def get_competency_post(body: Text):
+    """POST version of /get_competency/{abstract}. The abstract is sent
+    as raw text in the json body. Parameters are passed on to KeyBERT.
+
+    Args:
+        body (Text): abstract and optional parameters
+    """
+    return await extract_from_body("keybert", body)
+
+
+@app.post("/get_category_of_competency")
+async def get_category_post(body: Text):
+    """POST version of /get_category_of_competency/{competency}.
+
+    Args:
+        body (Text): the competency, parameters are not accepted
+
+    Returns:
+        int: id of the category
+    """
+    check_parameters(get_category_of_competency, body.parameters, "category")
+    return await call_async("category", get_category_of_competency,
+                            body.text)
+
+
+@app.post("/ask_gpt_neo")
+async def gpt_neo_post(body: Text):
+    """POST version of /ask_gpt_neo/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_gpt_neo
+
+    Returns:
+        list: [(competency, score), ...]
+    """
+    return await extract_from_body("gpt_neo", body)
+
+
+@app.post("/ask_pegasus")
+async def pegasus_post(body: Text):
+    """POST version of /ask_pegasus/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_pegasus
+
+    Returns:
+        string: Response from the model
+    """
+    check_parameters(ask_pegasus, body.parameters, "pegasus")
+    return await call_async("pegasus", ask_pegasus, body.text,
+                            **body.parameters)
+
+
+@app.post("/ask_galactica")
+async def galactica_post(body: Text):
+    """POST version of /ask_galactica/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_galactica
+
+    Returns:
+        list: [(competency, score), ...]
+    """
+    return await extract_from_body("galactica", body)
+
+
+@app.post("/ask_xlnet")
+async def xlnet_post(body: Text):
+    """POST version of /ask_xlnet/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_xlnet
+
+    Returns:
+        string: The model's response to the prompt.
+    """
+    check_parameters(ask_xlnet, body.parameters, "xlnet")
+    return await call_async("xlnet", ask_xlnet, body.text,
+                            **body.parameters)
+
+
+@app.post("/ask_bloom")
+async def bloom_post(body: Text):
+    """POST version of /ask_bloom/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_bloom
+
+    Returns:
+        list: [(competency, score), ...]
+    """
+    return await extract_from_body("bloom", body)
+
+
+@app.post("/ask_synthetic")
+async def synthetic_post(body: Text):
+    """POST version of /ask_synthetic/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_synthetic_batch
+
+    Returns:
+        list: [(competency, relevancy, category id), ...]
+    """
+    check_parameters(BATCH_EXTRACTORS["synthetic"], body.parameters,
+                     "synthetic")
+    return (await extract_and_categorize("synthetic", [body.text],
+                                         body.parameters))[0]
+
+
+@app.post("/ask_keybert")
+async def keybert_post(body: Text):
+    """POST version of /ask_keybert/{abstract}.
+
+    Args:
+        body (Text): abstract and optional parameters of ask_keybert
+
+    Returns:
+        list: [(competency, score), ...]
+    """
+    return await extract_from_body("keybert", body)
+
+
+async def server_sent_events(model: str, abstract: str, parameters: dict):
+    """Formats the streamed competencies as server-sent events. Every
+    competency is sent as a json [competency, score] data event, the end
+    of the stream as a "done" event and a failure as an "error" event.
+
+    Args:
+        model (str): Name of the model, one of STREAMING_MODELS
+        abstract (str): Abstract in text format
+        parameters (dict): Parameters of the model's extraction function
+
+    Yields:
+        str: The events
+    """
+    try:
+        async for competency in stream_extraction(model, abstract, parameters):
+            yield f"data: {json.dumps(competency)}\n\n"
+    except Exception as error:
+        yield f"event: error\ndata: {json.dumps(str(error))}\n\n"
+        return
+    yield "event: done\ndata: null\n\n"
+
+
+def stream_response(model: str, abstract: str,
+                    parameters: dict) -> StreamingResponse:
+    """Validates a streaming request and starts the event stream.
+
+    Args:
+        model (str): Name of the model
+        abstract (str): Abstract in text format
+        parameters (dict): Parameters of the model's extraction function
+
+    Raises:
+        HTTPException: If the model can't stream or doesn't accept
+                       the parameters
+        SchedulerOverloadedError: If the lane of the model is full
+
+    Returns:
+        StreamingResponse: text/event-stream of the competencies
+    """
+    if not registry.is_enabled(model):
+        raise HTTPException(status_code=404,
+                            detail=f"Model {model} is not enabled")
+    if model not in STREAMING_MODELS:
+        raise HTTPException(status_code=404,
+                            detail=f"Model {model} does not support "
+                                   f"streaming, use one of "
+                                   f"{', '.join(STREAMING_MODELS)}")
+    check_parameters(BATCH_EXTRACTORS[model], parameters, model)
+    # Once the stream started, an overloaded model can only be reported
+    # as an error event
+    scheduler.check(model)
+    # Proxies must not buffer the events
+    return StreamingResponse(server_sent_events(model, abstract, parameters),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
+
+
+@app.get("/stream/{model}/{abstract}")
+async def stream(model: str, abstract: str):
+    """Streams the competencies a generative model (bloom, galactica or
+    gpt_neo) extracts from an abstract as server-sent events, each
+    competency as soon as it is generated. Usable with EventSource.
+
+    Args:
+        model (str): Name of the model
+        abstract (str): Text of the abstract
+
+    Returns:
+        StreamingResponse: text/event-stream of [competency, score] events
+    """
+    return stream_response(model, abstract, {})
+
+
+@app.post("/stream/{model}")
+async def stream_post(model: str, body: Text):
+    """POST version of /stream/{model}/{abstract}.
+
+    Args:
+        model (str): Name of the model
+        body (Text): abstract and optional parameters of the model's
+                     batch extraction function
+
+    Returns:
+        StreamingResponse: text/event-stream of [competency, score] events
+    """
+    return stream_response(model, body.text, body.parameters)
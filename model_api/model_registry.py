@@ -0,0 +1,635 @@
+"""
+This module keeps the language models of the model_api resident in memory.
+Every model is loaded once, either at startup or on first use, and the
+same handle is shared by all endpoints afterwards. If a memory budget is
+configured, the least recently used models are evicted to make room for
+a model that has to be loaded. Pinned models are never evicted.
+"""
+
+import collections
+import contextlib
+import gc
+import importlib
+import os
+import threading
+import time
+
+import psutil
+
+# Comma separated list of models that are loaded when the api starts
+ENVIRONMENT_VARIABLE_PRELOAD_MODELS = "MODEL_API_PRELOAD_MODELS"
+PRELOAD_MODELS = os.environ.get(ENVIRONMENT_VARIABLE_PRELOAD_MODELS,
+                                "keybert,category")
+
+# Comma separated list of models the deployment serves, all if empty
+ENVIRONMENT_VARIABLE_ENABLED_MODELS = "MODEL_API_ENABLED_MODELS"
+ENABLED_MODELS = os.environ.get(ENVIRONMENT_VARIABLE_ENABLED_MODELS, "")
+
+# Memory in MB the resident models may use, 0 means no limit
+ENVIRONMENT_VARIABLE_MEMORY_BUDGET_MB = "MODEL_API_MEMORY_BUDGET_MB"
+MEMORY_BUDGET_MB = float(os.environ.get(ENVIRONMENT_VARIABLE_MEMORY_BUDGET_MB,
+                                        0))
+
+# Comma separated list of models whose default version is never evicted
+ENVIRONMENT_VARIABLE_PINNED_MODELS = "MODEL_API_PINNED_MODELS"
+PINNED_MODELS = os.environ.get(ENVIRONMENT_VARIABLE_PINNED_MODELS,
+                               "keybert,category")
+
+# Comma separated list of model:version pairs requests may ask for in
+# addition to the served and the resident versions of a model
+ENVIRONMENT_VARIABLE_ALLOWED_VERSIONS = "MODEL_API_ALLOWED_VERSIONS"
+ALLOWED_VERSIONS = os.environ.get(ENVIRONMENT_VARIABLE_ALLOWED_VERSIONS, "")
+
+# Comma separated list of model:MB or model:version:MB pairs, the memory
+# a model is expected to need before it was loaded for the first time
+ENVIRONMENT_VARIABLE_MODEL_MEMORY_MB = "MODEL_API_MODEL_MEMORY_MB"
+MODEL_MEMORY_MB = os.environ.get(ENVIRONMENT_VARIABLE_MODEL_MEMORY_MB, "")
+
+# Directory the Hugging Face hub downloads checkpoints to
+ENVIRONMENT_VARIABLE_HUB_CACHE = "HUGGINGFACE_HUB_CACHE"
+HUB_CACHE = os.environ.get(
+    ENVIRONMENT_VARIABLE_HUB_CACHE,
+    os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub"))
+
+MEGABYTE = 1024 * 1024
+
+# States a model can be in
+STATE_NOT_LOADED = "not_loaded"
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class ModelNotEnabledError(LookupError):
+    """Raised when a model is requested that the deployment doesn't enable."""
+
+
+class _ModelEntry:
+    """Bookkeeping for one loaded (or loading) version of a model."""
+
+    def __init__(self, name: str, version: str):
+        self.name = name
+        self.version = version
+        self.handle = None
+        self.state = STATE_NOT_LOADED
+        self.import_seconds = None
+        self.load_seconds = None
+        self.error = None
+        # Growth of the resident set size while the model was loaded
+        self.memory_bytes = None
+        self.last_used = 0.0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Loads models once and hands out shared handles to them.
+
+    A model is registered with a loader function which receives the
+    model version and returns the handle (e.g. a KeyBERT instance or a
+    tuple of tokenizer and model). The handle is loaded on the first
+    call of get() or by warmup(). It is kept until it is evicted to stay
+    within the memory budget, in which case the next get() loads it again.
+
+    The memory of a model is measured as the growth of the process' resident
+    set size while it is loaded, so models are loaded one at a time. Before
+    a model was loaded for the first time, room is made for an estimate
+    of its size: a configured size, the size given at registration or the
+    size of its checkpoint on disk.
+
+    Args:
+        memory_budget_bytes (int, optional): Memory the resident models may
+                                             use, None means no limit
+        pinned (list, optional): Models whose default version is never
+                                 evicted
+        enabled (list, optional): Models that may be loaded, None means all
+        allowed_versions (list, optional): (model, version) pairs requests
+                                           may ask for besides the served
+                                           and the resident versions
+        memory_estimates (dict, optional): Expected memory in bytes by
+                                           model name or (model, version)
+    """
+
+    def __init__(self, memory_budget_bytes: int = None, pinned: list = None,
+                 enabled: list = None, allowed_versions: list = None,
+                 memory_estimates: dict = None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._memory_estimates = dict(memory_estimates or {})
+        self._registered_estimates = {}
+        self._pinned = set(pinned or [])
+        self._enabled = None if enabled is None else set(enabled)
+        self._allowed_versions = set(allowed_versions or [])
+        self._loaders = {}
+        self._imports = {}
+        self._default_versions = {}
+        self._warmup_seconds = None
+        self._entries = {}
+        self._preload = []
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        # Number of requests using each (name, version)
+        self._users = collections.Counter()
+        self._unused = threading.Condition(self._lock)
+
+    def register(self, name: str, loader, default_version: str,
+                 imports: tuple = (), memory_mb: float = None):
+        """Registers a model.
+
+        Args:
+            name (str): Name under which the model is requested
+            loader (callable): Function loading the model, called with
+                               the model version
+            default_version (str): Version used when no version is requested
+            imports (tuple, optional): Modules the loader needs. They are
+                                       imported (and timed) before the
+                                       model is loaded for the first time.
+            memory_mb (float, optional): Memory the default version is
+                                         expected to need, unless a size
+                                         is configured
+        """
+        self._loaders[name] = loader
+        self._imports[name] = tuple(imports)
+        self._default_versions[name] = default_version
+        if memory_mb is not None:
+            self._registered_estimates[(name, default_version)] = int(
+                memory_mb * MEGABYTE)
+
+    def is_enabled(self, name: str) -> bool:
+        """Checks whether the deployment serves a model.
+
+        Args:
+            name (str): Name of the model
+
+        Returns:
+            bool: True if the model is registered and enabled
+        """
+        return name in self._loaders and (self._enabled is None
+                                          or name in self._enabled)
+
+    def is_version_allowed(self, name: str, version: str) -> bool:
+        """Checks whether a request may ask for a version of a model. Only
+        the served version, resident versions and versions allowed by
+        MODEL_API_ALLOWED_VERSIONS are, other versions are only loaded
+        by an admin swap.
+
+        Args:
+            name (str): Name of the model
+            version (str): Version of the model
+
+        Returns:
+            bool: True if the version may be requested
+        """
+        if version == self._default_versions.get(name):
+            return True
+        if (name, version) in self._allowed_versions:
+            return True
+        with self._lock:
+            entry = self._entries.get((name, version))
+        return entry is not None and entry.handle is not None
+
+    def default_version(self, name: str) -> str:
+        """Returns the version of a model used when no version is requested.
+
+        Args:
+            name (str): Name of the model
+
+        Returns:
+            str: The default version
+        """
+        return self._default_versions[name]
+
+    def set_default_version(self, name: str, version: str):
+        """Changes the version of a model used when no version is
+        requested. Requests that read the default before keep using
+        the previous version.
+
+        Args:
+            name (str): Name of the model
+            version (str): The new default version
+        """
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+        with self._lock:
+            self._default_versions[name] = version
+
+    def get(self, name: str, version: str = None):
+        """Returns the resident handle of a model, loading it if needed.
+
+        Args:
+            name (str): Name of the model
+            version (str, optional): Version of the model. Defaults to the
+                                     version the model was registered with.
+
+        Raises:
+            KeyError: If no model with this name is registered
+            ModelNotEnabledError: If the model is not enabled
+
+        Returns:
+            object: The handle returned by the model's loader
+        """
+        entry = self._get_entry(name, version)
+        entry.last_used = time.monotonic()
+        # The handle is read once, as the model may be evicted at any time
+        handle = entry.handle
+        if handle is not None:
+            return handle
+
+        with entry.lock:
+            # Another thread may have finished loading while we waited
+            if entry.handle is None:
+                self._load(entry)
+            return entry.handle
+
+    def warmup(self, names: list):
+        """Loads the given models in their default version. Models that
+        fail to load are marked as failed and do not stop the warmup.
+        Models that are not enabled are skipped.
+
+        Args:
+            names (list): Names of the models to load
+        """
+        self._preload = [name for name in names if self.is_enabled(name)]
+        start = time.perf_counter()
+        for name in self._preload:
+            try:
+                self.get(name)
+            except Exception as error:
+                print(f"Loading model {name} failed: {error}")
+        self._warmup_seconds = time.perf_counter() - start
+
+        for name, timing in self.startup_report()["models"].items():
+            print(f"Warmup of {name}: import {timing['import_seconds']}s, "
+                  f"load {timing['load_seconds']}s")
+
+    def is_ready(self) -> bool:
+        """Checks whether all preloaded models are loaded.
+
+        Returns:
+            bool: True if every model passed to warmup() is ready
+        """
+        with self._lock:
+            for name in self._preload:
+                key = (name, self._default_versions[name])
+                entry = self._entries.get(key)
+                if entry is None or entry.state != STATE_READY:
+                    return False
+        return True
+
+    def status(self) -> dict:
+        """Returns the state and load time of every known model version.
+
+        Returns:
+            dict: {"name:version": {"state": ..., "load_seconds": ...}, ...}
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+
+        return {f"{entry.name}:{entry.version}": {
+                    "state": entry.state,
+                    "import_seconds": entry.import_seconds,
+                    "load_seconds": entry.load_seconds,
+                    "error": entry.error,
+                    "memory_mb": _to_megabytes(entry.memory_bytes),
+                    "pinned": self._is_pinned(entry),
+                    "evictions": entry.evictions}
+                for entry in entries}
+
+    def startup_report(self) -> dict:
+        """Returns how the startup time is split between importing the
+        libraries and loading the models.
+
+        Returns:
+            dict: enabled models, warmup time and the import and load time
+                  of every loaded model version
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+
+        enabled = [name for name in self._loaders if self.is_enabled(name)]
+        return {"enabled_models": enabled,
+                "preload_models": list(self._preload),
+                "warmup_seconds": self._warmup_seconds,
+                "models": {f"{entry.name}:{entry.version}": {
+                               "import_seconds": entry.import_seconds,
+                               "load_seconds": entry.load_seconds}
+                           for entry in entries
+                           if entry.load_seconds is not None}}
+
+    def residency(self) -> dict:
+        """Returns the memory budget and the resident models, the most
+        recently used first.
+
+        Returns:
+            dict: budget, memory used by the resident models, the resident
+                  models and the eviction count of every model version
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        resident = sorted(self._get_resident(entries),
+                          key=lambda entry: entry.last_used, reverse=True)
+        now = time.monotonic()
+
+        return {"budget_mb": _to_megabytes(self.memory_budget_bytes),
+                "resident_mb": _to_megabytes(
+                    sum(entry.memory_bytes or 0 for entry in resident)),
+                "resident": [{"model": f"{entry.name}:{entry.version}",
+                              "memory_mb": _to_megabytes(entry.memory_bytes),
+                              "pinned": self._is_pinned(entry),
+                              "idle_seconds": now - entry.last_used}
+                             for entry in resident],
+                "evictions": {f"{entry.name}:{entry.version}": entry.evictions
+                              for entry in entries}}
+
+    def resident_handles(self) -> dict:
+        """Returns the handles of the resident models.
+
+        Returns:
+            dict: {"name:version": handle}
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        # The handle is read once, as the model may be evicted at any time
+        handles = {f"{entry.name}:{entry.version}": entry.handle
+                   for entry in entries}
+        return {key: handle for key, handle in handles.items()
+                if handle is not None}
+
+    def memory_bytes(self, name: str, version: str):
+        """Returns the memory a version of a model took when it was loaded.
+
+        Args:
+            name (str): Name of the model
+            version (str): Version of the model
+
+        Returns:
+            int: Growth of the resident set size, None if never loaded
+        """
+        with self._lock:
+            entry = self._entries.get((name, version))
+        return None if entry is None else entry.memory_bytes
+
+    def acquire(self, name: str, version: str = None) -> str:
+        """Marks a version of a model as used by one more request, so
+        unload_when_unused waits until release() is called.
+
+        Args:
+            name (str): Name of the model
+            version (str, optional): Version of the model, the default
+                                     version if None
+
+        Returns:
+            str: The acquired version
+        """
+        # The default is read under the same lock as it is swapped, so a
+        # swap can't unload the version between reading and acquiring it
+        with self._lock:
+            if version is None:
+                version = self._default_versions[name]
+            self._users[name, version] += 1
+        return version
+
+    def release(self, name: str, version: str):
+        """Marks a version of a model as used by one request less.
+
+        Args:
+            name (str): Name of the model
+            version (str): Version of the model
+        """
+        with self._lock:
+            self._users[name, version] -= 1
+            if not self._users[name, version]:
+                del self._users[name, version]
+                self._unused.notify_all()
+
+    @contextlib.contextmanager
+    def use(self, name: str, version: str = None):
+        """Marks a version of a model as used until the with block ends.
+
+        Args:
+            name (str): Name of the model
+            version (str, optional): Version of the model, the default
+                                     version if None
+
+        Yields:
+            str: The used version
+        """
+        version = self.acquire(name, version)
+        try:
+            yield version
+        finally:
+            self.release(name, version)
+
+    def unload_when_unused(self, name: str, version: str):
+        """Waits until no request uses a version of a model anymore and
+        unloads it, so queued requests don't load it again.
+
+        Args:
+            name (str): Name of the model
+            version (str): Version of the model
+        """
+        with self._lock:
+            self._unused.wait_for(lambda: not self._users[name, version])
+        self.unload(name, version)
+
+    def unload(self, name: str, version: str):
+        """Unloads a version of a model, e.g. after another version replaced
+        it. Requests that still use it keep it alive until they finish.
+
+        Args:
+            name (str): Name of the model
+            version (str): Version of the model
+        """
+        with self._lock:
+            entry = self._entries.get((name, version))
+        if entry is None:
+            return
+
+        with entry.lock:
+            if entry.handle is None:
+                return
+            print(f"Unloading model {name}:{version}")
+            entry.state = STATE_NOT_LOADED
+            entry.handle = None
+        gc.collect()
+
+    def _get_entry(self, name: str, version: str = None) -> _ModelEntry:
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+        if not self.is_enabled(name):
+            raise ModelNotEnabledError(
+                f"Model {name} is not enabled, see "
+                f"{ENVIRONMENT_VARIABLE_ENABLED_MODELS}")
+        version = version or self._default_versions[name]
+
+        with self._lock:
+            key = (name, version)
+            if key not in self._entries:
+                self._entries[key] = _ModelEntry(name, version)
+            return self._entries[key]
+
+    def _is_pinned(self, entry: _ModelEntry) -> bool:
+        return (entry.name in self._pinned
+                and entry.version == self._default_versions[entry.name])
+
+    @staticmethod
+    def _get_resident(entries: list) -> list:
+        return [entry for entry in entries if entry.handle is not None]
+
+    def _make_room(self, needed_bytes: int, loading: _ModelEntry):
+        """Evicts the least recently used models until the resident models
+        and needed_bytes fit into the budget (or nothing can be evicted).
+        """
+        if self.memory_budget_bytes is None:
+            return
+
+        with self._lock:
+            entries = list(self._entries.values())
+        resident = [entry for entry in self._get_resident(entries)
+                    if entry is not loading]
+        used = sum(entry.memory_bytes or 0 for entry in resident)
+
+        candidates = sorted((entry for entry in resident
+                             if not self._is_pinned(entry)),
+                            key=lambda entry: entry.last_used)
+        for entry in candidates:
+            if used + needed_bytes <= self.memory_budget_bytes:
+                break
+            # Models that are being loaded right now are skipped
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                used -= entry.memory_bytes or 0
+                self._evict(entry)
+            finally:
+                entry.lock.release()
+
+        if used + needed_bytes > self.memory_budget_bytes:
+            print(f"Memory budget of {_to_megabytes(self.memory_budget_bytes)}"
+                  f" MB exceeded by {loading.name}:{loading.version}, "
+                  f"the remaining models are pinned")
+
+    @staticmethod
+    def _evict(entry: _ModelEntry):
+        print(f"Evicting model {entry.name}:{entry.version}")
+        entry.state = STATE_NOT_LOADED
+        entry.handle = None
+        entry.evictions += 1
+        # Requests that still use the model keep it alive until they finish
+        gc.collect()
+
+    def estimate_memory_bytes(self, name: str, version: str) -> int:
+        """Returns the memory a version of a model is expected to need.
+
+        Args:
+            name (str): Name of the model
+            version (str): Version of the model
+
+        Returns:
+            int: The measured size if the version was loaded before, else
+                 the configured or registered estimate or the size of its
+                 checkpoint on disk, 0 if nothing is known
+        """
+        with self._lock:
+            entry = self._entries.get((name, version))
+        if entry is not None and entry.memory_bytes:
+            return entry.memory_bytes
+        for key in ((name, version), name):
+            if key in self._memory_estimates:
+                return self._memory_estimates[key]
+        if (name, version) in self._registered_estimates:
+            return self._registered_estimates[(name, version)]
+        return _get_checkpoint_bytes(version)
+
+    def _load(self, entry: _ModelEntry):
+        with self._load_lock:
+            # Room is made before loading, the model would otherwise sit
+            # next to all other models for a moment
+            self._make_room(self.estimate_memory_bytes(entry.name,
+                                                       entry.version), entry)
+
+            entry.state = STATE_LOADING
+            entry.error = None
+            process = psutil.Process()
+            rss_before = process.memory_info().rss
+            start = time.perf_counter()
+            try:
+                # Modules that were imported before take no time
+                for module in self._imports[entry.name]:
+                    importlib.import_module(module)
+                entry.import_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                entry.handle = self._loaders[entry.name](entry.version)
+            except Exception as error:
+                entry.state = STATE_FAILED
+                entry.error = str(error)
+                raise
+            entry.load_seconds = time.perf_counter() - start
+            entry.memory_bytes = max(0, process.memory_info().rss - rss_before)
+            entry.last_used = time.monotonic()
+            entry.state = STATE_READY
+
+            # The model may need more memory than estimated
+            self._make_room(entry.memory_bytes, entry)
+
+
+def get_preload_models() -> list:
+    """Returns the models configured to be loaded at startup.
+
+    Returns:
+        list: Names of the models
+    """
+    return _split_names(PRELOAD_MODELS)
+
+
+def _split_names(names: str) -> list:
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def _split_versions(versions: str) -> list:
+    # "bloom:bigscience/bloom-1b1" -> ("bloom", "bigscience/bloom-1b1")
+    return [tuple(pair.split(":", 1)) for pair in _split_names(versions)
+            if ":" in pair]
+
+
+def _split_memory_estimates(estimates: str) -> dict:
+    # "bloom:2300,gpt_neo:EleutherAI/gpt-neo-1.3B:5400"
+    # -> {"bloom": 2300 MB, ("gpt_neo", "EleutherAI/gpt-neo-1.3B"): 5400 MB}
+    result = {}
+    for pair in _split_names(estimates):
+        parts = pair.split(":")
+        if len(parts) not in (2, 3):
+            continue
+        key = parts[0] if len(parts) == 2 else (parts[0], parts[1])
+        result[key] = int(float(parts[-1]) * MEGABYTE)
+    return result
+
+
+def _get_checkpoint_bytes(version: str) -> int:
+    """Returns the size of a checkpoint on disk, either a local directory
+    or a download of the Hugging Face hub, 0 if it is not on disk.
+    """
+    directory = version
+    if not os.path.isdir(directory):
+        directory = os.path.join(
+            HUB_CACHE, "models--" + version.replace("/", "--"), "blobs")
+    size = 0
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return size
+
+
+def _to_megabytes(size_bytes):
+    return None if size_bytes is None else round(size_bytes / MEGABYTE, 1)
+
+
+registry = ModelRegistry(
+    memory_budget_bytes=int(MEMORY_BUDGET_MB * MEGABYTE) or None,
+    pinned=_split_names(PINNED_MODELS),
+    enabled=_split_names(ENABLED_MODELS) or None,
+    allowed_versions=_split_versions(ALLOWED_VERSIONS),
+    memory_estimates=_split_memory_estimates(MODEL_MEMORY_MB))
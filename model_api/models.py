@@ -2,18 +2,40 @@
 This module summarizes the functions used to generate the competencies.
 It contains a multitude of functions that are used to extract competencies
 from abstracts using different language models.
+
+The libraries of a model family (transformers, keybert, ...) are imported
+when a model of the family is loaded for the first time, so a deployment
+only pays for the models it enables.
 """
 
+import hashlib
+import os
 import random
-import galai as gal
-from transformers import (XLNetTokenizer, XLNetForQuestionAnsweringSimple,
-                          BloomForCausalLM, BloomTokenizerFast,
-                          pipeline, AutoTokenizer, OPTForCausalLM)
-from torch import argmax
-from torch.nn import functional as F
-from keybert import KeyBERT
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import re
+import weakref
+
+import inference_pool
+from chunking import (DEFAULT_CHUNK_OVERLAP, DEFAULT_MAX_CHUNK_TOKENS,
+                      ChunkSizeError, get_context_length,
+                      merge_chunk_results, split_abstracts)
+from metrics import (STAGE_FORWARD, STAGE_POSTPROCESS, STAGE_TOKENIZATION,
+                     time_stage)
+from model_registry import registry
+
+# Backend of the sentence encoders used by KeyBERT and the category
+# mapping, either "torch" or "onnx"
+ENVIRONMENT_VARIABLE_ENCODER_BACKEND = "ENCODER_BACKEND"
+ENCODER_BACKEND = os.environ.get(ENVIRONMENT_VARIABLE_ENCODER_BACKEND, "torch")
+
+# Whether the onnx backend uses int8 quantized encoders
+ENVIRONMENT_VARIABLE_ENCODER_ONNX_QUANTIZE = "ENCODER_ONNX_QUANTIZE"
+ENCODER_ONNX_QUANTIZE = os.environ.get(
+    ENVIRONMENT_VARIABLE_ENCODER_ONNX_QUANTIZE, "False") == "True"
+
+# Sentence encoder used by KeyBERT and the category mapping alike, so only
+# one encoder is kept in memory. Empty to use a separate encoder for each.
+ENVIRONMENT_VARIABLE_SHARED_ENCODER = "SHARED_ENCODER"
+SHARED_ENCODER = os.environ.get(ENVIRONMENT_VARIABLE_SHARED_ENCODER, "")
 
 CATEGORIES = ["Mathematics", "Computer and Informations Sciences",
                   "Physical Sciences", "Chemical Sciences",
@@ -35,6 +57,175 @@ CATEGORIES = ["Mathematics", "Computer and Informations Sciences",
                   "Ethics and Religion"]
 
 
+# Instances of the shared encoder, kept as long as a model uses them
+_shared_encoders = weakref.WeakValueDictionary()
+
+
+def _load_sentence_encoder(model_version: str):
+    # The registry loads one model at a time, so the shared encoder
+    # is not loaded twice
+    if model_version == SHARED_ENCODER:
+        encoder = _shared_encoders.get(model_version)
+        if encoder is None:
+            encoder = _create_sentence_encoder(model_version)
+            _shared_encoders[model_version] = encoder
+        return encoder
+    return _create_sentence_encoder(model_version)
+
+
+def _create_sentence_encoder(model_version: str):
+    if ENCODER_BACKEND == "onnx":
+        # Only imported when needed, as onnxruntime is an optional dependency
+        import onnx_encoder
+        return onnx_encoder.load_encoder(model_version,
+                                         quantize=ENCODER_ONNX_QUANTIZE)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_version)
+
+
+def _get_encoder_name(model_version: str) -> str:
+    # Embeddings of different backends differ slightly, so they are
+    # cached separately
+    if ENCODER_BACKEND == "onnx" and ENCODER_ONNX_QUANTIZE:
+        return f"onnx-int8-{model_version}"
+    return f"{ENCODER_BACKEND}-{model_version}"
+
+
+# Models whose results depend on the backend of their sentence encoder
+ENCODER_MODELS = ("keybert", "category")
+
+
+def get_cache_version(model: str, model_version: str) -> str:
+    """Returns the version under which results of a model are cached.
+
+    Args:
+        model (str): Name of the model
+        model_version (str): Version of the model
+
+    Returns:
+        str: The version, including the encoder backend and quantization
+             for models built on a sentence encoder
+    """
+    if model in ENCODER_MODELS:
+        return _get_encoder_name(model_version)
+    return model_version
+
+
+def _load_keybert(model_version: str):
+    from keybert import KeyBERT
+    return KeyBERT(_load_sentence_encoder(model_version))
+
+
+def _load_category_encoder(model_version: str):
+    encoder = _load_sentence_encoder(model_version)
+    # The categories never change, so their normalized embeddings are
+    # computed once and kept as a (categories x dimensions) matrix
+    category_embeddings = encoder.encode(CATEGORIES, normalize_embeddings=True)
+    return encoder, category_embeddings
+
+
+def _load_pegasus(model_version: str):
+    from transformers import pipeline
+    return pipeline("summarization", model=model_version)
+
+
+# Huggingface checkpoints of the galactica versions offered by galai
+GALACTICA_CHECKPOINTS = {"mini": "facebook/galactica-125m",
+                         "base": "facebook/galactica-1.3b",
+                         "standard": "facebook/galactica-6.7b",
+                         "large": "facebook/galactica-30b",
+                         "huge": "facebook/galactica-120b"}
+
+# Number of abstracts passed through a model in one forward pass
+DEFAULT_BATCH_SIZE = 8
+
+
+def _load_galactica(model_version: str):
+    from transformers import AutoTokenizer, OPTForCausalLM
+    checkpoint = GALACTICA_CHECKPOINTS[model_version]
+    tokenizer = AutoTokenizer.from_pretrained(checkpoint)
+    # The galactica tokenizer does not define its padding token
+    tokenizer.pad_token_id = 1
+    tokenizer.padding_side = "left"
+    model = OPTForCausalLM.from_pretrained(checkpoint)
+    return tokenizer, model
+
+
+def _load_xlnet(model_version: str):
+    from transformers import XLNetTokenizer, XLNetForQuestionAnsweringSimple
+    tokenizer = XLNetTokenizer.from_pretrained(model_version)
+    model = XLNetForQuestionAnsweringSimple.from_pretrained(model_version,
+                                                            return_dict=True)
+    return tokenizer, model
+
+
+def _load_bloom(model_version: str):
+    from transformers import BloomForCausalLM, BloomTokenizerFast
+    tokenizer = BloomTokenizerFast.from_pretrained(model_version)
+    tokenizer.padding_side = "left"
+    model = BloomForCausalLM.from_pretrained(model_version)
+    return tokenizer, model
+
+
+def _load_gpt_neo(model_version: str):
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(model_version)
+    # GPT-Neo has no padding token, the end of text token is used instead
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = AutoModelForCausalLM.from_pretrained(model_version)
+    return tokenizer, model
+
+
+# Words the synthetic model doesn't start or end a competency with
+SYNTHETIC_STOP_WORDS = frozenset(
+    "the and for are was has its our can not but all any may new two one "
+    "about also among based been between both from have into more most "
+    "other over paper show shows such than that their these they this "
+    "those through using which while with within were when where will "
+    "study results present presented propose proposed approach method "
+    "methods".split())
+
+
+def _load_synthetic(model_version: str):
+    # The synthetic model has nothing to load, its version seeds the
+    # random generator, so another version gives other competencies
+    return model_version
+
+
+# Modules each model family needs, imported before its first model is loaded
+ENCODER_IMPORTS = (("onnx_encoder",) if ENCODER_BACKEND == "onnx"
+                   else ("sentence_transformers",))
+KEYBERT_IMPORTS = ENCODER_IMPORTS + ("keybert",
+                                     "sklearn.feature_extraction.text",
+                                     "phrase_cache")
+TRANSFORMERS_IMPORTS = ("torch", "transformers")
+GENERATION_IMPORTS = TRANSFORMERS_IMPORTS + ("generation",)
+
+registry.register("keybert", _load_keybert,
+                  SHARED_ENCODER or "distilbert-base-nli-mean-tokens",
+                  imports=KEYBERT_IMPORTS)
+registry.register("category", _load_category_encoder,
+                  SHARED_ENCODER or "bert-base-nli-mean-tokens",
+                  imports=ENCODER_IMPORTS)
+if SHARED_ENCODER:
+    # The tokenizer of the encoder must not be used by two threads at once
+    inference_pool.share_lock("category", "keybert")
+# The memory estimates (MB) of the default versions are only used until a
+# model was loaded once. The encoders are estimated by their checkpoints.
+registry.register("pegasus", _load_pegasus, "google/pegasus-xsum",
+                  imports=TRANSFORMERS_IMPORTS, memory_mb=2300)
+registry.register("galactica", _load_galactica, "mini",
+                  imports=GENERATION_IMPORTS, memory_mb=550)
+registry.register("xlnet", _load_xlnet, "xlnet-base-cased",
+                  imports=TRANSFORMERS_IMPORTS, memory_mb=500)
+registry.register("bloom", _load_bloom, "bigscience/bloom-560m",
+                  imports=GENERATION_IMPORTS, memory_mb=2300)
+registry.register("gpt_neo", _load_gpt_neo, "EleutherAI/gpt-neo-125M",
+                  imports=GENERATION_IMPORTS, memory_mb=550)
+registry.register("synthetic", _load_synthetic, "1", memory_mb=0)
+
+
 def get_competency_from_backend(abstract: str):
     """Returns a list of competencies using KeyBERT with optimized paramters.
 
@@ -44,23 +235,19 @@ def get_competency_from_backend(abstract: str):
     Returns:
         list: list in the form of [(competency, score), ...]
     """
-    kw_model = KeyBERT("distilbert-base-nli-mean-tokens")
-    keywords = kw_model.extract_keywords(abstract,
-                                         keyphrase_ngram_range=(1, 2),
-                                         use_mmr=True, diversity=0.5)
-
-    filtered_keywords = list(filter(lambda x: x[1] > 0.4, keywords))
-    return filtered_keywords
+    return ask_keybert(abstract, use_mmr=True, diversity=0.5,
+                       keyphrase_ngram_range=(1, 2), minimum_relevancy=0.4)
 
 
-def ask_pegasus(abstract: str):
+def ask_pegasus(abstract: str, max_length: int = 2000):
     """Summarizes a given abstract.
 
     Args:
         abstract (str): A scientific abstract in text format
+        max_length (int): Maximum length of the summary in tokens
     """
-    summarizer = pipeline("summarization", model="google/pegasus-xsum")
-    answer = summarizer(abstract, max_length=2000)[0]["summary_text"]
+    summarizer = registry.get("pegasus")
+    answer = summarizer(abstract, max_length=max_length)[0]["summary_text"]
     return answer
 
 
@@ -78,38 +265,23 @@ def get_mock_competency():
     return random.choice(competence_list)
 
 
-def ask_galactica(abstract: str, max_length_output: int = 512,
-                  max_length_competencies: int = 4,
-                  min_length_competencies: int = 1,
-                  model_version: str = "mini"):
-    """Returns galactica's answer to being asked what competencies an
-    abstract author has.
+def _clean_competencies(text: str, min_length_competencies: int,
+                        max_length_competencies: int) -> list:
+    """Turns the comma separated text generated by a language model into
+    a list of competencies.
 
     Args:
-        abstract (str): A scientific abstract in text format
-        max_length_output (int, optional): Maximum length in
-                                           tokens of the generated text
-                                           (including prompt).
-        min_length_competencies (int, optional): Minimum number of words
-                                                 in a competency.
-        max_length_competencies (int, optional): Maximum number of words
-                                                 in a competency.
-        model_version (str, optional): The version of the model to use.
-                                       Available versions are "mini" (125M),
-                                       base (1.3 B), standard (6.7 B),
-                                       large (30 B) and huge (120 B).
+        text (str): Generated text without the prompt
+        min_length_competencies (int): Minimum number of words
+                                       in a competency.
+        max_length_competencies (int): Maximum number of words
+                                       in a competency.
 
     Returns:
         list: list in the form of [(competency, score), ...]
     """
-    model = gal.load_model(name=model_version)
-
-    prompt = f"Extract keywords from this abstract:{abstract} \n\n Keywords:"
-
-    # Generate keywords and refactor them to list
-    competency_list = model.generate(prompt,
-                                     max_length_output).replace(prompt,
-                                                                "").split(',')
+    # Split into single competencies
+    competency_list = text.split(',')
 
     # Remove unnecessary whitespaces
     competency_list = [competency.strip() for competency in competency_list]
@@ -139,8 +311,187 @@ def ask_galactica(abstract: str, max_length_output: int = 512,
     return competency_list
 
 
-def ask_xlnet(abstract: str,
-              question: str = "What keyword is mentioned in the abstract?"):
+def _get_competency_callback(on_competency, min_length_competencies: int,
+                             max_length_competencies: int, owners: list):
+    """Wraps a streaming callback, so it only receives competencies that
+    pass _clean_competencies and each competency only once per abstract.
+
+    Args:
+        on_competency (callable): Called with the index of the abstract
+                                  and a (competency, score) tuple
+        min_length_competencies (int): Minimum number of words
+                                       in a competency.
+        max_length_competencies (int): Maximum number of words
+                                       in a competency.
+        owners (list): Index of the abstract of each chunk
+
+    Returns:
+        callable: Callback for generate_batch, or None
+    """
+    if on_competency is None:
+        return None
+
+    seen = {}
+
+    def callback(chunk_index: int, text: str):
+        index = owners[chunk_index]
+        for competency in _clean_competencies(text, min_length_competencies,
+                                              max_length_competencies):
+            if competency[0] not in seen.setdefault(index, set()):
+                seen[index].add(competency[0])
+                on_competency(index, competency)
+
+    return callback
+
+
+def _generate_competencies(model_name: str, tokenizer, model, prefix: str,
+                           body_format: str, abstracts: list,
+                           max_new_tokens: int, max_competencies: int,
+                           min_length_competencies: int,
+                           max_length_competencies: int, batch_size: int,
+                           max_chunk_tokens: int, chunk_overlap: int,
+                           on_competency=None, **generation_kwargs) -> list:
+    """Extracts competencies with a generative model. Abstracts that don't
+    fit into the model's context next to the prompt and the generated
+    tokens are split into chunks, which are generated in the same batch.
+
+    Args:
+        model_name (str): Name of the model
+        tokenizer (PreTrainedTokenizer): Tokenizer of the model
+        model (PreTrainedModel): A causal language model
+        prefix (str): Start of the prompt
+        body_format (str): Rest of the prompt, {} is replaced by the abstract
+        abstracts (list): Abstracts in text format
+        max_new_tokens (int): Maximum number of generated tokens
+        max_competencies (int): Maximum number of competencies
+        min_length_competencies (int): Minimum number of words
+                                       in a competency
+        max_length_competencies (int): Maximum number of words
+                                       in a competency
+        batch_size (int): Number of prompts generated in one pass
+        max_chunk_tokens (int): Maximum number of abstract tokens per prompt
+        chunk_overlap (int): Number of tokens consecutive chunks share
+        on_competency (callable, optional): Streaming callback
+        **generation_kwargs: Arguments passed on to model.generate
+
+    Returns:
+        list: [[(competency, score), ...], ...] in the order of abstracts
+    """
+    from generation import generate_batch
+
+    prompt = prefix + body_format.format("")
+    prompt_tokens = len(tokenizer(prompt)["input_ids"])
+    context_length = get_context_length(model)
+    if prompt_tokens + max_new_tokens >= context_length:
+        raise ChunkSizeError(
+            f"The prompt ({prompt_tokens} tokens) and max_new_tokens "
+            f"({max_new_tokens}) leave no room for the abstract in the "
+            f"context of {context_length} tokens")
+    max_chunk_tokens = min(max_chunk_tokens,
+                           context_length - prompt_tokens - max_new_tokens)
+    chunks, owners = split_abstracts(tokenizer, abstracts, max_chunk_tokens,
+                                     chunk_overlap)
+
+    bodies = [body_format.format(chunk) for chunk in chunks]
+    results = generate_batch(tokenizer, model, prefix, bodies, batch_size,
+                             max_new_tokens, max_competencies,
+                             max_length_competencies,
+                             _get_competency_callback(
+                                 on_competency, min_length_competencies,
+                                 max_length_competencies, owners),
+                             model_name=model_name, **generation_kwargs)
+
+    results = [_clean_competencies(result, min_length_competencies,
+                                   max_length_competencies)
+               for result in results]
+    merged = merge_chunk_results(results, owners, len(abstracts))
+    # Chunks of one abstract may add up to more competencies
+    return [competencies[:max_competencies] for competencies in merged]
+
+
+def ask_galactica(abstract: str, max_new_tokens: int = 128,
+                  max_competencies: int = 20,
+                  max_length_competencies: int = 4,
+                  min_length_competencies: int = 1,
+                  model_version: str = None):
+    """Returns galactica's answer to being asked what competencies an
+    abstract author has.
+
+    Args:
+        abstract (str): A scientific abstract in text format
+        max_new_tokens (int, optional): Maximum number of generated
+                                        tokens (without prompt), the
+                                        budget adapts to the abstract.
+        max_competencies (int, optional): Maximum number of competencies.
+        min_length_competencies (int, optional): Minimum number of words
+                                                 in a competency.
+        max_length_competencies (int, optional): Maximum number of words
+                                                 in a competency.
+        model_version (str, optional): The version of the model to use.
+                                       Available versions are "mini" (125M),
+                                       base (1.3 B), standard (6.7 B),
+                                       large (30 B) and huge (120 B).
+                                       Defaults to the served version.
+
+    Returns:
+        list: list in the form of [(competency, score), ...]
+    """
+    return ask_galactica_batch([abstract],
+                               max_new_tokens=max_new_tokens,
+                               max_competencies=max_competencies,
+                               max_length_competencies=max_length_competencies,
+                               min_length_competencies=min_length_competencies,
+                               model_version=model_version)[0]
+
+
+def ask_galactica_batch(abstracts: list, max_new_tokens: int = 128,
+                        max_competencies: int = 20,
+                        max_length_competencies: int = 4,
+                        min_length_competencies: int = 1,
+                        model_version: str = None,
+                        batch_size: int = DEFAULT_BATCH_SIZE,
+                        max_chunk_tokens: int = DEFAULT_MAX_CHUNK_TOKENS,
+                        chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                        on_competency=None):
+    """Batched version of ask_galactica.
+
+    Args:
+        abstracts (list): Scientific abstracts in text format
+        max_new_tokens (int, optional): Maximum number of generated
+                                        tokens (without prompt), the
+                                        budget adapts to the abstract.
+        max_competencies (int, optional): Maximum number of competencies.
+        min_length_competencies (int, optional): Minimum number of words
+                                                 in a competency.
+        max_length_competencies (int, optional): Maximum number of words
+                                                 in a competency.
+        model_version (str, optional): The version of the model to use,
+                                       defaults to the served version.
+        batch_size (int, optional): Number of abstracts generated in one pass
+        max_chunk_tokens (int, optional): Longer abstracts are split into
+                                          chunks of this many tokens
+        chunk_overlap (int, optional): Number of tokens consecutive
+                                       chunks share
+        on_competency (callable, optional): Called with the index of the
+                                            abstract and each competency
+                                            as soon as it is generated
+
+    Returns:
+        list: [[(competency, score), ...], ...] in the order of abstracts
+    """
+    tokenizer, model = registry.get("galactica", model_version)
+    return _generate_competencies(
+        "galactica", tokenizer, model, "Extract keywords from this abstract:",
+        "{} \n\n Keywords:", abstracts, max_new_tokens, max_competencies,
+        min_length_competencies, max_length_competencies, batch_size,
+        max_chunk_tokens, chunk_overlap, on_competency)
+
+
+# Question XLNet answers with a competency of the abstract
+XLNET_QUESTION = "What keyword is mentioned in the abstract?"
+
+
+def ask_xlnet(abstract: str, question: str = XLNET_QUESTION):
     """Generates an answer to the question "What competency is mentioned in
     the abstract?" using XLNet.
 
@@ -150,9 +501,10 @@ def ask_xlnet(abstract: str,
     Returns:
         list: A list of competencies generated by XLNet
     """
-    tokenizer = XLNetTokenizer.from_pretrained("xlnet-base-cased")
-    model = XLNetForQuestionAnsweringSimple.from_pretrained("xlnet-base-cased",
-                                                            return_dict=True)
+    from torch import argmax
+    from torch.nn import functional as F
+
+    tokenizer, model = registry.get("xlnet")
     inputs = tokenizer.encode_plus(question, abstract,
                                    return_tensors='pt')
     output = model(**inputs)
@@ -163,12 +515,63 @@ def ask_xlnet(abstract: str,
     return answer
 
 
+def ask_xlnet_batch(abstracts: list,
+                    question: str = XLNET_QUESTION,
+                    batch_size: int = DEFAULT_BATCH_SIZE,
+                    max_chunk_tokens: int = DEFAULT_MAX_CHUNK_TOKENS,
+                    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                    model_version: str = None):
+    """Batched version of ask_xlnet. The answer for each abstract is
+    returned as a competency list with a single entry, long abstracts
+    get one answer per chunk.
+
+    Args:
+        abstracts (list): Scientific abstracts in text format
+        question (str): The question asked about each abstract
+        batch_size (int, optional): Number of abstracts passed through
+                                    the model in one pass
+        max_chunk_tokens (int, optional): Longer abstracts are split into
+                                          chunks of this many tokens
+        chunk_overlap (int, optional): Number of tokens consecutive
+                                       chunks share
+        model_version (str, optional): The version of the model to use,
+                                       defaults to the served version
+
+    Returns:
+        list: [[(answer, -1), ...], ...] in the order of abstracts
+    """
+    from torch import argmax, no_grad
+
+    tokenizer, model = registry.get("xlnet", model_version)
+    chunks, owners = split_abstracts(tokenizer, abstracts, max_chunk_tokens,
+                                     chunk_overlap)
+    results = []
+
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        with time_stage("xlnet", STAGE_TOKENIZATION):
+            inputs = tokenizer([question] * len(batch), batch,
+                               return_tensors="pt", padding=True)
+        with no_grad(), time_stage("xlnet", STAGE_FORWARD):
+            output = model(**inputs)
+        with time_stage("xlnet", STAGE_POSTPROCESS):
+            start_max = argmax(output.start_logits, dim=-1)
+            # Add one because of python list indexing
+            end_max = argmax(output.end_logits, dim=-1) + 1
+            for input_ids, answer_start, answer_end in zip(
+                    inputs["input_ids"], start_max, end_max):
+                answer = tokenizer.decode(input_ids[answer_start: answer_end])
+                results.append([(answer, -1)] if answer else [])
+    return merge_chunk_results(results, owners, len(abstracts))
+
+
 def ask_bloom(abstract: str,
               method: int = 0,
-              max_length_output: int = 512,
+              max_new_tokens: int = 128,
+              max_competencies: int = 20,
               max_length_competencies: int = 4,
               min_length_competencies: int = 1,
-              model_version: str = "bigscience/bloom-560m"
+              model_version: str = None
 
               ):
     """Generates an answer to the question "What competency is mentioned in
@@ -182,76 +585,88 @@ def ask_bloom(abstract: str,
                                        in a competency.
         min_length_competencies (int): Minimum number of words
                                        in a competency.
-        max_length_output (int): Maximum length in tokens of the
-                                    generated text (including prompt).
-        model_version (str): The version of the model to use.
+        max_new_tokens (int): Maximum number of generated tokens
+                              (without prompt), the budget adapts
+                              to the abstract.
+        max_competencies (int): Maximum number of competencies.
+        model_version (str): The version of the model to use,
+                             defaults to the served version.
 
     Returns:
         list: [(competency, score), ...]
     """
-    model = BloomForCausalLM.from_pretrained(model_version)
-    tokenizer = BloomTokenizerFast.from_pretrained(
-        model_version)
-    prompt = f"Extract keywords from the following abstract: {abstract} \n\n Keywords:"
-    inputs = tokenizer(prompt, return_tensors="pt")
-
-    result = ""
-
-    if method == 0:
-        # Greedy Search
-        result = tokenizer.decode(model.generate(inputs["input_ids"],
-                                  max_length=max_length_output)[0])
-    elif method == 1:
-        # Beam Search
-        result = tokenizer.decode(model.generate(inputs["input_ids"],
-                                  max_length=max_length_output,
-                                  num_beams=2,
-                                  no_repeat_ngram_size=2,
-                                  early_stopping=True)[0])
-    elif method == 2:
-        # Sampling Top-k + Top-p
-        result = tokenizer.decode(model.generate(inputs["input_ids"],
-                                                 max_length=max_length_output,
-                                                 do_sample=True,
-                                                 top_k=50,
-                                                 top_p=0.9)[0])
-
-    # Reomve prompt from result
-    result = result.replace(prompt, "")
-
-    # Split into single competencies
-    competency_list = result.split(',')
-
-    # Remove duplicates
-    competency_list = list(dict.fromkeys(competency_list))
-
-    # Remove empty strings
-    competency_list = list(filter(None, competency_list))
+    return ask_bloom_batch([abstract], method=method,
+                           max_new_tokens=max_new_tokens,
+                           max_competencies=max_competencies,
+                           max_length_competencies=max_length_competencies,
+                           min_length_competencies=min_length_competencies,
+                           model_version=model_version)[0]
+
+
+def ask_bloom_batch(abstracts: list,
+                    method: int = 0,
+                    max_new_tokens: int = 128,
+                    max_competencies: int = 20,
+                    max_length_competencies: int = 4,
+                    min_length_competencies: int = 1,
+                    model_version: str = None,
+                    batch_size: int = DEFAULT_BATCH_SIZE,
+                    max_chunk_tokens: int = DEFAULT_MAX_CHUNK_TOKENS,
+                    chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                    on_competency=None):
+    """Batched version of ask_bloom.
 
-    # Lowercase all competencies
-    competency_list = [competency.lower() for competency in competency_list]
-
-    # Remove all competencies with less than min_length_competencies words
-    competency_list = list(filter(
-        lambda x: len(x.split()) >= min_length_competencies,
-        competency_list))
+    Args:
+        abstracts (list): Abstracts in text format
+        method (int): The method to use for generating the answer
+                      (0: Greedy Search, 1: Beam Search, 2: Sampling)
+        max_length_competencies (int): Maximum number of words
+                                       in a competency.
+        min_length_competencies (int): Minimum number of words
+                                       in a competency.
+        max_new_tokens (int): Maximum number of generated tokens
+                              (without prompt), the budget adapts
+                              to the abstract.
+        max_competencies (int): Maximum number of competencies.
+        model_version (str): The version of the model to use,
+                             defaults to the served version.
+        batch_size (int, optional): Number of abstracts generated in one pass
+        max_chunk_tokens (int, optional): Longer abstracts are split into
+                                          chunks of this many tokens
+        chunk_overlap (int, optional): Number of tokens consecutive
+                                       chunks share
+        on_competency (callable, optional): Called with the index of the
+                                            abstract and each competency
+                                            as soon as it is generated
 
-    # Remove all competencies with more than max_length_competencies words
-    competency_list = list(filter(
-        lambda x: len(x.split()) <= max_length_competencies,
-        competency_list))
+    Returns:
+        list: [[(competency, score), ...], ...] in the order of abstracts
+    """
+    tokenizer, model = registry.get("bloom", model_version)
 
-    # Set the score of each competency to -1 (default relevancy
-    # for all models that do not calculate relevancy)
-    competency_list = [(competency, -1) for competency in competency_list]
+    generation_kwargs = {}
+    if method == 1:
+        # Beam Search
+        generation_kwargs.update(num_beams=2, no_repeat_ngram_size=2,
+                                 early_stopping=True)
+    elif method == 2:
+        # Sampling Top-k + Top-p
+        generation_kwargs.update(do_sample=True, top_k=50, top_p=0.9)
+    # Greedy Search otherwise
 
-    return competency_list
+    return _generate_competencies(
+        "bloom", tokenizer, model,
+        "Extract keywords from the following abstract:",
+        " {} \n\n Keywords:", abstracts, max_new_tokens, max_competencies,
+        min_length_competencies, max_length_competencies, batch_size,
+        max_chunk_tokens, chunk_overlap, on_competency, **generation_kwargs)
 
 
 def ask_keybert(abstract: str, use_mmr: bool = True,
                 diversity: float = 0.5,
                 keyphrase_ngram_range: tuple = (1, 2),
-                minimum_relevancy: float = 0.4):
+                minimum_relevancy: float = 0.4,
+                max_competencies: int = 5):
     """Extracts keywords from an abstract using KeyBert.
 
     Args:
@@ -260,20 +675,110 @@ def ask_keybert(abstract: str, use_mmr: bool = True,
         diversity (float): The diversity of the keywords
         keyphrase_ngram_range (tuple): The range of ngrams to use
         minimum_relevancy (float): The minimum relevancy of a keyword
+        max_competencies (int): Maximum number of keywords
 
     Returns:
         list: [[keyword, relevancy], [keyword, relevancy], ...]
     """
-    kw_model = KeyBERT("distilbert-base-nli-mean-tokens")
-    keywords = kw_model.extract_keywords(
-        abstract,
-        keyphrase_ngram_range=keyphrase_ngram_range,
-        use_mmr=use_mmr, diversity=diversity)
+    return ask_keybert_batch([abstract], use_mmr=use_mmr,
+                             diversity=diversity,
+                             keyphrase_ngram_range=keyphrase_ngram_range,
+                             minimum_relevancy=minimum_relevancy,
+                             max_competencies=max_competencies)[0]
+
+
+def ask_keybert_batch(abstracts: list, use_mmr: bool = True,
+                      diversity: float = 0.5,
+                      keyphrase_ngram_range: tuple = (1, 2),
+                      minimum_relevancy: float = 0.4,
+                      max_competencies: int = 5,
+                      batch_size: int = 32,
+                      max_chunk_tokens: int = DEFAULT_MAX_CHUNK_TOKENS,
+                      chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                      model_version: str = None):
+    """Extracts keywords from multiple abstracts using KeyBert. The
+    abstracts and their candidate keywords are embedded in batches, the
+    embeddings of the candidates are taken from the phrase cache.
+    Abstracts longer than the encoder's sequence length are embedded in
+    chunks, so their end is not cut off.
 
-    # Filter keywords with relevancy below minimum_relevancy
-    filtered_keywords = list(filter(lambda x: x[1] > minimum_relevancy,
-                                    keywords))
-    return filtered_keywords
+    Args:
+        abstracts (list): Scientific abstracts in text format
+        use_mmr (bool): Whether to use MMR to filter keywords
+        diversity (float): The diversity of the keywords
+        keyphrase_ngram_range (tuple): The range of ngrams to use
+        minimum_relevancy (float): The minimum relevancy of a keyword
+        max_competencies (int): Maximum number of keywords per abstract
+        batch_size (int): Number of abstracts handed to KeyBERT at once
+        max_chunk_tokens (int, optional): Longer abstracts are split into
+                                          chunks of this many tokens
+        chunk_overlap (int, optional): Number of tokens consecutive
+                                       chunks share
+        model_version (str, optional): The encoder to use, defaults to
+                                       the served version
+
+    Returns:
+        list: [[[keyword, relevancy], ...], ...] in the order of abstracts
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    from phrase_cache import get_phrase_cache
+
+    # The version is read once, so the phrase cache matches the encoder
+    # even if the served version is swapped meanwhile
+    model_version = model_version or registry.default_version("keybert")
+    kw_model = registry.get("keybert", model_version)
+    phrase_cache = get_phrase_cache(_get_encoder_name(model_version))
+
+    # The encoder truncates longer inputs silently. Its sequence length
+    # includes the start and end token. The sentence transformer is
+    # wrapped by KeyBERT's backend, the ONNX encoder is the backend itself.
+    encoder = (getattr(kw_model.model, "embedding_model", None)
+               or kw_model.model)
+    chunks, owners = abstracts, list(range(len(abstracts)))
+    if getattr(encoder, "tokenizer", None) is not None:
+        if encoder.max_seq_length:
+            max_chunk_tokens = min(max_chunk_tokens,
+                                   encoder.max_seq_length - 2)
+        chunks, owners = split_abstracts(encoder.tokenizer, abstracts,
+                                         max_chunk_tokens, chunk_overlap)
+    results = []
+
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        # The candidates are chosen like KeyBERT does, but only the
+        # candidates that were not embedded before go through the encoder
+        vectorizer = CountVectorizer(
+            ngram_range=tuple(keyphrase_ngram_range), stop_words="english")
+        try:
+            with time_stage("keybert", STAGE_TOKENIZATION):
+                candidates = list(vectorizer.fit(batch)
+                                  .get_feature_names_out())
+        except ValueError:
+            # None of the abstracts contains a candidate
+            results.extend([] for _ in batch)
+            continue
+
+        with time_stage("keybert", STAGE_FORWARD):
+            doc_embeddings = kw_model.model.embed(batch)
+            word_embeddings = phrase_cache.embed(candidates, kw_model.model)
+        with time_stage("keybert", STAGE_POSTPROCESS):
+            keywords = kw_model.extract_keywords(
+                batch, vectorizer=vectorizer,
+                use_mmr=use_mmr, diversity=diversity,
+                top_n=max_competencies,
+                doc_embeddings=doc_embeddings,
+                word_embeddings=word_embeddings)
+        # KeyBERT unpacks the result if only one document is passed
+        if len(batch) == 1:
+            keywords = [keywords]
+        results.extend(keywords)
+
+    # Filter keywords with relevancy below minimum_relevancy. Chunks of
+    # one abstract may add up to more keywords.
+    return [list(filter(lambda x: x[1] > minimum_relevancy,
+                        keywords))[:max_competencies]
+            for keywords in merge_chunk_results(results, owners,
+                                                len(abstracts))]
 
 
 def get_category_of_competency(competence: str):
@@ -283,22 +788,43 @@ def get_category_of_competency(competence: str):
     Args:
         competence (str): The string representation of a competence
     """
-    competency_and_categories = [competence] + CATEGORIES
-    model = SentenceTransformer("bert-base-nli-mean-tokens")
-    categories_embeddings = model.encode(competency_and_categories)
-    similarities = cosine_similarity([categories_embeddings[0]],
-                                     categories_embeddings[1:])
-    # Get index with maximum similarity, convertion to int, as fastapi
-    # cant handle numpy int
-    index = int(similarities[0].argmax())
-    return index
+    return get_categories_of_competencies([competence])[0]
+
+
+def get_categories_of_competencies(competencies: list,
+                                   model_version: str = None) -> list:
+    """Maps each competency to the category with the most similar
+    embedding. All competencies are encoded in one pass and compared to
+    the precomputed category embeddings with one matrix multiplication.
+
+    Args:
+        competencies (list): Competencies in text format
+        model_version (str, optional): The encoder to use, defaults to
+                                       the served version
+
+    Returns:
+        list: ids of the categories in the order of competencies
+    """
+    if not competencies:
+        return []
+
+    encoder, category_embeddings = registry.get("category", model_version)
+    with time_stage("category", STAGE_FORWARD):
+        embeddings = encoder.encode(competencies, normalize_embeddings=True)
+    with time_stage("category", STAGE_POSTPROCESS):
+        # Both sides are normalized, so the dot product is the
+        # cosine similarity
+        similarities = embeddings @ category_embeddings.T
+    # Convertion to int, as fastapi cant handle numpy int
+    return [int(index) for index in similarities.argmax(axis=1)]
 
 
 def ask_gpt_neo(abstract: str,
                 min_length_competencies: int = 1,
                 max_length_competencies: int = 4,
-                max_length_output: int = 512,
-                model_version: str = "EleutherAI/gpt-neo-125M",
+                max_new_tokens: int = 128,
+                max_competencies: int = 20,
+                model_version: str = None,
                 temperature: float = 0.00001):
     """Generates text based on an abstract using GPT-Neo.
 
@@ -308,58 +834,218 @@ def ask_gpt_neo(abstract: str,
                                        a competency in words
         max_length_competencies (int): The maximum length of
                                        a competency in words
-        max_length_output (int): The maximum length of the output
-                                 generated by GPT-Neo
-        model_version (str): The model version to use
+        max_new_tokens (int): The maximum number of tokens generated by
+                              GPT-Neo, the budget adapts to the abstract
+        max_competencies (int): The maximum number of competencies
+        model_version (str): The model version to use, defaults to
+                             the served version
         temperature (float): The temperature to use for sampling
 
 
     Returns:
         list: A list of generated texts
     """
-    prompt = f"Extract keywords from this abstract:{abstract} \n\n Keywords:"
-    generator = pipeline(
-                         "text-generation",
-                         model=model_version,
-                         max_length=max_length_output,
-                         do_sample=True,
-                         temperature=temperature
-                         )
-    response = generator(prompt)[0]['generated_text']
-
-    # Remove prompt and abstract from response
-    response = response.replace(abstract, "")
-    response = response.replace("Extract skills from this abstract:", "")
-    response = response.replace("\n\n Keywords:", "")
-
-    # Split response to get single competencies
-    competency_list = response.split(',')
+    return ask_gpt_neo_batch([abstract],
+                             min_length_competencies=min_length_competencies,
+                             max_length_competencies=max_length_competencies,
+                             max_new_tokens=max_new_tokens,
+                             max_competencies=max_competencies,
+                             model_version=model_version,
+                             temperature=temperature)[0]
+
+
+def ask_gpt_neo_batch(abstracts: list,
+                      min_length_competencies: int = 1,
+                      max_length_competencies: int = 4,
+                      max_new_tokens: int = 128,
+                      max_competencies: int = 20,
+                      model_version: str = None,
+                      temperature: float = 0.00001,
+                      batch_size: int = DEFAULT_BATCH_SIZE,
+                      max_chunk_tokens: int = DEFAULT_MAX_CHUNK_TOKENS,
+                      chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
+                      on_competency=None):
+    """Batched version of ask_gpt_neo.
 
-    # Remove unnecessary whitespaces
-    competency_list = [competency.strip() for competency in competency_list]
+    Args:
+        abstracts (list): Scientific abstracts in text format
+        min_length_competencies (int): The minimum length of
+                                       a competency in words
+        max_length_competencies (int): The maximum length of
+                                       a competency in words
+        max_new_tokens (int): The maximum number of tokens generated by
+                              GPT-Neo, the budget adapts to the abstract
+        max_competencies (int): The maximum number of competencies
+        model_version (str): The model version to use, defaults to
+                             the served version
+        temperature (float): The temperature to use for sampling
+        batch_size (int, optional): Number of abstracts generated in one pass
+        max_chunk_tokens (int, optional): Longer abstracts are split into
+                                          chunks of this many tokens
+        chunk_overlap (int, optional): Number of tokens consecutive
+                                       chunks share
+        on_competency (callable, optional): Called with the index of the
+                                            abstract and each competency
+                                            as soon as it is generated
 
-    # Lowercase all competencies
-    competency_list = [competency.lower() for competency in competency_list]
+    Returns:
+        list: [[(competency, score), ...], ...] in the order of abstracts
+    """
+    tokenizer, model = registry.get("gpt_neo", model_version)
+    return _generate_competencies(
+        "gpt_neo", tokenizer, model, "Extract keywords from this abstract:",
+        "{} \n\n Keywords:", abstracts, max_new_tokens, max_competencies,
+        min_length_competencies, max_length_competencies, batch_size,
+        max_chunk_tokens, chunk_overlap, on_competency,
+        do_sample=True, temperature=temperature)
+
+
+def _get_seed(*parts) -> int:
+    # Python's hash() of a string changes between processes,
+    # so a stable hash is used
+    content = "\x00".join(str(part) for part in parts)
+    return int.from_bytes(hashlib.sha256(content.encode("utf-8")).digest()[:8],
+                          "big")
+
+
+def ask_synthetic(abstract: str, max_competencies: int = 10,
+                  max_length_competencies: int = 2,
+                  minimum_relevancy: float = 0.4):
+    """Returns a synthetic competency list for an abstract without running
+    a language model. The competencies are phrases of the abstract, so they
+    look like KeyBERT's, and the same abstract always gets the same
+    competencies. Meant for testing the build pipeline and load tests.
 
-    # Remove duplicates
-    competency_list = list(dict.fromkeys(competency_list))
+    Args:
+        abstract (str): An abstract in text format
+        max_competencies (int): Maximum number of competencies
+        max_length_competencies (int): Maximum number of words
+                                       in a competency
+        minimum_relevancy (float): Lower bound of the relevancies
 
-    # Add -1 as relevancy for each competency (default value
-    # for models that do not calcute relevancy)
-    competency_list = [(competency, -1) for competency in competency_list]
+    Returns:
+        list: [(competency, relevancy), ...] sorted by relevancy
+    """
+    return ask_synthetic_batch([abstract], max_competencies=max_competencies,
+                               max_length_competencies=max_length_competencies,
+                               minimum_relevancy=minimum_relevancy)[0]
 
-    # Remove empty competencies
-    competency_list = [
-        competency for competency in competency_list if competency[0] != '']
 
-    # Remove all competencies that have more than max_length_competencies words
-    competency_list = [
-        competency for competency in competency_list if len(
-            competency[0].split()) <= max_length_competencies]
+def ask_synthetic_batch(abstracts: list, max_competencies: int = 10,
+                        max_length_competencies: int = 2,
+                        minimum_relevancy: float = 0.4,
+                        batch_size: int = DEFAULT_BATCH_SIZE,
+                        model_version: str = None):
+    """Batched version of ask_synthetic.
 
-    # Remove all competencies that have less than min_length_competencies words
-    competency_list = [
-        competency for competency in competency_list if len(
-            competency[0].split()) >= min_length_competencies]
+    Args:
+        abstracts (list): Abstracts in text format
+        max_competencies (int): Maximum number of competencies
+        max_length_competencies (int): Maximum number of words
+                                       in a competency
+        minimum_relevancy (float): Lower bound of the relevancies
+        batch_size (int, optional): Unused, accepted like by the other
+                                    batch extraction functions
+        model_version (str, optional): Seed of the model, defaults to
+                                       the served version
 
-    return competency_list
+    Returns:
+        list: [[(competency, relevancy), ...], ...] in the order of abstracts
+    """
+    model_version = registry.get("synthetic", model_version)
+    results = []
+
+    for abstract in abstracts:
+        rng = random.Random(_get_seed(model_version,
+                                      " ".join(abstract.lower().split())))
+        words = re.findall(r"[a-z][a-z-]{2,}", abstract.lower())
+
+        # Phrases of consecutive words that neither start nor end
+        # with a stop word
+        phrases = []
+        for start, word in enumerate(words):
+            if word in SYNTHETIC_STOP_WORDS:
+                continue
+            for length in range(1, max_length_competencies + 1):
+                phrase = words[start:start + length]
+                if len(phrase) == length and (
+                        phrase[-1] not in SYNTHETIC_STOP_WORDS):
+                    phrases.append(" ".join(phrase))
+        phrases = list(dict.fromkeys(phrases))
+
+        competencies = rng.sample(phrases, min(max_competencies, len(phrases)))
+        relevancies = sorted((round(rng.uniform(minimum_relevancy, 0.8), 4)
+                              for _ in competencies), reverse=True)
+        results.append(list(zip(competencies, relevancies)))
+    return results
+
+
+def get_keybert_categories(competencies: list) -> list:
+    """Maps competencies extracted by KeyBERT to categories, if KeyBERT
+    and the category mapping share their encoder (SHARED_ENCODER). The
+    embeddings KeyBERT computed for its candidates are taken from the
+    phrase cache, so the competencies are not encoded a second time.
+
+    Args:
+        competencies (list): Competencies in text format
+
+    Returns:
+        list: ids of the categories in the order of competencies
+    """
+    if not competencies:
+        return []
+
+    # One of the encoders may have been swapped for another version
+    model_version = registry.default_version("keybert")
+    if model_version != registry.default_version("category"):
+        return get_categories_of_competencies(competencies)
+
+    import numpy as np
+    from phrase_cache import get_phrase_cache
+
+    kw_model = registry.get("keybert", model_version)
+    _, category_embeddings = registry.get("category", model_version)
+    phrase_cache = get_phrase_cache(_get_encoder_name(model_version))
+    with time_stage("category", STAGE_FORWARD):
+        embeddings = phrase_cache.embed(competencies, kw_model.model)
+    with time_stage("category", STAGE_POSTPROCESS):
+        # The cached embeddings are not normalized, unlike the
+        # category embeddings
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        similarities = (embeddings / np.maximum(norms, 1e-12)
+                        @ category_embeddings.T)
+    # Convertion to int, as fastapi cant handle numpy int
+    return [int(index) for index in similarities.argmax(axis=1)]
+
+
+def get_synthetic_categories(competencies: list) -> list:
+    """Assigns each competency a category derived from its hash, so the
+    same competency always gets the same category.
+
+    Args:
+        competencies (list): Competencies in text format
+
+    Returns:
+        list: ids of the categories in the order of competencies
+    """
+    model_version = registry.get("synthetic")
+    return [_get_seed(model_version, competency) % len(CATEGORIES)
+            for competency in competencies]
+
+
+# Batched extraction functions by the model name used in /extract_batch
+BATCH_EXTRACTORS = {"keybert": ask_keybert_batch,
+                    "bloom": ask_bloom_batch,
+                    "galactica": ask_galactica_batch,
+                    "gpt_neo": ask_gpt_neo_batch,
+                    "xlnet": ask_xlnet_batch,
+                    "synthetic": ask_synthetic_batch}
+
+# Functions assigning categories to competencies by the model name, models
+# without an entry use get_categories_of_competencies
+BATCH_CATEGORIZERS = {"synthetic": get_synthetic_categories}
+if SHARED_ENCODER:
+    BATCH_CATEGORIZERS["keybert"] = get_keybert_categories
+
+# Models whose batch extraction function accepts on_competency
+STREAMING_MODELS = ("bloom", "galactica", "gpt_neo")
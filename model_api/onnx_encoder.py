@@ -0,0 +1,297 @@
+"""
+This module contains the ONNX Runtime backend of the sentence encoders
+used by KeyBERT and the category mapping. An encoder is exported to ONNX
+once (optionally quantized to int8), checked against the PyTorch encoder
+and then served through an ONNX Runtime session.
+
+The encoders can be exported in advance with
+    python onnx_encoder.py distilbert-base-nli-mean-tokens --quantize
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import onnxruntime
+from keybert.backend import BaseEmbedder
+from transformers import AutoTokenizer
+
+import inference_pool
+
+# Directory the exported encoders are stored in
+ENVIRONMENT_VARIABLE_ONNX_DIR = "ENCODER_ONNX_DIR"
+ONNX_DIR = os.environ.get(ENVIRONMENT_VARIABLE_ONNX_DIR, "onnx_models")
+
+# Maximum absolute difference between the normalized embeddings of the
+# ONNX and the PyTorch encoder
+TOLERANCE = 1e-4
+TOLERANCE_QUANTIZED = 5e-2
+
+# Sentences used to compare the ONNX and the PyTorch encoder
+VERIFICATION_SENTENCES = ["machine learning",
+                          "finite element method",
+                          "We study the thermal conductivity of thin films "
+                          "using molecular dynamics simulations."]
+
+
+def _get_directory(model_name: str) -> str:
+    return os.path.join(ONNX_DIR, model_name.replace("/", "_"))
+
+
+def _get_model_path(model_name: str, quantize: bool) -> str:
+    file_name = "model-int8.onnx" if quantize else "model.onnx"
+    return os.path.join(_get_directory(model_name), file_name)
+
+
+def _get_verified_path(model_name: str, quantize: bool) -> str:
+    # Written only after the exported model passed the verification
+    return _get_model_path(model_name, quantize) + ".verified"
+
+
+def export_encoder(model_name: str, quantize: bool = False) -> str:
+    """Exports the transformer of a sentence-transformers model to ONNX.
+
+    Args:
+        model_name (str): Name of the sentence-transformers model
+        quantize (bool): Whether to additionally quantize the weights to int8
+
+    Returns:
+        str: Path of the exported (and possibly quantized) model
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    directory = _get_directory(model_name)
+    os.makedirs(directory, exist_ok=True)
+
+    sentence_transformer = SentenceTransformer(model_name, device="cpu")
+    transformer = sentence_transformer[0].auto_model.eval()
+    tokenizer = sentence_transformer.tokenizer
+
+    class _LastHiddenState(torch.nn.Module):
+        """Returns only the token embeddings of the transformer."""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids,
+                              attention_mask=attention_mask)[0]
+
+    inputs = tokenizer(VERIFICATION_SENTENCES, padding=True,
+                       return_tensors="pt")
+    path = _get_model_path(model_name, quantize=False)
+    with torch.no_grad():
+        torch.onnx.export(_LastHiddenState(transformer),
+                          (inputs["input_ids"], inputs["attention_mask"]),
+                          path,
+                          input_names=["input_ids", "attention_mask"],
+                          output_names=["last_hidden_state"],
+                          dynamic_axes={"input_ids": {0: "batch",
+                                                      1: "sequence"},
+                                        "attention_mask": {0: "batch",
+                                                           1: "sequence"},
+                                        "last_hidden_state": {0: "batch",
+                                                              1: "sequence"}},
+                          opset_version=14)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized_path = _get_model_path(model_name, quantize=True)
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+        path = quantized_path
+
+    tokenizer.save_pretrained(directory)
+    with open(os.path.join(directory, "encoder.json"), "w",
+              encoding="utf-8") as f:
+        json.dump({"max_seq_length": sentence_transformer.max_seq_length}, f)
+    return path
+
+
+class OnnxSentenceEncoder(BaseEmbedder):
+    """Sentence encoder running an exported transformer in ONNX Runtime
+    followed by mean pooling. encode() mirrors SentenceTransformer.encode
+    and embed() makes the encoder usable as a KeyBERT backend.
+
+    Args:
+        model_name (str): Name of the exported sentence-transformers model
+        quantize (bool): Whether to use the int8 quantized model
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False):
+        super().__init__()
+        directory = _get_directory(model_name)
+        with open(os.path.join(directory, "encoder.json"),
+                  encoding="utf-8") as f:
+            self.max_seq_length = json.load(f)["max_seq_length"]
+
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL)
+        options.intra_op_num_threads = inference_pool.threads_per_worker()
+        self.session = onnxruntime.InferenceSession(
+            _get_model_path(model_name, quantize), options,
+            providers=["CPUExecutionProvider"])
+
+    def encode(self, sentences, batch_size: int = 32,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Computes the embeddings of sentences.
+
+        Args:
+            sentences (list or str): The sentences
+            batch_size (int): Number of sentences encoded in one pass
+            normalize_embeddings (bool): Whether to normalize the embeddings
+                                         to length 1
+            **kwargs: Further arguments of SentenceTransformer.encode,
+                      they are ignored
+
+        Returns:
+            np.ndarray: (sentences x dimensions) matrix, or a single vector
+                        if sentences is a string
+        """
+        single_sentence = isinstance(sentences, str)
+        if single_sentence:
+            sentences = [sentences]
+
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(list(sentences[start:start + batch_size]),
+                                    padding=True, truncation=True,
+                                    max_length=self.max_seq_length,
+                                    return_tensors="np")
+            attention_mask = inputs["attention_mask"].astype(np.int64)
+            token_embeddings = self.session.run(
+                None, {"input_ids": inputs["input_ids"].astype(np.int64),
+                       "attention_mask": attention_mask})[0]
+
+            # Mean pooling over the tokens that are not padding
+            mask = attention_mask[:, :, np.newaxis].astype(np.float32)
+            summed = (token_embeddings * mask).sum(axis=1)
+            counts = np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings.append(summed / counts)
+
+        if embeddings:
+            embeddings = np.concatenate(embeddings)
+        else:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+
+        return embeddings[0] if single_sentence else embeddings
+
+    def embed(self, documents: list, verbose: bool = False) -> np.ndarray:
+        """Embeds documents for KeyBERT.
+
+        Args:
+            documents (list): The documents or candidate keywords
+            verbose (bool): Unused, required by KeyBERT
+
+        Returns:
+            np.ndarray: (documents x dimensions) matrix
+        """
+        return self.encode(documents)
+
+
+def verify_encoder(model_name: str, encoder: OnnxSentenceEncoder,
+                   tolerance: float) -> float:
+    """Compares the ONNX encoder with the PyTorch encoder.
+
+    Args:
+        model_name (str): Name of the sentence-transformers model
+        encoder (OnnxSentenceEncoder): The ONNX encoder
+        tolerance (float): Maximum allowed absolute difference between
+                           the normalized embeddings
+
+    Raises:
+        ValueError: If the embeddings differ by more than tolerance
+
+    Returns:
+        float: The maximum absolute difference
+    """
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name, device="cpu").encode(
+        VERIFICATION_SENTENCES, normalize_embeddings=True)
+    embeddings = encoder.encode(VERIFICATION_SENTENCES,
+                                normalize_embeddings=True)
+
+    difference = float(np.abs(reference - embeddings).max())
+    if difference > tolerance:
+        raise ValueError(f"ONNX encoder of {model_name} differs from the "
+                         f"PyTorch encoder by {difference} "
+                         f"(tolerance {tolerance})")
+    return difference
+
+
+def export_and_verify(model_name: str, quantize: bool = False) -> tuple:
+    """Exports the encoder of a model and verifies it against the PyTorch
+    encoder. Only a verified export is marked as verified, a failed one is
+    deleted, so it is never served.
+
+    Args:
+        model_name (str): Name of the sentence-transformers model
+        quantize (bool): Whether to use the int8 quantized model
+
+    Raises:
+        ValueError: If the embeddings differ by more than the tolerance
+
+    Returns:
+        tuple: (OnnxSentenceEncoder, maximum absolute difference)
+    """
+    verified_path = _get_verified_path(model_name, quantize)
+    if os.path.exists(verified_path):
+        os.remove(verified_path)
+
+    path = export_encoder(model_name, quantize)
+    try:
+        encoder = OnnxSentenceEncoder(model_name, quantize)
+        difference = verify_encoder(
+            model_name, encoder,
+            TOLERANCE_QUANTIZED if quantize else TOLERANCE)
+    except Exception:
+        os.remove(path)
+        raise
+
+    with open(verified_path, "w", encoding="utf-8") as f:
+        json.dump({"max_difference": difference}, f)
+    return encoder, difference
+
+
+def load_encoder(model_name: str,
+                 quantize: bool = False) -> OnnxSentenceEncoder:
+    """Loads the ONNX encoder of a model. The model is exported and
+    verified against the PyTorch encoder if no verified export exists.
+
+    Args:
+        model_name (str): Name of the sentence-transformers model
+        quantize (bool): Whether to use the int8 quantized model
+
+    Returns:
+        OnnxSentenceEncoder: The encoder
+    """
+    if os.path.exists(_get_verified_path(model_name, quantize)):
+        return OnnxSentenceEncoder(model_name, quantize)
+
+    encoder, _ = export_and_verify(model_name, quantize)
+    return encoder
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exports a sentence encoder to ONNX and compares it "
+                    "with the PyTorch encoder.")
+    parser.add_argument("model_name")
+    parser.add_argument("--quantize", action="store_true",
+                        help="quantize the weights to int8")
+    arguments = parser.parse_args()
+
+    _, max_difference = export_and_verify(arguments.model_name,
+                                          arguments.quantize)
+    path = _get_model_path(arguments.model_name, arguments.quantize)
+    print(f"Exported {path}, maximum difference {max_difference}")
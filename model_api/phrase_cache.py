@@ -0,0 +1,278 @@
+"""
+This module contains a cache for the embeddings of KeyBERT's candidate
+phrases. Abstracts of one corpus share many phrases ("machine learning",
+"finite element"), so every phrase is embedded only once per encoder.
+Recently used embeddings are kept in memory, all embeddings are stored in
+a memory-mapped file on disk whose rows are indexed by a SQLite table.
+The files may be shared by several processes, e.g. the workers of the
+pre-fork mode.
+"""
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+ENVIRONMENT_VARIABLE_PHRASE_CACHE_DIR = "KEYBERT_PHRASE_CACHE_DIR"
+PHRASE_CACHE_DIR = os.environ.get(ENVIRONMENT_VARIABLE_PHRASE_CACHE_DIR,
+                                  "cache/phrase_embeddings")
+
+# Number of embeddings kept in memory, the least recently used are dropped
+ENVIRONMENT_VARIABLE_PHRASE_CACHE_MEMORY_ENTRIES = (
+    "KEYBERT_PHRASE_CACHE_MEMORY_ENTRIES")
+PHRASE_CACHE_MEMORY_ENTRIES = int(os.environ.get(
+    ENVIRONMENT_VARIABLE_PHRASE_CACHE_MEMORY_ENTRIES, 50000))
+
+# Number of embeddings stored on disk, further phrases are only kept
+# in memory
+ENVIRONMENT_VARIABLE_PHRASE_CACHE_DISK_ENTRIES = (
+    "KEYBERT_PHRASE_CACHE_DISK_ENTRIES")
+PHRASE_CACHE_DISK_ENTRIES = int(os.environ.get(
+    ENVIRONMENT_VARIABLE_PHRASE_CACHE_DISK_ENTRIES, 200000))
+
+# Rows the embedding file grows by when it is full
+GROWTH_ROWS = 16384
+
+# Maximum number of phrases looked up with one statement
+MAX_VARIABLES = 500
+
+SQL_CREATE_TABLE_PHRASE = """CREATE TABLE IF NOT EXISTS phrase(
+                                phrase text PRIMARY KEY,
+                                row integer NOT NULL
+                            );"""
+
+
+class PhraseEmbeddingCache:
+    """Embeddings of phrases for one encoder, in memory and on disk.
+
+    Args:
+        directory (str): Directory of the index and the embedding file
+        memory_entries (int): Number of embeddings kept in memory
+        disk_entries (int): Number of embeddings stored on disk
+    """
+
+    def __init__(self, directory: str, memory_entries: int,
+                 disk_entries: int):
+        os.makedirs(directory, exist_ok=True)
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self._embeddings_path = os.path.join(directory, "embeddings.f32")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"),
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SQL_CREATE_TABLE_PHRASE)
+        self._conn.commit()
+        self._rows = self._conn.execute(
+            "SELECT COUNT(*) FROM phrase").fetchone()[0]
+
+        # The dimension is only known after the first embedding
+        self._dimension = None
+        self._embeddings = None
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                self._dimension = json.load(f)["dimension"]
+            self._open_embeddings()
+
+    def embed(self, phrases: list, encoder) -> np.ndarray:
+        """Returns the embeddings of phrases, embedding only the phrases
+        that are not cached yet.
+
+        Args:
+            phrases (list): The phrases
+            encoder: KeyBERT backend whose embed() embeds a list of phrases
+
+        Returns:
+            np.ndarray: (phrases x dimensions) matrix in the order of phrases
+        """
+        with self._lock:
+            found = self._get_many(phrases)
+            missing = [phrase for phrase in dict.fromkeys(phrases)
+                       if phrase not in found]
+            self.hits += len(phrases) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            embeddings = np.asarray(encoder.embed(missing), dtype=np.float32)
+            with self._lock:
+                self._put_many(dict(zip(missing, embeddings)))
+            found.update(zip(missing, embeddings))
+
+        if not phrases:
+            return np.zeros((0, self._dimension or 0), dtype=np.float32)
+        return np.stack([found[phrase] for phrase in phrases])
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: hits, misses, hit_ratio, memory_entries and disk_entries
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0,
+                    "memory_entries": len(self._memory),
+                    "disk_entries": self._rows}
+
+    def _get_many(self, phrases: list) -> dict:
+        found = {}
+        on_disk = []
+        for phrase in dict.fromkeys(phrases):
+            if phrase in self._memory:
+                self._memory.move_to_end(phrase)
+                found[phrase] = self._memory[phrase]
+            else:
+                on_disk.append(phrase)
+
+        if on_disk and self._embeddings is not None:
+            for phrase, row in self._get_rows(on_disk).items():
+                # Another process may have grown the file meanwhile
+                if row >= len(self._embeddings):
+                    self._reserve(row + 1)
+                # Copy the row, so it doesn't keep the file mapped
+                found[phrase] = np.array(self._embeddings[row])
+                self._remember(phrase, found[phrase])
+        return found
+
+    def _get_rows(self, phrases: list) -> dict:
+        rows = {}
+        # SQLite limits the number of variables of one statement
+        for start in range(0, len(phrases), MAX_VARIABLES):
+            chunk = phrases[start:start + MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows.update(self._conn.execute(
+                "SELECT phrase, row FROM phrase "
+                f"WHERE phrase IN ({placeholders})", chunk).fetchall())
+        return rows
+
+    def _put_many(self, embeddings: dict):
+        for phrase, embedding in embeddings.items():
+            self._remember(phrase, embedding)
+
+        if self._dimension is None:
+            self._dimension = len(next(iter(embeddings.values())))
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dimension": self._dimension}, f)
+            self._open_embeddings()
+
+        try:
+            self._store(embeddings)
+        except sqlite3.OperationalError as error:
+            # The embeddings stay in memory, storing them is retried
+            # when they are embedded again
+            print(f"Storing {len(embeddings)} phrase embeddings failed: "
+                  f"{error}")
+
+    def _store(self, embeddings: dict):
+        """Writes embeddings to the next free rows of the embedding file.
+        The rows are allocated while the index is locked for writing, so
+        processes sharing the files never write to the same row.
+        """
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            # Another thread or process may have stored some of the
+            # phrases meanwhile
+            stored = self._get_rows(list(embeddings))
+            new = [(phrase, embedding)
+                   for phrase, embedding in embeddings.items()
+                   if phrase not in stored]
+            first_row = self._conn.execute(
+                "SELECT COALESCE(MAX(row) + 1, 0) FROM phrase").fetchone()[0]
+            new = new[:max(0, self.disk_entries - first_row)]
+            self._rows = first_row + len(new)
+            if not new:
+                return
+
+            self._reserve(first_row + len(new))
+            index = []
+            for offset, (phrase, embedding) in enumerate(new):
+                self._embeddings[first_row + offset] = embedding
+                index.append((phrase, first_row + offset))
+            self._embeddings.flush()
+            self._conn.executemany(
+                "INSERT INTO phrase(phrase, row) VALUES (?, ?)", index)
+
+    def _remember(self, phrase: str, embedding: np.ndarray):
+        self._memory[phrase] = embedding
+        self._memory.move_to_end(phrase)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _open_embeddings(self):
+        self._embeddings = None
+        self._reserve(GROWTH_ROWS)
+
+    def _reserve(self, rows: int):
+        """Maps the embedding file, growing it so it holds at least rows
+        embeddings. Another process may have grown the file already, so
+        its size is taken from disk and it is never shrunk.
+        """
+        if self._embeddings is not None and rows <= len(self._embeddings):
+            return
+
+        row_bytes = self._dimension * np.dtype(np.float32).itemsize
+        capacity = 0
+        if os.path.exists(self._embeddings_path):
+            capacity = os.path.getsize(self._embeddings_path) // row_bytes
+        if rows > capacity:
+            capacity = max(rows, capacity + GROWTH_ROWS)
+            with open(self._embeddings_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._embeddings = np.memmap(self._embeddings_path, dtype=np.float32,
+                                     mode="r+",
+                                     shape=(capacity, self._dimension))
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_phrase_cache(encoder_name: str) -> PhraseEmbeddingCache:
+    """Returns the phrase cache of an encoder, opening it on the first call.
+
+    Args:
+        encoder_name (str): Name identifying the encoder, embeddings of
+                            different encoders are stored separately
+
+    Returns:
+        PhraseEmbeddingCache: The cache
+    """
+    with _caches_lock:
+        if encoder_name not in _caches:
+            directory = os.path.join(PHRASE_CACHE_DIR,
+                                     encoder_name.replace("/", "_"))
+            _caches[encoder_name] = PhraseEmbeddingCache(
+                directory, PHRASE_CACHE_MEMORY_ENTRIES,
+                PHRASE_CACHE_DISK_ENTRIES)
+        return _caches[encoder_name]
+
+
+def get_phrase_cache_stats() -> dict:
+    """Returns the statistics of every opened phrase cache.
+
+    Returns:
+        dict: {encoder name: stats of its cache}
+    """
+    with _caches_lock:
+        caches = dict(_caches)
+    return {encoder_name: phrase_cache.stats()
+            for encoder_name, phrase_cache in caches.items()}
+
+
+def forget_phrase_caches():
+    """Drops the opened caches without closing them, so a forked process
+    opens its own connections instead of using those of its parent.
+    """
+    global _caches_lock
+    _caches.clear()
+    _caches_lock = threading.Lock()
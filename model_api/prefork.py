@@ -0,0 +1,221 @@
+"""
+This module serves the model_api with several worker processes that share
+the weights of the models. The models are loaded in the parent process,
+switched to inference mode and frozen before the workers are forked, so
+the memory pages holding the weights are shared copy-on-write instead of
+being copied into every worker.
+
+    MODEL_API_WORKERS=4 python run_model_api.py
+"""
+
+import gc
+import os
+import signal
+import socket
+import sys
+
+import psutil
+import uvicorn
+
+import inference_pool
+from model_registry import MEGABYTE, get_preload_models, registry
+
+# Number of worker processes, 1 serves the api without forking
+ENVIRONMENT_VARIABLE_WORKERS = "MODEL_API_WORKERS"
+WORKERS = int(os.environ.get(ENVIRONMENT_VARIABLE_WORKERS, 1))
+
+# Maximum number of connections waiting to be accepted by a worker
+BACKLOG = 2048
+
+# Set in the workers to the pid of the process that forked them
+_parent_pid = None
+
+
+def _find_modules(handle, depth: int = 0) -> list:
+    """Returns the torch modules a model handle consists of, e.g. the
+    model of a (tokenizer, model) tuple or the sentence transformer
+    inside a KeyBERT instance.
+    """
+    torch = sys.modules.get("torch")
+    if torch is None or handle is None or depth > 3:
+        return []
+    if isinstance(handle, torch.nn.Module):
+        return [handle]
+
+    if isinstance(handle, (tuple, list)):
+        parts = handle
+    else:
+        # KeyBERT -> backend -> sentence transformer, pipeline -> model
+        parts = [getattr(handle, attribute, None)
+                 for attribute in ("model", "embedding_model")]
+
+    modules = []
+    for part in parts:
+        modules.extend(_find_modules(part, depth + 1))
+    return modules
+
+
+def _make_read_only(handle):
+    numpy = sys.modules.get("numpy")
+    if numpy is None or not isinstance(handle, (tuple, list)):
+        return
+    # e.g. the category embeddings next to their encoder
+    for part in handle:
+        if isinstance(part, numpy.ndarray):
+            part.flags.writeable = False
+
+
+def freeze_models() -> int:
+    """Prepares the resident models for being shared by forked workers.
+    Every model is switched to eval mode and its weights no longer
+    require gradients, so inference never writes to them.
+
+    Returns:
+        int: Number of frozen torch modules
+    """
+    frozen = 0
+    for handle in registry.resident_handles().values():
+        _make_read_only(handle)
+        for module in _find_modules(handle):
+            module.eval()
+            for parameter in module.parameters():
+                parameter.requires_grad_(False)
+            frozen += 1
+
+    # The garbage collector writes to every object it inspects, which
+    # would copy the pages of the objects loaded so far into each worker.
+    # Frozen objects are never inspected again.
+    gc.collect()
+    gc.freeze()
+    return frozen
+
+
+def _create_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _after_fork(workers: int):
+    """Replaces the state a worker must not share with its parent."""
+    global _parent_pid
+    _parent_pid = os.getppid()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # SQLite connections can't be used across a fork
+    from extraction_cache import cache
+    cache.reopen()
+    if "phrase_cache" in sys.modules:
+        sys.modules["phrase_cache"].forget_phrase_caches()
+
+    inference_pool.share_cores(workers)
+
+
+def _fork_worker(app, sock: socket.socket, workers: int) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+
+    _after_fork(workers)
+    # Host and port are taken from the shared socket
+    server = uvicorn.Server(uvicorn.Config(app))
+    try:
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def serve(host: str, port: int, workers: int = WORKERS):
+    """Loads the preloaded models, forks the workers and restarts workers
+    that exit until the parent is stopped with SIGTERM or SIGINT.
+
+    Args:
+        host (str): Address the api listens on
+        port (int): Port the api listens on
+        workers (int, optional): Number of worker processes
+    """
+    # Imported here, so the api is imported in the parent only
+    from model_api import app
+
+    registry.warmup(get_preload_models())
+    print(f"Froze {freeze_models()} modules before forking {workers} "
+          f"workers")
+
+    sock = _create_socket(host, port)
+    children = {_fork_worker(app, sock, workers) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting it")
+            children.add(_fork_worker(app, sock, workers))
+    sock.close()
+
+
+def _to_megabytes(size_bytes):
+    return None if size_bytes is None else round(size_bytes / MEGABYTE, 1)
+
+
+def memory_report() -> dict:
+    """Returns the memory of the processes serving the api. The unique
+    set size (uss) is the memory only this process uses, the proportional
+    set size (pss) splits shared pages between the processes sharing them.
+    In prefork mode the uss of a worker is what an additional worker
+    costs, as the weights are shared with the parent.
+
+    Returns:
+        dict: mode, the memory of every process and the sums over workers
+    """
+    current = psutil.Process()
+    if _parent_pid is None:
+        processes = [("server", current)]
+    else:
+        parent = psutil.Process(_parent_pid)
+        processes = [("parent", parent)] + [("worker", child)
+                                            for child in parent.children()]
+
+    report = []
+    for role, process in processes:
+        try:
+            info = process.memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        # pss and shared are not available on every platform
+        report.append({"pid": process.pid,
+                       "role": role,
+                       "current": process.pid == current.pid,
+                       "rss_mb": _to_megabytes(info.rss),
+                       "uss_mb": _to_megabytes(info.uss),
+                       "pss_mb": _to_megabytes(getattr(info, "pss", None)),
+                       "shared_mb": _to_megabytes(
+                           getattr(info, "shared", None))})
+
+    workers = [process for process in report if process["role"] == "worker"]
+    return {"mode": "single" if _parent_pid is None else "prefork",
+            "processes": report,
+            "workers": len(workers),
+            "worker_uss_mb": round(sum(process["uss_mb"]
+                                       for process in workers), 1),
+            "total_pss_mb": round(sum(process["pss_mb"] or 0
+                                      for process in report), 1)}
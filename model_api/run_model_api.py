@@ -3,6 +3,8 @@
 import threading
 import os
 
+import prefork
+
 ENVIRONMENT_VARIABLE_MODEL_API_PORT = "MODEL_API_PORT"
 MODEL_API_PORT = os.environ.get(ENVIRONMENT_VARIABLE_MODEL_API_PORT)
 
@@ -13,5 +15,10 @@ def run_model_api():
     os.system('uvicorn model_api:app --reload --port ' + MODEL_API_PORT  + ' --host 0.0.0.0')
 
 
-model_api = threading.Thread(target=run_model_api)
-model_api.start()
+if prefork.WORKERS > 1:
+    # The models are loaded once and shared by the workers, forking
+    # and handling signals requires the main thread
+    prefork.serve("0.0.0.0", int(MODEL_API_PORT), prefork.WORKERS)
+else:
+    model_api = threading.Thread(target=run_model_api)
+    model_api.start()
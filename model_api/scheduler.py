@@ -0,0 +1,509 @@
+"""
+This module contains the inference scheduler of the model_api. Requests
+for the same model and parameters that arrive within a short time window
+are gathered and passed through the model as one batch. The results are
+then handed back to the waiting requests. The queue of every model is
+bounded, abstracts that don't fit or wait too long are rejected, so
+clients back off instead of piling up requests.
+
+Every queue has two lanes: interactive requests are batched before bulk
+requests (e.g. a database build), unless the oldest bulk request has
+waited longer than the aging limit.
+"""
+
+import collections
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import inference_pool
+import metrics
+from models import BATCH_EXTRACTORS
+
+# Time in milliseconds the scheduler waits for further requests
+# after the first request of a batch arrived
+ENVIRONMENT_VARIABLE_BATCH_WINDOW_MS = "SCHEDULER_BATCH_WINDOW_MS"
+BATCH_WINDOW_MS = float(os.environ.get(ENVIRONMENT_VARIABLE_BATCH_WINDOW_MS,
+                                       10))
+
+# Maximum number of abstracts in one batch
+ENVIRONMENT_VARIABLE_MAX_BATCH_SIZE = "SCHEDULER_MAX_BATCH_SIZE"
+MAX_BATCH_SIZE = int(os.environ.get(ENVIRONMENT_VARIABLE_MAX_BATCH_SIZE, 16))
+
+# Maximum number of abstracts waiting for one model, 0 means no limit
+ENVIRONMENT_VARIABLE_MAX_QUEUE_DEPTH = "SCHEDULER_MAX_QUEUE_DEPTH"
+MAX_QUEUE_DEPTH = int(os.environ.get(ENVIRONMENT_VARIABLE_MAX_QUEUE_DEPTH,
+                                     256))
+
+# Maximum time in milliseconds an abstract waits for its batch,
+# 0 means no limit
+ENVIRONMENT_VARIABLE_MAX_WAIT_MS = "SCHEDULER_MAX_WAIT_MS"
+MAX_WAIT_MS = float(os.environ.get(ENVIRONMENT_VARIABLE_MAX_WAIT_MS, 30000))
+
+# Maximum number of queues, one per model and set of parameters,
+# 0 means no limit
+ENVIRONMENT_VARIABLE_MAX_QUEUES = "SCHEDULER_MAX_QUEUES"
+MAX_QUEUES = int(os.environ.get(ENVIRONMENT_VARIABLE_MAX_QUEUES, 32))
+
+# Seconds after which a queue without requests is removed with its thread
+ENVIRONMENT_VARIABLE_QUEUE_IDLE_SECONDS = "SCHEDULER_QUEUE_IDLE_SECONDS"
+QUEUE_IDLE_SECONDS = float(os.environ.get(
+    ENVIRONMENT_VARIABLE_QUEUE_IDLE_SECONDS, 60))
+
+# Time in milliseconds after which bulk requests are batched before
+# interactive requests, so a stream of interactive requests can't starve them
+ENVIRONMENT_VARIABLE_BULK_AGING_MS = "SCHEDULER_BULK_AGING_MS"
+BULK_AGING_MS = float(os.environ.get(ENVIRONMENT_VARIABLE_BULK_AGING_MS,
+                                     5000))
+
+# Priority lanes, in the order they are served
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+# Lane of the request being handled, set by the api from a request header
+request_lane = contextvars.ContextVar("request_lane",
+                                      default=LANE_INTERACTIVE)
+
+# Weight of the latest batch in the average time per abstract
+SMOOTHING = 0.2
+
+# Reasons an abstract is rejected
+REASON_QUEUE_FULL = "queue_full"
+REASON_TIMEOUT = "timeout"
+REASON_TOO_MANY_QUEUES = "too_many_queues"
+
+
+class SchedulerOverloadedError(RuntimeError):
+    """Raised when the queue of a model can't take more abstracts or an
+    abstract waited longer than the maximum wait time.
+
+    Args:
+        message (str): Description of the error
+        retry_after (int): Seconds after which the request may be retried
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _PendingAbstract:
+    """An abstract waiting in a queue for its batch."""
+
+    def __init__(self, abstract: str, lane: str):
+        self.abstract = abstract
+        self.lane = lane
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _BatchQueue:
+    """Queue of the abstracts for one model and one set of parameters.
+    A worker thread takes batches from the queue and runs them in the
+    inference pool, one batch at a time. The queue closes and its thread
+    ends once no abstract arrived for the idle time of the scheduler.
+    """
+
+    def __init__(self, key: tuple, model: str, parameters: dict, scheduler):
+        self.key = key
+        self.model = model
+        self.parameters = parameters
+        self.closed = False
+        self._scheduler = scheduler
+        self._pending = {lane: collections.deque() for lane in LANES}
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def put(self, abstracts: list, lane: str) -> list:
+        """Queues abstracts, unless the queue is closed.
+
+        Returns:
+            list: A Future for the result of each abstract, None if closed
+        """
+        pending = [_PendingAbstract(abstract, lane) for abstract in abstracts]
+        with self._condition:
+            if self.closed:
+                return None
+            self._pending[lane].extend(pending)
+            self._condition.notify()
+        return [item.future for item in pending]
+
+    def depth(self) -> int:
+        """Returns the number of abstracts waiting for their batch."""
+        with self._condition:
+            return self._depth()
+
+    def _depth(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    def _get_lane_order(self) -> list:
+        bulk = self._pending[LANE_BULK]
+        waited = time.monotonic() - bulk[0].enqueued_at if bulk else 0
+        if waited > self._scheduler.bulk_aging_seconds:
+            return [self._pending[LANE_BULK], self._pending[LANE_INTERACTIVE]]
+        return [self._pending[lane] for lane in LANES]
+
+    def _expire(self):
+        # The oldest abstracts are at the front of each lane
+        max_wait = self._scheduler.max_wait_seconds
+        expired = []
+        for pending in self._pending.values():
+            while (max_wait and pending
+                   and time.monotonic() - pending[0].enqueued_at > max_wait):
+                expired.append(pending.popleft())
+        if not expired:
+            return
+
+        self._scheduler.record_dequeue(self.model, expired, REASON_TIMEOUT)
+        error = SchedulerOverloadedError(
+            f"Waited longer than {max_wait}s for model {self.model}",
+            self._scheduler.estimate_wait(self.model))
+        for item in expired:
+            item.future.set_exception(error)
+
+    def _take_batch(self) -> list:
+        with self._condition:
+            idle_until = time.monotonic() + self._scheduler.idle_seconds
+            while True:
+                self._expire()
+                if self._depth():
+                    break
+                remaining = idle_until - time.monotonic()
+                if remaining <= 0:
+                    self.closed = True
+                    return None
+                self._condition.wait(remaining)
+
+            # Wait for more requests until the window of the oldest
+            # request is over or the batch is full
+            deadline = (min(pending[0].enqueued_at
+                            for pending in self._pending.values() if pending)
+                        + self._scheduler.window_seconds)
+            while self._depth() < self._scheduler.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Lanes served first fill the batch, the others fill it up
+            batch = []
+            for pending in self._get_lane_order():
+                while pending and len(batch) < self._scheduler.max_batch_size:
+                    batch.append(pending.popleft())
+            self._scheduler.record_dequeue(self.model, batch)
+            return batch
+
+    def _work(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                self._scheduler.remove_queue(self)
+                return
+            self._scheduler.record_batch(self.model, len(batch))
+            start = time.monotonic()
+            try:
+                results = inference_pool.submit(
+                    self.model, self._scheduler.extractors[self.model],
+                    [item.abstract for item in batch],
+                    **self.parameters).result()
+            except Exception as error:
+                for item in batch:
+                    item.future.set_exception(error)
+                continue
+            self._scheduler.record_duration(self.model, len(batch),
+                                            time.monotonic() - start)
+            for item, result in zip(batch, results):
+                item.future.set_result(result)
+
+
+class InferenceScheduler:
+    """Gathers concurrent extraction requests into batches per model.
+
+    Args:
+        extractors (dict): Batch extraction function by model name
+        window_seconds (float): Time to wait for further requests
+        max_batch_size (int): Maximum number of abstracts in one batch
+        max_queue_depth (int, optional): Maximum number of abstracts
+                                         waiting per model and lane,
+                                         0 means no limit
+        max_wait_seconds (float, optional): Maximum time an abstract waits
+                                            for its batch, 0 means no limit
+        bulk_aging_seconds (float, optional): Time after which bulk
+                                              requests are served before
+                                              interactive requests
+        max_queues (int, optional): Maximum number of queues, one per
+                                    model and set of parameters,
+                                    0 means no limit
+        idle_seconds (float, optional): Time after which a queue without
+                                        requests is removed
+    """
+
+    def __init__(self, extractors: dict, window_seconds: float,
+                 max_batch_size: int, max_queue_depth: int = 0,
+                 max_wait_seconds: float = 0,
+                 bulk_aging_seconds: float = BULK_AGING_MS / 1000,
+                 max_queues: int = MAX_QUEUES,
+                 idle_seconds: float = QUEUE_IDLE_SECONDS):
+        self.extractors = extractors
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_queue_depth = max_queue_depth
+        self.max_wait_seconds = max_wait_seconds
+        self.bulk_aging_seconds = bulk_aging_seconds
+        self.max_queues = max_queues
+        self.idle_seconds = idle_seconds
+        self._queues = {}
+        self._batch_sizes = collections.defaultdict(collections.Counter)
+        self._depths = collections.Counter()
+        self._rejections = collections.defaultdict(collections.Counter)
+        self._seconds_per_abstract = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model: str, abstracts: list, parameters: dict = None,
+               lane: str = None) -> list:
+        """Queues abstracts for extraction.
+
+        Args:
+            model (str): Name of the model
+            abstracts (list): Abstracts in text format
+            parameters (dict, optional): Parameters of the extraction
+            lane (str, optional): One of LANES, defaults to the lane of
+                                  the request being handled
+
+        Raises:
+            SchedulerOverloadedError: If the lane of the model is full or
+                                      there are too many queues
+
+        Returns:
+            list: A Future for the result of each abstract
+        """
+        parameters = parameters or {}
+        lane = lane or request_lane.get()
+        key = (model, json.dumps(parameters, sort_keys=True))
+        with self._lock:
+            depth = self._check_depth(model, lane, len(abstracts))
+
+            # Every set of parameters has a queue with its own thread
+            too_many_queues = (self.max_queues and key not in self._queues
+                               and len(self._queues) >= self.max_queues)
+            if too_many_queues:
+                self._rejections[model][REASON_TOO_MANY_QUEUES] += len(
+                    abstracts)
+                metrics.QUEUE_REJECTIONS.inc(len(abstracts), model=model,
+                                             reason=REASON_TOO_MANY_QUEUES)
+                raise SchedulerOverloadedError(
+                    f"{len(self._queues)} sets of parameters are queued, "
+                    "use the parameters of a queued request",
+                    max(1, math.ceil(self.idle_seconds)))
+
+            self._depths[model, lane] += len(abstracts)
+        metrics.QUEUE_DEPTH_ON_ARRIVAL.observe(depth, model=model, lane=lane)
+
+        while True:
+            with self._lock:
+                if key not in self._queues:
+                    self._queues[key] = _BatchQueue(key, model, parameters,
+                                                    self)
+                queue = self._queues[key]
+            futures = queue.put(abstracts, lane)
+            if futures is not None:
+                return futures
+            # The queue closed after it was looked up
+            self.remove_queue(queue)
+
+    def call(self, model: str, function, *args, **kwargs) -> Future:
+        """Runs a single call of a model function that is not batched in
+        the inference pool. The call is admitted like an abstract in the
+        lane of the request being handled, so it is rejected once the lane
+        of the model is full.
+
+        Args:
+            model (str): Name of the model the function uses
+            function (callable): The model function
+            *args: Positional arguments of the function
+            **kwargs: Keyword arguments of the function
+
+        Raises:
+            SchedulerOverloadedError: If the lane of the model is full
+
+        Returns:
+            Future: The result of the function
+        """
+        item = _PendingAbstract(None, request_lane.get())
+        with self._lock:
+            depth = self._check_depth(model, item.lane, 1)
+            self._depths[model, item.lane] += 1
+        metrics.QUEUE_DEPTH_ON_ARRIVAL.observe(depth, model=model,
+                                               lane=item.lane)
+
+        def run():
+            metrics.QUEUE_WAIT_SECONDS.observe(
+                time.monotonic() - item.enqueued_at, model=model,
+                lane=item.lane)
+            return function(*args, **kwargs)
+
+        future = inference_pool.submit(model, run)
+        # A cancelled call never runs, so the call leaves the lane once
+        # its Future is done, however it ended
+        future.add_done_callback(
+            lambda _: self._leave_lane(model, item.lane))
+        return future
+
+    def check(self, model: str, lane: str = None):
+        """Checks that the lane of a model has room for one more call,
+        e.g. before a stream is started.
+
+        Args:
+            model (str): Name of the model
+            lane (str, optional): One of LANES, defaults to the lane of
+                                  the request being handled
+
+        Raises:
+            SchedulerOverloadedError: If the lane of the model is full
+        """
+        with self._lock:
+            self._check_depth(model, lane or request_lane.get(), 1)
+
+    def _leave_lane(self, model: str, lane: str):
+        with self._lock:
+            self._depths[model, lane] -= 1
+
+    def _check_depth(self, model: str, lane: str, count: int) -> int:
+        # Bulk requests can't fill the queue for interactive requests
+        depth = self._depths[model, lane]
+        # A request larger than the limit is accepted by an empty lane
+        too_deep = (self.max_queue_depth and depth
+                    and depth + count > self.max_queue_depth)
+        if too_deep:
+            self._rejections[model][REASON_QUEUE_FULL] += count
+            metrics.QUEUE_REJECTIONS.inc(count, model=model,
+                                         reason=REASON_QUEUE_FULL)
+            raise SchedulerOverloadedError(
+                f"The {lane} queue of model {model} is full, {depth} "
+                "abstracts are waiting", self._estimate_wait(model, depth))
+        return depth
+
+    def remove_queue(self, queue: _BatchQueue):
+        """Removes a closed queue, so the next request creates a new one.
+
+        Args:
+            queue (_BatchQueue): The closed queue
+        """
+        with self._lock:
+            if self._queues.get(queue.key) is queue:
+                del self._queues[queue.key]
+
+    def record_batch(self, model: str, size: int):
+        """Counts a batch in the batch size histogram of its model.
+
+        Args:
+            model (str): Name of the model
+            size (int): Number of abstracts in the batch
+        """
+        with self._lock:
+            self._batch_sizes[model][size] += 1
+
+    def record_dequeue(self, model: str, items: list, reason: str = None):
+        """Removes abstracts that left a queue from the depth of their
+        model and measures how long they waited.
+
+        Args:
+            model (str): Name of the model
+            items (list): The abstracts that left the queue
+            reason (str, optional): Why the abstracts were rejected,
+                                    None if they are extracted
+        """
+        now = time.monotonic()
+        with self._lock:
+            for item in items:
+                self._depths[model, item.lane] -= 1
+            if reason is not None:
+                self._rejections[model][reason] += len(items)
+        if reason is not None:
+            metrics.QUEUE_REJECTIONS.inc(len(items), model=model,
+                                         reason=reason)
+        for item in items:
+            metrics.QUEUE_WAIT_SECONDS.observe(now - item.enqueued_at,
+                                               model=model, lane=item.lane)
+
+    def record_duration(self, model: str, size: int, seconds: float):
+        """Updates the average time per abstract of a model, which is
+        used to tell rejected clients when to retry.
+
+        Args:
+            model (str): Name of the model
+            size (int): Number of abstracts in the batch
+            seconds (float): Time the batch took
+        """
+        with self._lock:
+            latest = seconds / size
+            average = self._seconds_per_abstract.get(model, latest)
+            self._seconds_per_abstract[model] = (
+                SMOOTHING * latest + (1 - SMOOTHING) * average)
+
+    def estimate_wait(self, model: str) -> int:
+        """Estimates when the queue of a model has room again.
+
+        Args:
+            model (str): Name of the model
+
+        Returns:
+            int: Seconds until a request should be retried
+        """
+        with self._lock:
+            depth = sum(self._depths[model, lane] for lane in LANES)
+            return self._estimate_wait(model, depth)
+
+    def _estimate_wait(self, model: str, depth: int) -> int:
+        # Models that didn't finish a batch yet are assumed to take a
+        # second per abstract
+        seconds = depth * self._seconds_per_abstract.get(model, 1)
+        if self.max_wait_seconds:
+            seconds = min(seconds, self.max_wait_seconds)
+        return max(1, math.ceil(seconds))
+
+    def queue_depths(self) -> dict:
+        """Returns the number of waiting abstracts of every model.
+
+        Returns:
+            dict: {model: number of abstracts}
+        """
+        with self._lock:
+            queues = list(self._queues.values())
+
+        depths = collections.Counter()
+        for queue in queues:
+            depths[queue.model] += queue.depth()
+        return dict(depths)
+
+    def stats(self) -> dict:
+        """Returns the configuration and the batch size histograms.
+
+        Returns:
+            dict: window, max batch size and {model: {batch size: count}}
+        """
+        with self._lock:
+            histograms = {model: dict(sorted(sizes.items()))
+                          for model, sizes in self._batch_sizes.items()}
+            rejections = {model: dict(reasons)
+                          for model, reasons in self._rejections.items()}
+        return {"window_ms": self.window_seconds * 1000,
+                "max_batch_size": self.max_batch_size,
+                "max_queue_depth": self.max_queue_depth,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+                "bulk_aging_ms": self.bulk_aging_seconds * 1000,
+                "queues": len(self._queues),
+                "max_queues": self.max_queues,
+                "batch_sizes": histograms,
+                "rejections": rejections}
+
+
+scheduler = InferenceScheduler(BATCH_EXTRACTORS, BATCH_WINDOW_MS / 1000,
+                               MAX_BATCH_SIZE, MAX_QUEUE_DEPTH,
+                               MAX_WAIT_MS / 1000)
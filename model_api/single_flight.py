@@ -0,0 +1,109 @@
+"""
+This module deduplicates identical extractions that run at the same time.
+The first request for a key computes the result, requests for the same key
+that arrive before the result is ready wait for that computation and
+share its result instead of passing the abstract through the model again.
+Every request waits on a Future of its own, so a request that is cancelled,
+e.g. because its client disconnected, doesn't cancel the others.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import metrics
+
+# Roles of a request for a key
+ROLE_LEADER = "leader"
+ROLE_DUPLICATE = "duplicate"
+
+
+class _Call:
+    """A computation that is in flight and the requests waiting for it."""
+
+    def __init__(self):
+        self.waiters = []
+        self.started = time.monotonic()
+        self.duplicates = 0
+
+
+class SingleFlight:
+    """Shares the result of a computation with all requests for the same
+    key that arrive while it is running.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def join(self, model: str, keys: list) -> tuple:
+        """Joins the computations of keys that are in flight and starts
+        a computation for every other key. The caller has to compute the
+        keys it started and pass their results to finish().
+
+        Args:
+            model (str): Name of the model, used as label of the metrics
+            keys (list): Distinct keys, e.g. extraction cache keys
+
+        Returns:
+            tuple: ({key: Future of the result}, keys the caller computes)
+        """
+        futures = {}
+        started = []
+        with self._lock:
+            for key in keys:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    started.append(key)
+                else:
+                    call.duplicates += 1
+                futures[key] = Future()
+                call.waiters.append(futures[key])
+
+        if started:
+            metrics.COALESCING_REQUESTS.inc(len(started), model=model,
+                                            role=ROLE_LEADER)
+        if len(keys) > len(started):
+            metrics.COALESCING_REQUESTS.inc(len(keys) - len(started),
+                                            model=model, role=ROLE_DUPLICATE)
+        return futures, started
+
+    def finish(self, model: str, key: str, result=None,
+               error: Exception = None):
+        """Hands the result of a computation to every request waiting for
+        it. Requests for the key arriving afterwards start a new one.
+        Finishing a key that is not in flight does nothing.
+
+        Args:
+            model (str): Name of the model, used as label of the metrics
+            key (str): Key the computation was started for
+            result (optional): The result
+            error (Exception, optional): The error, if the computation failed
+        """
+        with self._lock:
+            call = self._calls.pop(key, None)
+        if call is None:
+            return
+
+        # Every duplicate would have taken as long as the computation
+        if call.duplicates:
+            metrics.COALESCING_SAVED_SECONDS.inc(
+                call.duplicates * (time.monotonic() - call.started),
+                model=model)
+        for waiter in call.waiters:
+            _resolve(waiter, result, error)
+
+
+def _resolve(future: Future, result, error: Exception):
+    # A cancelled waiter doesn't get the result
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+in_flight = SingleFlight()
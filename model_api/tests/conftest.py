@@ -0,0 +1,18 @@
+"""
+Shared setup of the model_api tests. The modules of the model_api import
+each other by their file name, as the api is started from its directory.
+The caches are written to a temporary directory.
+"""
+
+import os
+import sys
+import tempfile
+
+MODEL_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MODEL_API_DIR)
+
+_cache_dir = tempfile.mkdtemp(prefix="model_api_tests_")
+os.environ.setdefault("EXTRACTION_CACHE_PATH",
+                      os.path.join(_cache_dir, "extraction_cache.db"))
+os.environ.setdefault("KEYBERT_PHRASE_CACHE_DIR",
+                      os.path.join(_cache_dir, "phrase_embeddings"))
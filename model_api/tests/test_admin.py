@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException, Request  # noqa: E402
+
+import model_api  # noqa: E402
+
+
+def _request(token: str = None) -> Request:
+    headers = [] if token is None else [(b"x-admin-token", token.encode())]
+    return Request({"type": "http", "headers": headers})
+
+
+def test_admin_endpoints_are_disabled_without_token(monkeypatch):
+    monkeypatch.setattr(model_api, "ADMIN_TOKEN", "")
+    with pytest.raises(HTTPException) as error:
+        model_api.check_admin_token(_request("secret"))
+    assert error.value.status_code == 403
+
+
+@pytest.mark.parametrize("token", [None, "", "wrong"])
+def test_wrong_admin_token_is_rejected(monkeypatch, token):
+    monkeypatch.setattr(model_api, "ADMIN_TOKEN", "secret")
+    with pytest.raises(HTTPException) as error:
+        model_api.check_admin_token(_request(token))
+    assert error.value.status_code == 401
+
+
+def test_admin_token_is_accepted(monkeypatch):
+    monkeypatch.setattr(model_api, "ADMIN_TOKEN", "secret")
+    model_api.check_admin_token(_request("secret"))
@@ -0,0 +1,47 @@
+import pytest
+
+from chunking import ChunkSizeError, merge_chunk_results, split_abstracts
+
+
+class WordTokenizer:
+    """Tokenizer with one token per word."""
+
+    is_fast = False
+
+    def __call__(self, texts, add_special_tokens=True):
+        return {"input_ids": [text.split() for text in texts]}
+
+    def decode(self, ids):
+        return " ".join(ids)
+
+
+def test_short_abstracts_are_kept():
+    chunks, owners = split_abstracts(WordTokenizer(), ["a b c", "d"], 4, 1)
+    assert chunks == ["a b c", "d"]
+    assert owners == [0, 1]
+
+
+def test_long_abstracts_are_split_with_overlap():
+    chunks, owners = split_abstracts(WordTokenizer(), ["a b c d e f"], 4, 2)
+    assert chunks == ["a b c d", "c d e f"]
+    assert owners == [0, 0]
+
+
+def test_overlap_is_clamped_for_small_chunks():
+    # An encoder with a short sequence length and the default overlap
+    chunks, owners = split_abstracts(WordTokenizer(), ["a b c d e f"], 2, 64)
+    assert chunks == ["a b", "b c", "c d", "d e", "e f"]
+    assert owners == [0] * 5
+
+
+@pytest.mark.parametrize("max_tokens", [0, -10])
+def test_no_room_for_the_abstract_is_rejected(max_tokens):
+    with pytest.raises(ChunkSizeError):
+        split_abstracts(WordTokenizer(), ["a b c"], max_tokens, 1)
+
+
+def test_merge_keeps_the_highest_relevancy():
+    merged = merge_chunk_results([[("nlp", 0.5), ("ml", 0.7)],
+                                  [("nlp", 0.9)], [("cv", 0.4)]],
+                                 [0, 0, 1], 2)
+    assert merged == [[("nlp", 0.9), ("ml", 0.7)], [("cv", 0.4)]]
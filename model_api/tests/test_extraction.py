@@ -0,0 +1,24 @@
+import extraction
+import models
+
+
+def test_cache_key_depends_on_the_encoder_backend(monkeypatch):
+    parameters = {"model_version": "encoder"}
+    torch_key = extraction.get_cache_keys("keybert", ["text"], parameters)
+
+    monkeypatch.setattr(models, "ENCODER_BACKEND", "onnx")
+    onnx_key = extraction.get_cache_keys("keybert", ["text"], parameters)
+    monkeypatch.setattr(models, "ENCODER_ONNX_QUANTIZE", True)
+    quantized_key = extraction.get_cache_keys("keybert", ["text"], parameters)
+
+    assert len({*torch_key, *onnx_key, *quantized_key}) == 3
+
+
+def test_cache_key_of_other_models_ignores_the_encoder_backend(monkeypatch):
+    parameters = {"model_version": "google/pegasus-xsum"}
+    torch_key = extraction.get_cache_keys("pegasus", ["text"], parameters)
+
+    monkeypatch.setattr(models, "ENCODER_BACKEND", "onnx")
+
+    assert extraction.get_cache_keys("pegasus", ["text"], parameters) == \
+        torch_key
@@ -0,0 +1,33 @@
+import itertools
+
+import extraction_cache
+from extraction_cache import ExtractionCache, make_key
+
+
+def test_results_are_stored_and_counted(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache.db"), max_entries=10)
+    cache.put_many({"a": [["nlp", 0.9]]})
+
+    assert cache.get_many(["a", "b"]) == {"a": [["nlp", 0.9]]}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_least_recently_used_results_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(extraction_cache.time, "time", lambda: next(clock))
+    cache = ExtractionCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put_many({"a": [], "b": []})
+    cache.get_many(["a"])
+    cache.put_many({"c": []})
+
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["entries"] == 2
+
+
+def test_key_ignores_whitespace_but_not_parameters():
+    key = make_key("keybert", "1", {"top_n": 5}, "Machine  learning ")
+
+    assert key == make_key("keybert", "1", {"top_n": 5}, "Machine learning")
+    assert key != make_key("keybert", "1", {"top_n": 3}, "Machine learning")
+    assert key != make_key("keybert", "2", {"top_n": 5}, "Machine learning")
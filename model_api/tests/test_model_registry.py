@@ -0,0 +1,54 @@
+import model_registry
+from model_registry import MEGABYTE, ModelRegistry
+
+
+def test_room_is_made_before_the_first_load():
+    registry = ModelRegistry(memory_budget_bytes=100 * MEGABYTE)
+    resident_while_loading = []
+
+    def load(version):
+        resident_while_loading.append(sorted(registry.resident_handles()))
+        return b"1" * (60 * MEGABYTE)
+
+    registry.register("first", load, "1", memory_mb=60)
+    registry.register("second", load, "1", memory_mb=60)
+    registry.get("first")
+    registry.get("second")
+
+    # "first" was evicted before "second" was loaded
+    assert resident_while_loading[-1] == []
+
+
+def test_configured_estimate_overrides_the_registered_one():
+    registry = ModelRegistry(memory_estimates={"model": 10 * MEGABYTE})
+    registry.register("model", lambda version: version, "1", memory_mb=80)
+
+    assert registry.estimate_memory_bytes("model", "1") == 10 * MEGABYTE
+
+
+def test_estimate_from_checkpoint_on_disk(tmp_path):
+    (tmp_path / "weights.bin").write_bytes(b"0" * 1000)
+    registry = ModelRegistry()
+    registry.register("model", lambda version: version, str(tmp_path))
+
+    assert registry.estimate_memory_bytes("model", str(tmp_path)) == 1000
+    assert registry.estimate_memory_bytes("model", "unknown") == 0
+
+
+def test_split_memory_estimates():
+    assert model_registry._split_memory_estimates(
+        "bloom:2, gpt_neo:large:3") == {"bloom": 2 * MEGABYTE,
+                                        ("gpt_neo", "large"): 3 * MEGABYTE}
+
+
+def test_acquire_pins_the_default_version():
+    registry = ModelRegistry()
+    registry.register("model", lambda version: version, "1")
+
+    version = registry.acquire("model")
+    registry.set_default_version("model", "2")
+
+    assert version == "1"
+    assert registry.acquire("model") == "2"
+    with registry.use("model", "3") as used:
+        assert used == "3"
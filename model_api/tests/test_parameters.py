@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # noqa: E402
+
+from model_api import check_parameters  # noqa: E402
+from models import BATCH_EXTRACTORS  # noqa: E402
+
+
+@pytest.mark.parametrize("parameters", [
+    {},
+    {"max_competencies": 3, "diversity": 1, "use_mmr": False},
+    {"keyphrase_ngram_range": [1, 3]},
+])
+def test_valid_parameters_are_accepted(parameters):
+    check_parameters(BATCH_EXTRACTORS["keybert"], parameters, "keybert")
+
+
+@pytest.mark.parametrize("parameters", [
+    {"max_competencies": "x"},
+    {"use_mmr": 1},
+    {"keyphrase_ngram_range": ["a", 2]},
+    {"keyphrase_ngram_range": [1]},
+    {"max_competencies": -1},
+    {"batch_size": 0},
+    {"model_version": ["a"]},
+    {"unknown": 1},
+    {"on_competency": None},
+])
+def test_invalid_parameters_are_rejected_with_422(parameters):
+    with pytest.raises(HTTPException) as error:
+        check_parameters(BATCH_EXTRACTORS["keybert"], parameters, "keybert")
+    assert error.value.status_code == 422
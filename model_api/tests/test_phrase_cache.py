@@ -0,0 +1,68 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from phrase_cache import PhraseEmbeddingCache  # noqa: E402
+
+
+class CountingEncoder:
+    """Embeds a phrase as [length, number of words] and counts phrases."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed(self, phrases):
+        self.embedded.extend(phrases)
+        return [[len(phrase), len(phrase.split())] for phrase in phrases]
+
+
+def test_phrases_are_embedded_once(tmp_path):
+    encoder = CountingEncoder()
+    cache = PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                                 disk_entries=10)
+    first = cache.embed(["deep learning", "nlp", "nlp"], encoder)
+    second = cache.embed(["nlp", "deep learning"], encoder)
+
+    assert encoder.embedded == ["deep learning", "nlp"]
+    assert first.tolist() == [[13, 2], [3, 1], [3, 1]]
+    assert second.tolist() == [[3, 1], [13, 2]]
+    assert cache.stats()["hits"] == 3
+
+
+def test_embeddings_are_read_from_disk(tmp_path):
+    PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                         disk_entries=10).embed(["nlp"], CountingEncoder())
+
+    encoder = CountingEncoder()
+    cache = PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                                 disk_entries=10)
+
+    assert cache.embed(["nlp"], encoder).tolist() == [[3, 1]]
+    assert encoder.embedded == []
+
+
+def test_processes_sharing_the_files_use_separate_rows(tmp_path):
+    first = PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                                 disk_entries=10)
+    second = PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                                  disk_entries=10)
+    first.embed(["nlp"], CountingEncoder())
+    second.embed(["machine learning"], CountingEncoder())
+
+    encoder = CountingEncoder()
+    reader = PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                                  disk_entries=10)
+    embeddings = reader.embed(["nlp", "machine learning"], encoder)
+
+    assert embeddings.tolist() == [[3, 1], [16, 2]]
+    assert encoder.embedded == []
+
+
+def test_disk_entries_are_limited(tmp_path):
+    cache = PhraseEmbeddingCache(str(tmp_path), memory_entries=10,
+                                 disk_entries=1)
+    cache.embed(["nlp", "deep learning"], CountingEncoder())
+
+    assert cache.stats()["disk_entries"] == 1
+    # Phrases that don't fit on disk are kept in memory
+    assert cache.stats()["memory_entries"] == 2
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+import pytest
+
+from scheduler import (REASON_QUEUE_FULL, REASON_TOO_MANY_QUEUES,
+                       InferenceScheduler, SchedulerOverloadedError)
+
+
+def _make_scheduler(**kwargs) -> InferenceScheduler:
+    return InferenceScheduler({}, window_seconds=0.001, max_batch_size=4,
+                              **kwargs)
+
+
+def test_call_leaves_the_lane_when_done():
+    scheduler = _make_scheduler(max_queue_depth=4)
+    assert scheduler.call("test_done", len, "abc").result(timeout=5) == 3
+    assert scheduler._depths["test_done", "interactive"] == 0
+
+
+def test_failed_call_leaves_the_lane():
+    scheduler = _make_scheduler(max_queue_depth=4)
+
+    def fail():
+        raise ValueError("model failed")
+
+    with pytest.raises(ValueError):
+        scheduler.call("test_failed", fail).result(timeout=5)
+    assert scheduler._depths["test_failed", "interactive"] == 0
+
+
+def test_cancelled_call_leaves_the_lane():
+    scheduler = _make_scheduler(max_queue_depth=4)
+    release = threading.Event()
+
+    async def run():
+        # The first call occupies the model, so the second one waits
+        running = asyncio.ensure_future(asyncio.wrap_future(
+            scheduler.call("test_cancel", release.wait, 5)))
+        waiting = asyncio.ensure_future(asyncio.wrap_future(
+            scheduler.call("test_cancel", len, "abc")))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        await asyncio.sleep(0.05)
+        release.set()
+        await running
+
+    asyncio.run(run())
+    assert scheduler._depths["test_cancel", "interactive"] == 0
+
+
+def test_full_lane_rejects_calls():
+    scheduler = _make_scheduler(max_queue_depth=1)
+    release = threading.Event()
+    running = scheduler.call("test_full", release.wait, 5)
+    try:
+        with pytest.raises(SchedulerOverloadedError) as error:
+            scheduler.call("test_full", len, "abc")
+        assert error.value.retry_after >= 1
+        with pytest.raises(SchedulerOverloadedError):
+            scheduler.check("test_full")
+        # Bulk requests have a lane of their own
+        scheduler.check("test_full", lane="bulk")
+    finally:
+        release.set()
+    running.result(timeout=5)
+
+
+def test_full_lane_rejects_abstracts():
+    release = threading.Event()
+
+    def extract(abstracts):
+        release.wait(5)
+        return [[] for _ in abstracts]
+
+    scheduler = InferenceScheduler({"test_submit": extract},
+                                   window_seconds=0.001, max_batch_size=4,
+                                   max_queue_depth=2)
+    futures = scheduler.submit("test_submit", ["a", "b"])
+    try:
+        with pytest.raises(SchedulerOverloadedError) as error:
+            scheduler.submit("test_submit", ["c"])
+        assert error.value.retry_after >= 1
+        rejections = scheduler.stats()["rejections"]["test_submit"]
+        assert rejections == {REASON_QUEUE_FULL: 1}
+    finally:
+        release.set()
+    assert [future.result(timeout=5) for future in futures] == [[], []]
+    assert scheduler._depths["test_submit", "interactive"] == 0
+
+
+def test_too_many_parameter_sets_are_rejected():
+    def extract(abstracts, diversity):
+        return [[] for _ in abstracts]
+
+    scheduler = InferenceScheduler({"test_queues": extract},
+                                   window_seconds=0.001, max_batch_size=4,
+                                   max_queues=1, idle_seconds=60)
+    first = scheduler.submit("test_queues", ["a"], {"diversity": 0.5})
+    assert first[0].result(timeout=5) == []
+
+    with pytest.raises(SchedulerOverloadedError):
+        scheduler.submit("test_queues", ["a"], {"diversity": 0.7})
+    rejections = scheduler.stats()["rejections"]["test_queues"]
+    assert rejections == {REASON_TOO_MANY_QUEUES: 1}
+
+    # The parameters of the queue are still accepted
+    second = scheduler.submit("test_queues", ["b"], {"diversity": 0.5})
+    assert second[0].result(timeout=5) == []
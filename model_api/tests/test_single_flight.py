@@ -0,0 +1,83 @@
+import asyncio
+from concurrent.futures import Future
+
+import extraction
+from single_flight import SingleFlight
+
+
+def test_duplicates_share_the_result():
+    flight = SingleFlight()
+    first, started = flight.join("keybert", ["a", "b"])
+    second, started_again = flight.join("keybert", ["a"])
+    assert started == ["a", "b"]
+    assert started_again == []
+
+    flight.finish("keybert", "a", result=[("nlp", 0.9)])
+    assert first["a"].result() == [("nlp", 0.9)]
+    assert second["a"].result() == [("nlp", 0.9)]
+    assert not first["b"].done()
+
+
+def test_error_is_shared():
+    flight = SingleFlight()
+    first, _ = flight.join("keybert", ["a"])
+    second, _ = flight.join("keybert", ["a"])
+    flight.finish("keybert", "a", error=ValueError("model failed"))
+    for futures in (first, second):
+        assert isinstance(futures["a"].exception(), ValueError)
+
+
+def test_finished_key_starts_a_new_computation():
+    flight = SingleFlight()
+    flight.join("keybert", ["a"])
+    flight.finish("keybert", "a", result=1)
+    _, started = flight.join("keybert", ["a"])
+    assert started == ["a"]
+
+
+def test_finishing_twice_does_nothing():
+    flight = SingleFlight()
+    futures, _ = flight.join("keybert", ["a"])
+    flight.finish("keybert", "a", result=1)
+    flight.finish("keybert", "a", result=2)
+    assert futures["a"].result() == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_duplicates():
+    flight = SingleFlight()
+
+    async def run():
+        first, _ = flight.join("keybert", ["a"])
+        second, _ = flight.join("keybert", ["a"])
+        cancelled = asyncio.ensure_future(asyncio.wrap_future(first["a"]))
+        waiting = asyncio.ensure_future(asyncio.wrap_future(second["a"]))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        flight.finish("keybert", "a", result=[("nlp", 0.9)])
+        assert await waiting == [("nlp", 0.9)]
+        assert first["a"].cancelled()
+
+    asyncio.run(run())
+
+
+def test_cancelled_extraction_does_not_strand_other_keys(monkeypatch):
+    stored = {}
+    monkeypatch.setattr(extraction.cache, "put_many", stored.update)
+    flight = SingleFlight()
+    monkeypatch.setattr(extraction, "in_flight", flight)
+
+    waiting, _ = flight.join("keybert", ["a", "b"])
+    cancelled = Future()
+    cancelled.cancel()
+    computed = Future()
+    computed.set_result([("nlp", 0.9)])
+    extraction._finish("keybert", ["a", "b"], [cancelled, computed])
+
+    assert stored == {"b": [("nlp", 0.9)]}
+    assert waiting["a"].exception() is not None
+    assert waiting["b"].result() == [("nlp", 0.9)]
+    # Both keys left the flight, so new requests compute them again
+    _, started = flight.join("keybert", ["a", "b"])
+    assert started == ["a", "b"]